@@ -1,11 +1,12 @@
 import time
 import json
 import socket
-import subprocess
 import threading
 from zeroconf import Zeroconf, ServiceInfo, ServiceBrowser
 from flask import Flask, jsonify, send_from_directory
 
+from phone_metrics import PhoneMetrics
+
 # ----------------------------
 # DEVICE CONFIG
 # ----------------------------
@@ -23,6 +24,9 @@ STALE_TIME = 60
 DISCOVERED_NODES = {}
 NODES_LOCK = threading.Lock()
 
+# /proc + /sys readings shared by /info and the advertiser (see phone_metrics.py)
+PHONE_METRICS = PhoneMetrics()
+
 app = Flask(__name__, static_folder="static", static_url_path="")
 
 # ----------------------------
@@ -41,27 +45,14 @@ def get_local_ip():
 
 
 def get_battery():
-    """Termux-only battery API"""
-    try:
-        out = subprocess.check_output(["termux-battery-status"])
-        data = json.loads(out.decode())
-        return data.get("percentage")
-    except Exception:
-        return None
+    """Battery % (sysfs, cached; termux-battery-status only as a fallback)"""
+    return PHONE_METRICS.battery()
 
 
 def get_cpu():
-    """Termux-friendly CPU usage"""
-    try:
-        out = subprocess.check_output("top -bn1 | head -n 5", shell=True)
-        text = out.decode().lower()
-        for line in text.splitlines():
-            if "%cpu" in line:
-                num = "".join(ch for ch in line if ch.isdigit() or ch == ".")
-                return float(num) if num else 0.0
-        return 0.0
-    except Exception:
-        return 0.0
+    """CPU % from /proc/stat (cached; `top` only as a fallback)"""
+    cpu = PHONE_METRICS.cpu()
+    return cpu if cpu is not None else 0.0
 
 
 def compute_health(cpu, battery, load):
@@ -1,11 +1,13 @@
 import time
 import json
 import socket
-import subprocess
 import threading
 import requests
+from requests.adapters import HTTPAdapter
 from zeroconf import Zeroconf, ServiceInfo, ServiceBrowser
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory
+
+from phone_metrics import PhoneMetrics
 
 # ----------------------------
 # DEVICE CONFIG (PHONE CLIENT)
@@ -22,6 +24,13 @@ current_load = 0
 CLUSTER_ENTRY = "http://192.168.0.105:5001"
 USER_TOKEN = "testtoken123"
 
+# keep-alive connection pool towards the cluster entry
+# (separate connect / read timeouts: fail fast if the laptop is gone,
+#  but give long LLM pipelines time to finish)
+CLUSTER_POOL_SIZE = 4
+CLUSTER_CONNECT_TIMEOUT = 3
+CLUSTER_READ_TIMEOUT = 60
+
 # remove nodes after stale time
 STALE_TIME = 60
 
@@ -29,6 +38,15 @@ STALE_TIME = 60
 DISCOVERED_NODES = {}
 NODES_LOCK = threading.Lock()
 
+# /proc + /sys readings shared by /info and the advertiser (see phone_metrics.py)
+PHONE_METRICS = PhoneMetrics()
+
+# one pooled session reused by every proxied request
+CLUSTER_SESSION = requests.Session()
+CLUSTER_SESSION.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=CLUSTER_POOL_SIZE))
+CLUSTER_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=CLUSTER_POOL_SIZE))
+proxied_requests = 0
+
 # static folder = frontend
 app = Flask(__name__, static_folder="static", static_url_path="")
 
@@ -49,27 +67,14 @@ def get_local_ip():
 
 
 def get_battery():
-    """Termux-only battery API"""
-    try:
-        out = subprocess.check_output(["termux-battery-status"])
-        data = json.loads(out.decode())
-        return data.get("percentage")
-    except Exception:
-        return None
+    """Battery % (sysfs, cached; termux-battery-status only as a fallback)"""
+    return PHONE_METRICS.battery()
 
 
 def get_cpu():
-    """Termux-friendly CPU usage"""
-    try:
-        out = subprocess.check_output("top -bn1 | head -n 5", shell=True)
-        text = out.decode().lower()
-        for line in text.splitlines():
-            if "%cpu" in line:
-                num = "".join(ch for ch in line if ch.isdigit() or ch == ".")
-                return float(num) if num else 0.0
-        return 0.0
-    except Exception:
-        return 0.0
+    """CPU % from /proc/stat (cached; `top` only as a fallback)"""
+    cpu = PHONE_METRICS.cpu()
+    return cpu if cpu is not None else 0.0
 
 
 def compute_health(cpu, battery, load):
@@ -259,18 +264,43 @@ def get_nodes():
 @app.post("/task")
 def proxy_task():
     """Send tasks from phone to the real cluster node."""
+    global proxied_requests
+    proxied_requests += 1
     try:
-        r = requests.post(
+        r = CLUSTER_SESSION.post(
             f"{CLUSTER_ENTRY}/task",
             json=request.json,
             headers={"X-User-Token": USER_TOKEN},
-            timeout=60
+            timeout=(CLUSTER_CONNECT_TIMEOUT, CLUSTER_READ_TIMEOUT),
         )
         return (r.json(), r.status_code)
     except Exception as e:
         return {"error": "cluster unreachable", "detail": str(e)}, 500
 
 
+@app.get("/pool_stats")
+def pool_stats():
+    """Connection reuse towards CLUSTER_ENTRY."""
+    new_conns = reqs = open_conns = 0
+    pools = CLUSTER_SESSION.get_adapter(CLUSTER_ENTRY).poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None or pool.pool is None:
+            continue
+        new_conns += pool.num_connections
+        reqs += pool.num_requests
+        idle = sum(1 for c in list(pool.pool.queue) if c is not None)
+        open_conns += idle + (pool.pool.maxsize - pool.pool.qsize())
+
+    return jsonify({
+        "cluster_entry": CLUSTER_ENTRY,
+        "requests": proxied_requests,
+        "new_connections": new_conns,
+        "reuse_rate": round(1.0 - new_conns / reqs, 3) if reqs else None,
+        "open_connections": open_conns,
+    })
+
+
 @app.route("/<path:path>")
 def serve_static(path):
     return send_from_directory("static", path)
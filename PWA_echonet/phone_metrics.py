@@ -0,0 +1,206 @@
+"""
+Cheap CPU / battery readings for the phone nodes (app.py, net_phone.py).
+
+CPU comes from /proc/stat (busy share of the jiffies since the previous reading) and the battery
+from /sys/class/power_supply/*/capacity, read directly without starting any process. Readings
+are cached: CPU for CPU_INTERVAL seconds, battery for BATTERY_INTERVAL seconds (it changes slowly),
+so /info polled by several PWA tabs plus the advertiser tick share one reading.
+
+Only when those files cannot be read (newer Android versions hide /proc/stat from apps) does it
+fall back to the old `top -bn1` / `termux-battery-status` subprocesses, still cached.
+
+    python phone_metrics.py      # measure the CPU cost of both ways on this device
+"""
+
+import glob
+import json
+import os
+import subprocess
+import threading
+import time
+
+CPU_INTERVAL = float(os.getenv("PHONE_CPU_INTERVAL", "2"))
+BATTERY_INTERVAL = float(os.getenv("PHONE_BATTERY_INTERVAL", "60"))
+
+
+def read_proc_stat(path="/proc/stat"):
+    """(busy, total) jiffies of the aggregate `cpu` line, or None if unreadable."""
+    try:
+        with open(path, "rb") as f:
+            line = f.readline().split()
+    except OSError:
+        return None
+    if not line or line[0] != b"cpu":
+        return None
+    values = [int(v) for v in line[1:9]]  # user nice system idle iowait irq softirq steal
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    total = sum(values)
+    return total - idle, total
+
+
+def find_battery_file(root="/sys/class/power_supply"):
+    """Path of the first battery `capacity` file, or None."""
+    for supply in sorted(glob.glob(os.path.join(root, "*"))):
+        try:
+            with open(os.path.join(supply, "type")) as f:
+                if f.read().strip().lower() != "battery":
+                    continue
+        except OSError:
+            continue
+        capacity = os.path.join(supply, "capacity")
+        if os.access(capacity, os.R_OK):
+            return capacity
+    return None
+
+
+def read_power_mw(capacity_file):
+    """Instantaneous battery power draw in mW from current_now/voltage_now next to capacity_file, or None."""
+    if not capacity_file:
+        return None
+    supply = os.path.dirname(capacity_file)
+    try:
+        with open(os.path.join(supply, "current_now")) as f:
+            current = abs(float(f.read()))  # µA
+        with open(os.path.join(supply, "voltage_now")) as f:
+            voltage = float(f.read())  # µV
+    except (OSError, ValueError):
+        return None
+    return current * voltage / 1e9
+
+
+def top_cpu():
+    """Old way: parse `top -bn1` (one shell + top process per call)."""
+    try:
+        out = subprocess.check_output("top -bn1 | head -n 5", shell=True)
+        text = out.decode().lower()
+        for line in text.splitlines():
+            if "%cpu" in line:
+                num = "".join(ch for ch in line if ch.isdigit() or ch == ".")
+                return float(num) if num else 0.0
+        return 0.0
+    except Exception:
+        return 0.0
+
+
+def termux_battery():
+    """Old way: Termux battery API (starts a process that talks to the Termux:API app)."""
+    try:
+        out = subprocess.check_output(["termux-battery-status"])
+        return json.loads(out.decode()).get("percentage")
+    except Exception:
+        return None
+
+
+class PhoneMetrics:
+    """Cached CPU% / battery% readings from /proc and /sys, with subprocess fallbacks."""
+
+    def __init__(self, cpu_interval=CPU_INTERVAL, battery_interval=BATTERY_INTERVAL):
+        self.cpu_interval = cpu_interval
+        self.battery_interval = battery_interval
+        self._lock = threading.Lock()
+        self._prev = read_proc_stat()
+        self.cpu_source = "proc" if self._prev is not None else "top"
+        self._battery_file = find_battery_file()
+        self.battery_source = "sysfs" if self._battery_file else "termux"
+        self._cpu = (0.0, 0.0)  # (value, read at)
+        self._battery = (None, 0.0)
+        self.reads = 0
+        self.subprocess_calls = 0
+
+    def _read_cpu(self):
+        if self.cpu_source == "proc":
+            cur = read_proc_stat()
+            if cur is not None:
+                prev, self._prev = self._prev, cur
+                busy, total = cur[0] - prev[0], cur[1] - prev[1]
+                return round(100.0 * busy / total, 1) if total > 0 else self._cpu[0]
+            self.cpu_source = "top"
+        self.subprocess_calls += 1
+        return top_cpu()
+
+    def _read_battery(self):
+        if self._battery_file:
+            try:
+                with open(self._battery_file) as f:
+                    return float(f.read().strip())
+            except (OSError, ValueError):
+                self._battery_file = None
+                self.battery_source = "termux"
+        self.subprocess_calls += 1
+        return termux_battery()
+
+    def cpu(self):
+        with self._lock:
+            value, at = self._cpu
+            now = time.monotonic()
+            if not at or now - at >= self.cpu_interval:
+                self.reads += 1
+                value = self._read_cpu()
+                self._cpu = (value, now)
+            return value
+
+    def battery(self):
+        with self._lock:
+            value, at = self._battery
+            now = time.monotonic()
+            if not at or now - at >= self.battery_interval:
+                value = self._read_battery()
+                self._battery = (value, now)
+            return value
+
+    def stats(self):
+        return {"cpu_source": self.cpu_source, "battery_source": self.battery_source,
+                "cpu_interval": self.cpu_interval, "battery_interval": self.battery_interval,
+                "reads": self.reads, "subprocess_calls": self.subprocess_calls}
+
+
+def _cpu_seconds():
+    """CPU time used by this process and its finished children (the subprocesses)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _bench(label, fn, calls, battery_file=None):
+    power = []
+    started, cpu = time.perf_counter(), _cpu_seconds()
+    for _ in range(calls):
+        fn()
+        mw = read_power_mw(battery_file)
+        if mw is not None:
+            power.append(mw)
+    wall, cpu = time.perf_counter() - started, _cpu_seconds() - cpu
+    line = f"{label:<34} {wall / calls * 1000:9.2f} ms wall  {cpu / calls * 1000:9.2f} ms CPU per call"
+    if power:
+        line += f"  {sum(power) / len(power):8.0f} mW battery draw"
+    print(line)
+    return cpu / calls
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure the cost of collecting phone metrics.")
+    parser.add_argument("-n", type=int, default=50, help="calls per method (default 50)")
+    parser.add_argument("--tabs", type=int, default=1, help="open PWA tabs polling /info every 2 s")
+    args = parser.parse_args()
+
+    m = PhoneMetrics(cpu_interval=0, battery_interval=0)
+    battery_file = find_battery_file()
+    print(f"sources: cpu={m.cpu_source} battery={m.battery_source}\n")
+    old = _bench("subprocess (top + termux-battery)", lambda: (top_cpu(), termux_battery()), args.n, battery_file)
+    raw = _bench("/proc + /sys, uncached", lambda: (m.cpu(), m.battery()), args.n, battery_file)
+    cached = PhoneMetrics()
+    _bench("/proc + /sys, cached", lambda: (cached.cpu(), cached.battery()), args.n, battery_file)
+
+    # 每个标签页每 2 秒请求一次 /info，广播每 3 秒一次；缓存后每 CPU_INTERVAL 秒最多真正读一次
+    calls_per_hour = 3600 * (args.tabs / 2.0 + 1 / 3.0)
+    reads_per_hour = 3600 / max(CPU_INTERVAL, 1e-3)
+    print(f"\nper hour with {args.tabs} tab(s): {calls_per_hour:.0f} metric requests")
+    print(f"  subprocess, every request   {old * calls_per_hour:8.1f} CPU seconds")
+    print(f"  /proc + /sys, cached        {raw * min(calls_per_hour, reads_per_hour):8.1f} CPU seconds")
+    print("mW figures are whole-device draw while each method runs (only where current_now is readable);")
+    print("the saved CPU seconds are what the monitoring no longer takes from the battery")
+
+
+if __name__ == "__main__":
+    main()
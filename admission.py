@@ -0,0 +1,197 @@
+"""
+Admission control for skill executions on one node.
+
+最多 MAX_CONCURRENCY 个 step 同时执行，另有最多 ADMISSION_QUEUE_MAX 个请求排队等待空位
+（每个最多等 ADMISSION_QUEUE_TIMEOUT 秒）。队列满或等待超时抛出 Overloaded，
+HTTP 层据此返回 429 + Retry-After；Retry-After 按最近 step 耗时的滑动平均和排队长度估算。
+排队的 step 按用户做加权公平调度（start-time fair queuing），空出的名额优先给虚拟时间最小的用户。
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+
+class Overloaded(Exception):
+    """No execution slot is available; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int, reason: str = "node overloaded"):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class VirtualClock:
+    """Start-time fair queuing tags. Not thread-safe; callers hold their own lock."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._finish: Dict[Any, float] = {}
+
+    def tag(self, user: Any, weight: float) -> float:
+        start = max(self.now, self._finish.get(user, 0.0))
+        self._finish[user] = start + 1.0 / weight
+        return start
+
+    def advance(self, tag: float) -> None:
+        self.now = max(self.now, tag)
+
+
+class AdmissionController:
+    """Bounded concurrency plus a bounded, time-limited, per-user fair wait queue."""
+
+    def __init__(self, max_concurrency: Optional[int] = None, queue_max: Optional[int] = None,
+                 queue_timeout: Optional[float] = None):
+        self.max_concurrency = max(1, int(max_concurrency if max_concurrency is not None else os.getenv("MAX_CONCURRENCY", "16")))
+        self.queue_max = max(0, int(queue_max if queue_max is not None else os.getenv("ADMISSION_QUEUE_MAX", "32")))
+        self.queue_timeout = float(queue_timeout if queue_timeout is not None else os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+        self._cond = threading.Condition()
+        self._clock = VirtualClock()
+        self._waiters = []  # [tag, seq, user, granted, wake]；wake 用于唤醒协程等待者
+        self._seq = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._avg_duration = 1.0  # 秒，EWMA
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def acquire(self, bounded: bool = True, user: Any = None, weight: float = 1.0,
+                timeout: Optional[float] = None) -> float:
+        """Take an execution slot, waiting in the queue if needed; returns the start time.
+
+        bounded=False waits without the queue limit or timeout (steps this node runs as
+        coordinator must not be dropped half way through a pipeline). `timeout` (the
+        caller's remaining deadline) caps the wait either way. Raises Overloaded.
+        """
+        with self._cond:
+            waiter, limit = self._enter(bounded, user, weight, timeout)
+            if waiter is None:
+                return time.monotonic()
+            ok = self._cond.wait_for(lambda: waiter[3], timeout=limit)
+            if not ok:
+                self._timed_out(waiter)
+            self.admitted += 1
+        return time.monotonic()
+
+    async def acquire_async(self, bounded: bool = True, user: Any = None, weight: float = 1.0,
+                            timeout: Optional[float] = None) -> float:
+        """acquire() for coroutines: waits in the same fair queue without blocking a thread."""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        with self._cond:
+            waiter, limit = self._enter(bounded, user, weight, timeout, wake)
+            if waiter is None:
+                return time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), limit)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._cond:
+                if not waiter[3]:
+                    if isinstance(e, asyncio.CancelledError):
+                        self._waiters.remove(waiter)
+                        raise
+                    self._timed_out(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                # 名额刚好在取消时分到：交还给下一个等待者
+                self.release()
+                raise
+        with self._cond:
+            self.admitted += 1
+        return time.monotonic()
+
+    def _enter(self, bounded, user, weight, timeout, wake=None):
+        """Admit at once (returns (None, None)) or queue a waiter; returns it and its wait limit.
+
+        Caller holds self._cond.
+        """
+        if self.running < self.max_concurrency and not self._waiters:
+            self.running += 1
+            self.admitted += 1
+            return None, None
+        if bounded and len(self._waiters) >= self.queue_max:
+            self.rejected += 1
+            raise Overloaded(self._retry_after(), "admission queue full")
+        self._seq += 1
+        waiter = [self._clock.tag(user, weight), self._seq, user, False, wake]
+        self._waiters.append(waiter)
+        limit = self.queue_timeout if bounded else None
+        if timeout is not None:
+            limit = max(0.0, timeout if limit is None else min(limit, timeout))
+        return waiter, limit
+
+    def _timed_out(self, waiter) -> None:
+        self._waiters.remove(waiter)
+        self.rejected += 1
+        self.timed_out += 1
+        raise Overloaded(self._retry_after(), "timed out waiting for an execution slot")
+
+    def release(self, started: Optional[float] = None) -> None:
+        with self._cond:
+            if started is not None:
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - started)
+            if self._waiters:
+                # 名额直接交给虚拟时间最小的等待者（running 不变）
+                waiter = min(self._waiters, key=lambda w: (w[0], w[1]))
+                self._waiters.remove(waiter)
+                self._clock.advance(waiter[0])
+                waiter[3] = True
+                self._cond.notify_all()
+                if waiter[4] is not None:
+                    waiter[4]()
+            else:
+                self.running = max(0, self.running - 1)
+
+    @contextmanager
+    def slot(self, bounded: bool = True, user: Any = None, weight: float = 1.0, timeout: Optional[float] = None):
+        started = self.acquire(bounded, user, weight, timeout)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def _retry_after(self) -> int:
+        # 粗略估计：排在前面的请求按 max_concurrency 路并行、每个耗时约为平均 step 时长
+        waves = (len(self._waiters) + 1) / self.max_concurrency
+        return max(1, min(60, math.ceil(self._avg_duration * waves)))
+
+    def retry_after(self) -> int:
+        with self._cond:
+            return self._retry_after()
+
+    def snapshot(self):
+        """(running, queued) right now."""
+        with self._cond:
+            return self.running, len(self._waiters)
+
+    def queued_by_user(self) -> Dict[Any, int]:
+        with self._cond:
+            out: Dict[Any, int] = {}
+            for w in self._waiters:
+                out[w[2]] = out.get(w[2], 0) + 1
+            return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "queue_max": self.queue_max,
+                "queue_timeout": self.queue_timeout,
+                "running": self.running,
+                "queued": len(self._waiters),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "avg_step_seconds": round(self._avg_duration, 3),
+            }
@@ -0,0 +1,97 @@
+"""
+Benchmark the node-to-node wire codecs (wire_codec.py) on realistic pipeline states.
+
+对每种 state 比较 JSON / MessagePack，以及不压缩 / gzip / zstd 的编码耗时、解码耗时和传输字节数。
+
+    python bench_codec.py            # 默认每组 200 次
+    python bench_codec.py -n 1000
+"""
+
+import argparse
+import random
+import time
+
+import wire_codec
+
+_WORDS = ("autumn leaves drift over silent water while the moon keeps its quiet watch "
+          "and every lantern in the harbor remembers a song the sailors forgot").split()
+_HANZI = "秋叶飘落静水之上明月守望港口灯火记得水手遗忘的歌声风起云涌山高水长"
+
+
+def _english(rng, words):
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _chinese(rng, chars):
+    return "".join(rng.choice(_HANZI) for _ in range(chars))
+
+
+def realistic_states(seed=7):
+    rng = random.Random(seed)
+    poem = {
+        "english_poem": _english(rng, 120),
+        "chinese_poem": _chinese(rng, 160),
+    }
+    fan_out = {f"r{i}": {"output": _english(rng, 300)} for i in range(5)}
+    fan_out["ai_result"] = {"output": _english(rng, 200)}
+    document = {
+        "command": "Summarize the attached report and translate the summary into Chinese",
+        "document": "\n".join(_english(rng, 80) for _ in range(60)),
+        "ai_result": {"output": _english(rng, 250)},
+        "chinese_poem": _chinese(rng, 400),
+    }
+    batch = {"poems": [{"english_poem": _english(rng, 60), "chinese_poem": _chinese(rng, 80)} for _ in range(100)]}
+    return {
+        "poem (2 steps)": poem,
+        "fan-out (6 ai_execute)": fan_out,
+        "document (~30 KB)": document,
+        "batch (100 poems)": batch,
+    }
+
+
+def _variants():
+    formats = [("json", wire_codec.JSON)]
+    if wire_codec.msgpack is not None:
+        formats.append(("msgpack", wire_codec.MSGPACK))
+    encodings = ["identity", "gzip"]
+    if wire_codec.zstandard is not None:
+        encodings.append("zstd")
+    for fname, ctype in formats:
+        for enc in encodings:
+            yield f"{fname}+{enc}" if enc != "identity" else fname, ctype, enc
+
+
+def bench(state, ctype, enc, n):
+    t0 = time.perf_counter()
+    for _ in range(n):
+        body = wire_codec.compress(wire_codec.dumps(state, ctype), enc)
+    t1 = time.perf_counter()
+    for _ in range(n):
+        out = wire_codec.loads(wire_codec.decompress(body, enc), ctype)
+    t2 = time.perf_counter()
+    assert out == state
+    return len(body), (t1 - t0) / n * 1e6, (t2 - t1) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=200, help="iterations per measurement")
+    args = parser.parse_args()
+
+    if wire_codec.msgpack is None:
+        print("⚠️ msgpack not installed; only JSON is benchmarked (pip install msgpack)")
+    if wire_codec.zstandard is None:
+        print("⚠️ zstandard not installed; zstd is skipped (pip install zstandard)")
+
+    for name, state in realistic_states().items():
+        print(f"\n== {name} ==")
+        print(f"{'codec':<16}{'bytes':>10}{'vs json':>9}{'encode us':>12}{'decode us':>12}")
+        baseline = None
+        for label, ctype, enc in _variants():
+            size, enc_us, dec_us = bench(state, ctype, enc, args.n)
+            baseline = baseline or size
+            print(f"{label:<16}{size:>10}{size / baseline:>8.0%}{enc_us:>12.1f}{dec_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Per-peer circuit breakers for node-to-node calls.
+
+每个对端（scheme://host:port）一个断路器：
+
+- closed     正常放行。最近 window 次调用中失败（连接失败、超时、5xx，或慢调用）的比例达到 error_rate
+             （且至少有 min_calls 次调用），或连续失败 consecutive 次，就打开。
+             慢调用按对端自己的耗时判断：超过该对端同一路由最近成功调用 p95 的 slow_factor 倍
+             （且不少于 slow_min 秒）；设置了 slow_call 时改用这个固定阈值。
+- open       直接拒绝（CircuitOpen），不再等对端超时；open_seconds 秒后进入 half_open。
+             连续多次打开时冷却时间翻倍，最多 max_open_seconds。
+- half_open  只放行一个探测请求：成功则关闭并清空统计，失败则重新打开。
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """The peer's circuit is open; the call was not attempted."""
+
+    def __init__(self, peer: str, retry_in: float):
+        super().__init__(f"circuit open for {peer}; retry in {retry_in:.0f}s")
+        self.peer = peer
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by error rate, consecutive failures and latency."""
+
+    def __init__(self, window: int = 20, min_calls: int = 5, error_rate: float = 0.5, consecutive: int = 3,
+                 slow_call: Optional[float] = None, open_seconds: float = 15.0, max_open_seconds: float = 300.0,
+                 slow_factor: float = 4.0, slow_min: float = 5.0, latency_window: int = 100):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.consecutive = consecutive
+        self.slow_call = slow_call
+        self.slow_factor = slow_factor
+        self.slow_min = slow_min
+        self.latency_window = latency_window
+        self._latency: Dict[str, deque] = {}  # 路由 -> 最近成功调用的耗时（秒）
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = CLOSED
+        self._calls = deque(maxlen=window)  # True = 失败
+        self._streak = 0
+        self._trips = 0  # 连续打开的次数（决定冷却时长）
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+
+    def _cooldown(self) -> float:
+        return min(self.max_open_seconds, self.open_seconds * (2 ** max(0, self._trips - 1)))
+
+    def retry_in(self, now: float) -> float:
+        return max(0.0, self._opened_at + self._cooldown() - now) if self.state == OPEN else 0.0
+
+    def available(self, now: float) -> bool:
+        """Would a call be let through right now? (Does not reserve the half-open probe.)"""
+        if self.state == OPEN:
+            return self.retry_in(now) <= 0
+        if self.state == HALF_OPEN:
+            return not self._probing
+        return True
+
+    def allow(self, now: float) -> bool:
+        if self.state == OPEN and self.retry_in(now) <= 0:
+            self.state = HALF_OPEN
+            self._probing = False
+        if self.state == HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+            return True
+        if self.state == OPEN:
+            self.rejected += 1
+            return False
+        return True
+
+    def slow_threshold(self, route: str = "") -> Optional[float]:
+        """Seconds above which a successful call to `route` counts as a failure (None: not enough samples)."""
+        if self.slow_call is not None:
+            return self.slow_call
+        samples = self._latency.get(route)
+        if not samples or len(samples) < self.min_calls:
+            return None
+        ordered = sorted(samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return max(self.slow_min, self.slow_factor * p95)
+
+    def record(self, ok: Optional[bool], seconds: float, now: float, error: Optional[str] = None,
+               route: str = "") -> None:
+        """ok=None: the call says nothing about the peer (e.g. the caller's own deadline cut it short)."""
+        if ok is None:
+            self._probing = False
+            return
+        failed = not ok
+        if ok:
+            threshold = self.slow_threshold(route)
+            slow = threshold is not None and seconds > threshold
+            # 慢调用不进入基线（否则几次慢调用就把 p95 拉高）；half-open 的探测只看成败，
+            # 成功的慢探测计入基线，对端长期变慢后阈值逐渐随之调整，断路器不会一直打开
+            if not slow or self.state == HALF_OPEN:
+                self._latency.setdefault(route, deque(maxlen=self.latency_window)).append(seconds)
+            failed = slow and self.state != HALF_OPEN
+        if failed:
+            self.last_error = error or f"slow call ({seconds:.1f}s)"
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if failed:
+                self._open(now)
+            else:
+                self.state = CLOSED
+                self._calls.clear()
+                self._streak = 0
+                self._trips = 0
+            return
+        self._calls.append(failed)
+        self._streak = self._streak + 1 if failed else 0
+        if self.state == CLOSED and (self._streak >= self.consecutive or (
+                len(self._calls) >= self.min_calls and sum(self._calls) / len(self._calls) >= self.error_rate)):
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self._trips += 1
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        calls = len(self._calls)
+        return {
+            "state": self.state,
+            "error_rate": round(sum(self._calls) / calls, 2) if calls else 0.0,
+            "calls": calls,
+            "consecutive_failures": self._streak,
+            "retry_in": round(self.retry_in(now), 1),
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+        }
+
+
+class BreakerBoard:
+    """One CircuitBreaker per peer base URL, created on first use."""
+
+    def __init__(self, enabled: bool = True, **settings):
+        self.enabled = enabled
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    @staticmethod
+    def _peer(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _get(self, url: str) -> CircuitBreaker:
+        peer = self._peer(url)
+        breaker = self._breakers.get(peer)
+        if breaker is None:
+            breaker = self._breakers[peer] = CircuitBreaker(**self.settings)
+        return breaker
+
+    def available(self, url: str) -> bool:
+        if not self.enabled or not url:
+            return True
+        with self._lock:
+            return self._get(url).available(time.monotonic())
+
+    def before(self, url: str) -> None:
+        """Raise CircuitOpen if a call to url must not be attempted now."""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._get(url)
+            if not breaker.allow(now):
+                raise CircuitOpen(self._peer(url), breaker.retry_in(now))
+
+    def record(self, url: str, ok: Optional[bool], seconds: float, error: Optional[str] = None) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._get(url).record(ok, seconds, time.monotonic(), error, urlsplit(url).path)
+
+    def state(self, url: str) -> Dict[str, Any]:
+        with self._lock:
+            return self._get(url).snapshot(time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {peer: b.snapshot(now) for peer, b in self._breakers.items()}
@@ -11,10 +11,11 @@ import os
 from typing import Any, Dict, Optional
 
 from flask import Flask, request, jsonify
-import requests
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from peer_pool import PeerSessionPool
+
 # 加载 .env（如果存在）
 load_dotenv()
 
@@ -103,6 +104,9 @@ def get_self_skills() -> set:
 
 
 SELF_SKILL_SET = get_self_skills()
+
+# 节点间调用复用 keep-alive 连接（超时/池大小见 peer_pool.py 的环境变量）
+PEER_POOL = PeerSessionPool()
 logger.info("Node %s (%s) skills: %s", SELF_ID, SELF_URL, sorted(SELF_SKILL_SET))
 
 
@@ -149,7 +153,7 @@ def handle_task():
             url = target_node.get("url", "").rstrip("/") + "/execute_step"
             payload = {"op": op, "params": params, "state": state}
             try:
-                resp = requests.post(url, json=payload, timeout=60)
+                resp = PEER_POOL.post(url, json=payload)
             except Exception as e:
                 logger.exception("Request to %s failed: %s", url, e)
                 return jsonify({"error": "remote request failed", "detail": str(e)}), 500
@@ -194,6 +198,11 @@ def execute_step():
     return jsonify({"state": state})
 
 
+@app.route("/pool_stats", methods=["GET"])
+def pool_stats():
+    return jsonify(PEER_POOL.stats())
+
+
 @app.route("/info", methods=["GET"])
 def info():
     return jsonify({
@@ -0,0 +1,174 @@
+"""
+Per-user fairness: token-bucket rate limits, concurrency caps and weighted fair queuing.
+
+users.json 中每个用户（{ "id", "token", ... }）可以单独配置，缺省取环境变量：
+
+- weight            公平队列中的权重（默认 1）
+- max_concurrency   同时运行的任务数上限（USER_MAX_CONCURRENCY，默认 4）
+- max_queued        排队等待的任务数上限（USER_MAX_QUEUED，默认 16）
+- rate / burst      令牌桶：每秒补充的请求数 / 桶容量（USER_RATE 默认 5，USER_BURST 默认 20；
+                    rate 为 0 表示不限速）
+
+排队的工作按 start-time fair queuing 出队：每个用户的虚拟时间按 1/weight 递增，
+总是先服务虚拟时间最小（且未达到并发上限）的用户，所以一次提交大量任务的用户
+只能拿到按权重分配的份额，不会饿死其他用户。
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from admission import Overloaded, VirtualClock
+
+DEFAULT_LIMITS = {
+    "weight": 1.0,
+    "max_concurrency": int(os.getenv("USER_MAX_CONCURRENCY", "4")),
+    "max_queued": int(os.getenv("USER_MAX_QUEUED", "16")),
+    "rate": float(os.getenv("USER_RATE", "5")),
+    "burst": float(os.getenv("USER_BURST", "20")),
+}
+
+
+def parse_limits(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Limits for one users.json entry, falling back to DEFAULT_LIMITS for missing keys."""
+    limits = dict(DEFAULT_LIMITS)
+    for key, cast in (("weight", float), ("max_concurrency", int), ("max_queued", int), ("rate", float), ("burst", float)):
+        if entry.get(key) is not None:
+            try:
+                limits[key] = cast(entry[key])
+            except (TypeError, ValueError):
+                pass
+    limits["weight"] = max(limits["weight"], 0.01)
+    return limits
+
+
+class TokenBucket:
+    """Classic token bucket; not thread-safe on its own (FairScheduler holds its lock)."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Take one token. Returns 0 if allowed, else the seconds until one is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FairScheduler:
+    """Per-user rate limits and concurrency caps, plus a weighted fair queue of pending
+    tasks drained by `workers` threads."""
+
+    def __init__(self, workers: int, limits: Optional[Dict[str, Dict[str, Any]]] = None, name: str = "task"):
+        self._limits = dict(limits or {})
+        self._cond = threading.Condition()
+        self._clock = VirtualClock()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._queues: Dict[str, deque] = {}
+        self._running: Dict[str, int] = {}
+        self._rejected: Dict[str, int] = {}
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True).start()
+
+    def limits(self, user: Optional[str]) -> Dict[str, Any]:
+        return self._limits.get(user) or DEFAULT_LIMITS
+
+    def weight(self, user: Optional[str]) -> float:
+        return self.limits(user)["weight"]
+
+    def _reject(self, user: str, retry_after: float, reason: str):
+        self._rejected[user] = self._rejected.get(user, 0) + 1
+        return Overloaded(max(1, int(retry_after + 0.999)), reason)
+
+    def check_rate(self, user: str) -> None:
+        """Spend one request token for `user`; raises Overloaded when the bucket is empty."""
+        limits = self.limits(user)
+        with self._cond:
+            bucket = self._buckets.get(user)
+            if bucket is None:
+                bucket = self._buckets[user] = TokenBucket(limits["rate"], limits["burst"])
+            wait = bucket.take()
+            if wait:
+                raise self._reject(user, wait, "rate limit exceeded")
+
+    def try_start(self, user: str) -> None:
+        """Count a task that runs right away (sync /task); raises Overloaded at the user's cap."""
+        with self._cond:
+            if self._running.get(user, 0) >= self.limits(user)["max_concurrency"]:
+                raise self._reject(user, 1, "too many concurrent tasks for this user")
+            self._running[user] = self._running.get(user, 0) + 1
+
+    def finish(self, user: str) -> None:
+        with self._cond:
+            self._running[user] = max(0, self._running.get(user, 0) - 1)
+            self._cond.notify_all()
+
+    def submit(self, user: str, fn: Callable, *args) -> None:
+        """Queue fn(*args) for `user`; raises Overloaded if the user's queue is full."""
+        limits = self.limits(user)
+        with self._cond:
+            q = self._queues.setdefault(user, deque())
+            if len(q) >= limits["max_queued"]:
+                raise self._reject(user, 1, "too many queued tasks for this user")
+            q.append((self._clock.tag(user, limits["weight"]), fn, args))
+            self._cond.notify()
+
+    def _next(self):
+        """Head item of the eligible user with the smallest tag, or None. Caller holds the lock."""
+        best = None
+        for user, q in self._queues.items():
+            if q and self._running.get(user, 0) < self.limits(user)["max_concurrency"]:
+                if best is None or q[0][0] < self._queues[best][0][0]:
+                    best = user
+        if best is None:
+            return None
+        tag, fn, args = self._queues[best].popleft()
+        self._clock.advance(tag)
+        self._running[best] = self._running.get(best, 0) + 1
+        return best, fn, args
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                item = self._next()
+                while item is None:
+                    self._cond.wait()
+                    item = self._next()
+            user, fn, args = item
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ fair scheduler job for {user} failed: {e}")
+            finally:
+                self.finish(user)
+
+    def queue_depth(self, user: str) -> int:
+        with self._cond:
+            return len(self._queues.get(user, ()))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            users = set(self._limits) | set(self._queues) | set(self._running) | set(self._buckets)
+            out = {}
+            for user in sorted(u for u in users if u is not None):
+                limits = self.limits(user)
+                bucket = self._buckets.get(user)
+                out[user] = dict(
+                    limits,
+                    running=self._running.get(user, 0),
+                    queued=len(self._queues.get(user, ())),
+                    tokens=round(bucket.tokens, 2) if bucket is not None and bucket.rate > 0 else None,
+                    rejected=self._rejected.get(user, 0),
+                )
+            return out
@@ -61,7 +61,7 @@ function renderNodes(nodes) {
     const label = String.fromCharCode(65 + idx); // A, B, C, ...
     const cpuText = n.cpu !== undefined && n.cpu !== null ? `${n.cpu}%` : 'n/a';
     const batteryText = n.battery !== undefined && n.battery !== null ? `${n.battery}` : 'n/a';
-    const loadText = n.load !== undefined && n.load !== null ? `${n.load}` : 'n/a';
+    const loadText = n.load !== undefined && n.load !== null ? (n.max_load ? `${n.load} / ${n.max_load}` : `${n.load}`) : 'n/a';
     const healthText = n.health !== undefined && n.health !== null ? `${(n.health*100).toFixed(0)}%` : 'n/a';
     card.innerHTML = `
       <h3>${label} (${n.id})</h3>
@@ -202,6 +202,34 @@ function appendMessage(role, text) {
     msgs.appendChild(el);
     msgs.scrollTop = msgs.scrollHeight;
   }
+  return el;
+}
+
+// 调用 /task/stream（Server-Sent Events），每收到一个事件就回调 onEvent(event, data)
+// 事件：task, step_started, delta, step_done, final, error
+async function streamTask(body, headers, onEvent) {
+  const r = await fetch('/task/stream', { method: 'POST', headers, body: JSON.stringify(body) });
+  if (!r.ok) throw new Error(await r.text());
+  const reader = r.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buf.indexOf('\n\n')) >= 0) {
+      const frame = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+      let event = 'message';
+      const data = [];
+      frame.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+      });
+      if (data.length) onEvent(event, JSON.parse(data.join('\n')));
+    }
+  }
 }
 
 function formatFinalState(final_state) {
@@ -241,21 +269,29 @@ chatSend && chatSend.addEventListener('click', async () => {
   appendMessage('user', msg);
   chatInput.value = '';
 
-  // send as ai_execute pipeline to /task
+  // send as ai_execute pipeline to /task/stream：边生成边显示
+  const replyEl = appendMessage('assistant', '…');
   try {
     const headers = { 'Content-Type': 'application/json' };
     if (token) headers['X-User-Token'] = token;
-    const r = await fetch('/task', {
-      method: 'POST',
-      headers,
-      body: JSON.stringify({ pipeline: [{ op: 'ai_execute', params: { prompt: msg } }] })
+    let streamed = '';
+    let js = null;
+    await streamTask({ pipeline: [{ op: 'ai_execute', params: { prompt: msg } }] }, headers, (event, data) => {
+      if (event === 'delta') {
+        streamed += data.text;
+        replyEl.textContent = streamed;
+        const msgs = document.getElementById('messages') || messagesEl;
+        if (msgs) msgs.scrollTop = msgs.scrollHeight;
+      } else if (event === 'final') {
+        js = data;
+      } else if (event === 'error') {
+        throw new Error(JSON.stringify(data));
+      }
     });
-    const js = await r.json();
-    if (!r.ok) throw new Error(JSON.stringify(js));
+    if (!js) throw new Error('stream ended without a result');
 
     // format final_state into readable assistant text
-    const reply = formatFinalState(js.final_state);
-    appendMessage('assistant', reply);
+    replyEl.textContent = formatFinalState(js.final_state);
 
     // show task assignment in logs / node cards if pipeline present
     if (js.pipeline && Array.isArray(js.pipeline)) {
@@ -265,7 +301,7 @@ chatSend && chatSend.addEventListener('click', async () => {
       });
     }
   } catch (err) {
-    appendMessage('assistant', '请求失败：' + String(err));
+    replyEl.textContent = '请求失败：' + String(err);
   }
 });
 
@@ -283,7 +319,11 @@ dispatchAllBtn.addEventListener('click', async () => {
     // 优先使用当初 AI 返回并保存在 data-task 的完整任务对象（包含 target_node）
     try {
       const t = JSON.parse(card.dataset.task || '{}');
-      return { op: t.op, params: t.params || {}, target_node: t.target_node };
+      const step = { op: t.op, params: t.params || {}, target_node: t.target_node };
+      // 保留 id / depends_on，后端据此并行执行互不依赖的任务
+      if (t.id !== undefined) step.id = t.id;
+      if (Array.isArray(t.depends_on)) step.depends_on = t.depends_on;
+      return step;
     } catch(e) {
       // 兜底：从 DOM 恢复
       const opText = card.querySelector('.task-header').textContent || '';
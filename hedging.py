@@ -0,0 +1,175 @@
+"""
+Hedged requests against tail latency.
+
+每个 key（step 的 op，或 LLM 的 model）记录最近 window 次调用的耗时。样本足够后，如果一次调用
+超过了耗时的第 percentile 百分位还没有返回，就再发一个备份请求，取先成功的那个（线程版本里另一个
+跑完后结果丢弃，asyncio 版本里另一个被取消）。
+每个 key 的备份请求数不超过最近调用数的 budget 比例（默认 10%），所以额外负载有上限，
+不会在整体变慢时把负载翻倍。
+备份赢了时，还没返回的主请求也记一个样本（到此刻为止的耗时，不小于对冲延迟）：只记赢家的话，
+慢的样本总被丢掉，百分位会越来越低，对冲越来越早，很快顶到预算上限。
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class Hedger:
+    """Run a call and, if it is slower than the key's latency percentile, a backup alongside it."""
+
+    def __init__(self, percentile: float = 95, budget: float = 0.1, min_samples: int = 20, window: int = 200,
+                 max_parallel: int = 32, name: str = "hedge"):
+        self.percentile = min(max(percentile, 0.0), 100.0)
+        self.budget = budget
+        self.min_samples = max(1, min_samples)
+        self.window = window
+        self._lock = threading.Lock()
+        self._latency: Dict[str, deque] = {}
+        self._sent: Dict[str, deque] = {}  # 最近 window 次调用各自是否发了备份（[0] / [1]）
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix=name)
+
+    def delay(self, key: str) -> Optional[float]:
+        """Seconds to wait before hedging `key`, or None while there are too few samples."""
+        with self._lock:
+            samples = self._latency.get(key)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def observe(self, key: str, seconds: float) -> None:
+        with self._lock:
+            self._latency.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def _count(self, key: str, field: str) -> None:
+        stats = self._stats.setdefault(key, {"calls": 0, "hedged": 0, "backup_wins": 0, "over_budget": 0})
+        stats[field] += 1
+
+    def _start(self, key: str) -> list:
+        flag = [0]
+        with self._lock:
+            self._sent.setdefault(key, deque(maxlen=self.window)).append(flag)
+            self._count(key, "calls")
+        return flag
+
+    def _take_budget(self, key: str, flag: list) -> bool:
+        with self._lock:
+            sent = self._sent[key]
+            if sum(f[0] for f in sent) + 1 > self.budget * len(sent):
+                self._count(key, "over_budget")
+                return False
+            flag[0] = 1
+            self._count(key, "hedged")
+            return True
+
+    def _submit(self, fn: Callable[[], Any]):
+        started = time.monotonic()
+        ctx = contextvars.copy_context()
+        return self._executor.submit(lambda: (ctx.run(fn), time.monotonic() - started))
+
+    def run(self, key: str, primary: Callable[[], Any], backup: Optional[Callable[[], Any]] = None) -> Tuple[Any, Optional[str]]:
+        """Return (result, hedge): hedge is None if no backup was sent, else 'primary' or 'backup' (the winner).
+
+        Without a backup callable (or before enough samples) primary runs inline and is only timed.
+        If both fail, the primary's exception is raised.
+        """
+        flag = self._start(key)
+        after = self.delay(key) if backup is not None else None
+        if after is None:
+            started = time.monotonic()
+            result = primary()
+            self.observe(key, time.monotonic() - started)
+            return result, None
+
+        started = time.monotonic()
+        first = self._submit(primary)
+        done, _ = wait([first], timeout=after)
+        if done or not self._take_budget(key, flag):
+            result, took = first.result()
+            self.observe(key, took)
+            return result, None
+
+        second = self._submit(backup)
+        pending = {first: "primary", second: "backup"}
+        error = None
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                which = pending.pop(fut)
+                try:
+                    result, took = fut.result()
+                except Exception as e:
+                    if which == "primary" or error is None:
+                        error = e
+                    continue
+                # 输的那一个继续在后台跑完，结果丢弃
+                self.observe(key, took)
+                if which == "backup":
+                    self._backup_won(key, started, first in pending)
+                return result, which
+        raise error
+
+    async def arun(self, key: str, primary: Callable[[], Awaitable[Any]],
+                   backup: Optional[Callable[[], Awaitable[Any]]] = None) -> Tuple[Any, Optional[str]]:
+        """Asyncio twin of run(): primary/backup are coroutine factories; the loser is cancelled."""
+        flag = self._start(key)
+        after = self.delay(key) if backup is not None else None
+        started = time.monotonic()
+        if after is None:
+            result = await primary()
+            self.observe(key, time.monotonic() - started)
+            return result, None
+
+        first = asyncio.ensure_future(primary())
+        done, _ = await asyncio.wait([first], timeout=after)
+        if done or not self._take_budget(key, flag):
+            result = await first
+            self.observe(key, time.monotonic() - started)
+            return result, None
+
+        backup_started = time.monotonic()
+        second = asyncio.ensure_future(backup())
+        pending = {first: "primary", second: "backup"}
+        error = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    which = pending.pop(fut)
+                    if fut.exception() is not None:
+                        if which == "primary" or error is None:
+                            error = fut.exception()
+                        continue
+                    self.observe(key, time.monotonic() - (started if which == "primary" else backup_started))
+                    if which == "backup":
+                        self._backup_won(key, started, first in pending)
+                    return fut.result(), which
+            raise error
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+    def _backup_won(self, key: str, started: float, primary_pending: bool) -> None:
+        with self._lock:
+            self._count(key, "backup_wins")
+        if primary_pending:
+            # 主请求的耗时是截尾样本：至少是到现在为止的时间
+            self.observe(key, time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for key, stats in self._stats.items():
+                samples = sorted(self._latency.get(key, ()))
+                out[key] = dict(stats, samples=len(samples))
+                if len(samples) >= self.min_samples:
+                    out[key]["hedge_after_ms"] = round(
+                        samples[min(len(samples) - 1, int(len(samples) * self.percentile / 100))] * 1000, 1)
+            return {"percentile": self.percentile, "budget": self.budget, "min_samples": self.min_samples,
+                    "keys": out}
@@ -0,0 +1,154 @@
+"""
+Persistent cache for chat-completion responses.
+
+键由 (model, messages, temperature, max_tokens) 规范化后做 SHA-256；值保存在 SQLite 中，
+进程重启后仍然有效。淘汰策略：读取时检查 TTL，写入时每隔一段时间按 last_access 做 LRU 裁剪。
+命中时只在内存里记下 last_access，随下一次写入（或攒满 touch_batch 条）批量落盘，读路径不再每次 commit。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+DEFAULT_TEMPERATURE = 1.0  # OpenAI 的默认 temperature
+
+
+def normalize_request(model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+                      max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """Canonical form of a chat request: stripped message text, explicit default temperature."""
+    norm_messages = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            content = content.strip()
+        norm_messages.append({"role": m.get("role", "user"), "content": content})
+    return {
+        "model": model,
+        "messages": norm_messages,
+        "temperature": float(DEFAULT_TEMPERATURE if temperature is None else temperature),
+        "max_tokens": int(max_tokens) if max_tokens is not None else None,
+    }
+
+
+def cache_key(model: str, messages: List[Dict[str, Any]], temperature: Optional[float] = None,
+              max_tokens: Optional[int] = None) -> str:
+    norm = normalize_request(model, messages, temperature, max_tokens)
+    raw = json.dumps(norm, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed LRU + TTL cache of completion text, with hit/miss counters."""
+
+    def __init__(self, path: str, max_entries: int = 10000, ttl: float = 7 * 24 * 3600, prune_every: int = 100,
+                 touch_batch: int = 100):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.touch_batch = touch_batch
+        self._touched: Dict[str, float] = {}  # 待落盘的 LRU 访问时间
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY, model TEXT, response TEXT NOT NULL,"
+            " created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache(last_access)")
+        self._db.commit()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                if row is not None:
+                    self._touched.pop(key, None)
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.evictions += 1
+                self.misses += 1
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touches()
+                self._db.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, response: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._touched.pop(key, None)
+            self._flush_touches()
+            self._db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, response, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model, json.dumps(response, ensure_ascii=False), now, now),
+            )
+            self._puts += 1
+            if self._puts % self.prune_every == 0:
+                self._prune(now)
+            self._db.commit()
+
+    def note_bypass(self) -> None:
+        with self._lock:
+            self.bypassed += 1
+
+    def _flush_touches(self) -> None:
+        # 调用方持锁并负责 commit
+        if self._touched:
+            self._db.executemany("UPDATE llm_cache SET last_access = ? WHERE key = ?",
+                                 [(t, k) for k, t in self._touched.items()])
+            self._touched.clear()
+
+    def flush(self) -> None:
+        """Write pending LRU touches to disk."""
+        with self._lock:
+            self._flush_touches()
+            self._db.commit()
+
+    def _prune(self, now: float) -> None:
+        if self.ttl:
+            cur = self._db.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+            self.evictions += cur.rowcount
+        cur = self._db.execute(
+            "DELETE FROM llm_cache WHERE key NOT IN"
+            " (SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+        self.evictions += cur.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._touched.clear()
+            self._db.execute("DELETE FROM llm_cache")
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._touched:
+                self._flush_touches()
+                self._db.commit()
+            entries = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,162 @@
+"""
+Background metrics sampler for one node.
+
+后台线程每 interval 秒采样一次：CPU 用 psutil.cpu_percent(interval=None)（与上一次调用之间的平均值，
+不阻塞），在途/排队数由调用方提供的 probe 读取。CPU、负载、排队数和在途数做 EWMA 平滑后，
+整体发布为一个只读快照（MappingProxyType），/info、/nodes、调度和 mDNS 广播都直接读这个快照。
+
+快照里的负载都是数值：load = running + queued，max_load，load_ratio = load / max_load。
+订阅者（广播）只有在四舍五入后的广播内容变化时才会被通知，不会每个周期都重新编码、重新广播。
+"""
+
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+try:
+    import psutil
+except Exception:
+    psutil = None
+    print('⚠️ psutil not available; install psutil to enable CPU/battery metrics (pip install psutil)')
+
+# 广播给其它节点的字段（以及比较是否变化时的取整位数）
+ADVERT_FIELDS = (("cpu", 0), ("battery", 0), ("load", 0), ("max_load", 0), ("running", 0), ("queued", 0),
+                 ("health", 2), ("load_avg", 1))
+
+
+def _ewma(prev: Optional[float], value: Optional[float], alpha: float) -> Optional[float]:
+    if value is None:
+        return prev
+    return value if prev is None else alpha * value + (1 - alpha) * prev
+
+
+def _round(v: Optional[float], digits: int) -> Optional[float]:
+    return None if v is None else round(v, digits)
+
+
+class MetricsSampler:
+    """Samples CPU/battery/load without blocking and publishes an immutable, EWMA-smoothed snapshot.
+
+    probe() returns (running, queued, inflight): steps executing here, steps waiting for a slot
+    here, and steps this node has dispatched to peers.
+    """
+
+    def __init__(self, probe: Callable[[], Tuple[int, int, int]], max_load: int, interval: float = 3.0,
+                 alpha: float = 0.3):
+        self.probe = probe
+        self.max_load = max(1, max_load)
+        self.interval = interval
+        self.alpha = min(max(alpha, 0.01), 1.0)
+        self._ewma: Dict[str, Optional[float]] = {"cpu": None, "load": None, "queued": None, "inflight": None}
+        self._subscribers: List[Callable[[Mapping[str, Any]], None]] = []
+        self._advert: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.samples = 0
+        self.adverts = 0
+        if psutil:
+            try:
+                psutil.cpu_percent(interval=None)  # 第一次调用只是建立基准，返回值无意义
+            except Exception:
+                pass
+        self._snapshot: Mapping[str, Any] = MappingProxyType(self._build(None, None))
+
+    @property
+    def snapshot(self) -> Mapping[str, Any]:
+        """The latest published snapshot (read-only; replaced, never mutated)."""
+        return self._snapshot
+
+    def subscribe(self, fn: Callable[[Mapping[str, Any]], None]) -> None:
+        """Call fn(snapshot) whenever the advertised (rounded) metrics change."""
+        self._subscribers.append(fn)
+
+    def advert(self) -> Dict[str, Any]:
+        """The subset of the snapshot peers need, rounded so that noise does not count as a change."""
+        snap = self._snapshot
+        return {key: _round(snap.get(key), digits) for key, digits in ADVERT_FIELDS}
+
+    def _read_host(self):
+        cpu = battery = None
+        if psutil:
+            try:
+                cpu = psutil.cpu_percent(interval=None)
+            except Exception:
+                cpu = None
+            # battery may be None on desktops/servers
+            try:
+                batt = psutil.sensors_battery()
+                battery = round(batt.percent, 1) if batt and batt.percent is not None else None
+            except Exception:
+                battery = None
+        return cpu, battery
+
+    def _build(self, cpu: Optional[float], battery: Optional[float]) -> Dict[str, Any]:
+        try:
+            running, queued, inflight = self.probe()
+        except Exception:
+            running = queued = inflight = 0
+        load = running + queued
+        e = self._ewma
+        e["cpu"] = _ewma(e["cpu"], cpu, self.alpha)
+        e["load"] = _ewma(e["load"], load, self.alpha)
+        e["queued"] = _ewma(e["queued"], queued, self.alpha)
+        e["inflight"] = _ewma(e["inflight"], inflight, self.alpha)
+        smoothed_cpu = e["cpu"]
+        # 健康度：CPU 越忙越低（与原来的启发式相同，只是用平滑后的 CPU）
+        health = max(0.0, min(1.0, (100.0 - smoothed_cpu) / 100.0)) if smoothed_cpu is not None else None
+        return {
+            "cpu": _round(smoothed_cpu, 1),
+            "cpu_now": _round(cpu, 1),
+            "battery": battery,
+            "running": running,
+            "queued": queued,
+            "inflight": inflight,
+            "load": load,
+            "max_load": self.max_load,
+            "load_ratio": round(load / self.max_load, 3),
+            "load_avg": _round(e["load"], 2),
+            "queued_avg": _round(e["queued"], 2),
+            "inflight_avg": _round(e["inflight"], 2),
+            "health": _round(health, 3),
+            "sampled_at": time.time(),
+        }
+
+    def sample_once(self) -> Mapping[str, Any]:
+        """Take one sample, publish it and notify subscribers if the advert changed."""
+        cpu, battery = self._read_host()
+        self._snapshot = MappingProxyType(self._build(cpu, battery))
+        self.samples += 1
+        advert = self.advert()
+        if advert != self._advert:
+            self._advert = advert
+            self.adverts += 1
+            for fn in list(self._subscribers):
+                try:
+                    fn(self._snapshot)
+                except Exception as e:
+                    print(f"⚠️ metrics subscriber failed: {e}")
+        return self._snapshot
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.sample_once()
+                except Exception as e:
+                    print(f"⚠️ metrics sample failed: {e}")
+                if self._stop.wait(self.interval):
+                    return
+
+        self._thread = threading.Thread(target=run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._snapshot, interval=self.interval, alpha=self.alpha, samples=self.samples,
+                    adverts=self.adverts, psutil=psutil is not None)
@@ -2,19 +2,35 @@
 import json
 import re
 import requests
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from openai import OpenAI
 import os
 from dotenv import load_dotenv
 import socket
 import threading
 from zeroconf import Zeroconf, ServiceInfo, ServiceBrowser
+import contextvars
 import copy
-try:
-    import psutil
-except Exception:
-    psutil = None
-    print('⚠️ psutil not available; install psutil to enable CPU/battery metrics (pip install psutil)')
+import hashlib
+import queue
+import random
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from peer_pool import PeerSessionPool
+from admission import AdmissionController, Overloaded
+from circuit_breaker import BreakerBoard
+from fair_share import FairScheduler, parse_limits
+from hedging import Hedger
+from wire_codec import PeerCodecs, CodecError, decode_request, decode_response, make_response
+from llm_cache import LLMCache, cache_key, normalize_request
+from task_store import MemoryTaskStore, SQLiteTaskStore
+from state_transfer import BlobStore, PeerBlobIndex, MissingBlobs, decode_state, fingerprint, make_delta, apply_delta
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import MetricsSampler
+from prometheus import CONTENT_TYPE as PROM_CONTENT_TYPE, Registry
+from tracing import TRACEPARENT, JsonlExporter, OtlpExporter, Tracer
 
 # 从项目根目录的 .env 加载环境变量（不会把密钥写入源码）
 load_dotenv()
@@ -96,20 +112,39 @@ openai_client = OpenAI(api_key=OPENAI_API_KEY)
 
 # --- Minimal user store (token -> user id)
 USERS = {}
+# user id -> 公平调度/限流参数（weight, max_concurrency, max_queued, rate, burst，见 fair_share.py）
+USER_LIMITS = {}
 if os.path.exists('users.json'):
     try:
         with open('users.json', 'r', encoding='utf-8') as f:
             data = json.load(f)
             for u in data.get('users', []):
                 USERS[u['token']] = u['id']
+                USER_LIMITS[u['id']] = parse_limits(u)
     except Exception:
         USERS = {}
+        USER_LIMITS = {}
 else:
     # create a default test user (convenience for local testing)
     USERS['testtoken123'] = 'user1'
 
-# In-memory task store: task_id -> { owner_token, pipeline, final_state, status }
-TASK_STORE = {}
+# 任务存储：task_id -> { owner, pipeline, status, error, final_state }（见 task_store.py）
+# TASK_STORE=memory（默认，有界 LRU）或 sqlite（写入 TASK_STORE_PATH，重启后 /result 仍可读）
+TASK_STORE_BACKEND = os.getenv('TASK_STORE', 'memory').lower()
+TASK_TTL = float(os.getenv('TASK_TTL', str(24 * 3600)))
+if TASK_STORE_BACKEND == 'sqlite':
+    TASK_STORE = SQLiteTaskStore(
+        os.getenv('TASK_STORE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tasks.sqlite3')),
+        max_tasks=int(os.getenv('TASK_STORE_MAX', '100000')),
+        ttl=TASK_TTL,
+        hot_tasks=int(os.getenv('TASK_STORE_HOT', '1000')),
+    )
+else:
+    TASK_STORE = MemoryTaskStore(
+        max_tasks=int(os.getenv('TASK_STORE_MAX', '10000')),
+        ttl=TASK_TTL,
+        max_result_bytes=int(os.getenv('TASK_RESULT_MAX_BYTES', str(64 << 20))),
+    )
 
 import uuid
 
@@ -122,41 +157,339 @@ def _require_token(req):
     return token, None
 
 
+def _user_of(token):
+    return USERS.get(token)
+
+
 # get_local_ip is defined earlier near config loading; reuse that implementation
 
 
+# 节点间调用复用 keep-alive 连接（按对端 URL 分池，见 peer_pool.py）
+PEER_POOL = PeerSessionPool()
+# 节点间编码协商（MessagePack / zstd / gzip，见 wire_codec.py）
+PEER_CODECS = PeerCodecs()
+
+
+# 每个对端一个断路器（见 circuit_breaker.py）：对端连续失败/错误率过高/太慢时直接快速失败，
+# 调度时跳过断路器打开的节点，冷却后放行一个探测请求
+BREAKERS = BreakerBoard(
+    enabled=os.getenv('CIRCUIT_BREAKER', '1') not in ('0', 'false', 'no'),
+    window=int(os.getenv('BREAKER_WINDOW', '20')),
+    min_calls=int(os.getenv('BREAKER_MIN_CALLS', '5')),
+    error_rate=float(os.getenv('BREAKER_ERROR_RATE', '0.5')),
+    consecutive=int(os.getenv('BREAKER_CONSECUTIVE', '3')),
+    # 慢调用默认按对端自己的 p95 耗时判断（见 circuit_breaker.py）；BREAKER_SLOW_CALL 设置固定阈值
+    slow_call=float(os.getenv('BREAKER_SLOW_CALL')) if os.getenv('BREAKER_SLOW_CALL') else None,
+    slow_factor=float(os.getenv('BREAKER_SLOW_FACTOR', '4')),
+    slow_min=float(os.getenv('BREAKER_SLOW_MIN', '5')),
+    open_seconds=float(os.getenv('BREAKER_OPEN_SECONDS', '15')),
+    max_open_seconds=float(os.getenv('BREAKER_MAX_OPEN_SECONDS', '300')),
+)
+
+
+def _breaker_call(url, call):
+    """Run call() -> response through the peer's circuit breaker. Raises CircuitOpen without calling.
+
+    The call runs inside a `peer_call` span, so headers built with TRACER.headers() inside call()
+    name it as the parent of the peer's spans.
+    """
+    BREAKERS.before(url)
+    with TRACER.span('peer_call', url=url) as span:
+        started = time.monotonic()
+        try:
+            resp = call()
+        except Exception as e:
+            # 被自己的 deadline 截断的调用不算对端的错
+            BREAKERS.record(url, None if _deadline_expired() else False, time.monotonic() - started, str(e))
+            _observe_peer(url, 'error', time.monotonic() - started)
+            raise
+        # 429 说明对端活着只是忙，不算失败；504 是调用方自己的预算用完了，与对端健康无关
+        ok = None if resp.status_code == 504 else resp.status_code < 500
+        BREAKERS.record(url, ok, time.monotonic() - started, None if ok is not False else f"HTTP {resp.status_code}")
+        _observe_peer(url, resp.status_code, time.monotonic() - started)
+        if span is not None:
+            span['status'] = resp.status_code
+        return resp
+
+
+def _observe_peer(url, status, seconds):
+    peer, route = _peer_label(url)
+    PROM_PEER_SECONDS.observe(seconds, peer, route)
+    PROM_PEER_REQUESTS.inc(peer, route, str(status))
+
+
+def _circuit_ok(node):
+    return node.get('id') == SELF_ID or BREAKERS.available(node.get('url'))
+
+
+def _peer_post(url, obj, **kwargs):
+    """POST `obj` to a peer with the best codec it has advertised so far."""
+    _check_deadline()
+    with TRACER.span('serialize', codec='wire'):
+        body, headers = PEER_CODECS.encode(url, obj)
+    if _hop_timeout() is not None:
+        kwargs.setdefault('timeout', _hop_timeout())
+    headers = _deadline_headers(headers)
+    resp = _breaker_call(url, lambda: PEER_POOL.post(url, data=body, headers=TRACER.headers(headers), **kwargs))
+    PEER_CODECS.learn(url, resp)
+    return resp
+
+
+def _request_body():
+    """Decode the current request body (JSON or negotiated MessagePack, maybe compressed)."""
+    return decode_request(request)
+
+
+def _reply(obj, status=200):
+    """JSON by default; MessagePack/compressed only if the caller's Accept headers ask for it."""
+    resp = make_response(obj, status, request)
+    if status == 429 and isinstance(obj, dict) and obj.get('retry_after'):
+        resp.headers['Retry-After'] = str(obj['retry_after'])
+    return resp
+
+
+# 准入控制：本节点同时执行的 step 数有上限，超出的排队，队列满则 429（见 admission.py）
+ADMISSION = AdmissionController()
+
+# 当前任务所属的用户 id：排队的 step 按用户公平调度，远端调用时随 payload 一起发给对端
+CURRENT_USER = contextvars.ContextVar('current_user', default=None)
+
+
+# 端到端 deadline：/task 的 deadline_ms（或 X-Deadline-Ms 头，缺省 TASK_TIMEOUT 秒）换算成本进程
+# time.monotonic() 上的截止时间；跨节点时用 X-Deadline-Ms 传剩余毫秒数（相对时间，不依赖各节点时钟同步）
+DEADLINE_HEADER = 'X-Deadline-Ms'
+TASK_TIMEOUT = float(os.getenv('TASK_TIMEOUT', '300'))
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+# 每一跳的 HTTP 超时 = 剩余预算 + HOP_GRACE 秒，让对端自己的 504 先于本地超时返回
+HOP_GRACE = float(os.getenv('HOP_GRACE', '1'))
+DEADLINE = contextvars.ContextVar('deadline', default=None)
+
+
+def _overloaded(e, **extra):
+    return _reply(dict(extra, error=e.reason, retry_after=e.retry_after), 429)
+
+
+def _remaining():
+    """Seconds left before the current deadline, or None if there is none."""
+    deadline = DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _deadline_expired():
+    left = _remaining()
+    return left is not None and left <= 0
+
+
+def _deadline_error(detail=None):
+    body = {"error": "deadline exceeded"}
+    if detail:
+        body["detail"] = detail
+    return PipelineError(504, body)
+
+
+def _check_deadline(detail=None):
+    if _deadline_expired():
+        raise _deadline_error(detail)
+
+
+@contextmanager
+def _deadline_scope(deadline):
+    token = DEADLINE.set(deadline)
+    try:
+        yield
+    finally:
+        DEADLINE.reset(token)
+
+
+def _task_deadline(data, headers):
+    """Deadline for a new task: body deadline_ms, else the X-Deadline-Ms header, else TASK_TIMEOUT.
+
+    Raises PipelineError(400) for a malformed or non-positive budget.
+    """
+    raw = data.get('deadline_ms')
+    if raw is None:
+        raw = headers.get(DEADLINE_HEADER)
+    if raw is None or raw == '':
+        return time.monotonic() + TASK_TIMEOUT if TASK_TIMEOUT > 0 else None
+    try:
+        ms = float(raw)
+    except (TypeError, ValueError):
+        ms = 0
+    if ms <= 0:
+        raise PipelineError(400, {'error': 'deadline_ms must be a positive number of milliseconds'})
+    return time.monotonic() + ms / 1000.0
+
+
+def _incoming_deadline(headers):
+    """Peer side: deadline from the caller's X-Deadline-Ms. Raises PipelineError(504) if already spent."""
+    raw = headers.get(DEADLINE_HEADER)
+    if not raw:
+        return None
+    try:
+        ms = float(raw)
+    except ValueError:
+        return None
+    if ms <= 0:
+        raise _deadline_error('budget spent before the step reached this node')
+    return time.monotonic() + ms / 1000.0
+
+
+def _deadline_headers(headers=None):
+    headers = dict(headers or {})
+    left = _remaining()
+    if left is not None:
+        headers[DEADLINE_HEADER] = str(max(0, int(left * 1000)))
+    return headers
+
+
+def _hop_timeout():
+    """Read timeout for one peer hop: the remaining budget plus HOP_GRACE, or None (pool default)."""
+    left = _remaining()
+    if left is None:
+        return None
+    return min(PEER_POOL.read_timeout, max(left, 0) + HOP_GRACE)
+
+
+def _llm_timeout():
+    left = _remaining()
+    if left is None:
+        return LLM_TIMEOUT
+    if left <= 0:
+        raise _deadline_error('no time left for the LLM call')
+    return min(LLM_TIMEOUT, left)
+
+
+def _admission_args(user=None):
+    """(user, weight) for ADMISSION.acquire/slot; defaults to the current task's user."""
+    user = user if user is not None else CURRENT_USER.get()
+    return user, FAIR.weight(user)
+
+
+def _with_user(payload):
+    user = CURRENT_USER.get()
+    if user is not None:
+        payload["user"] = user
+    return payload
+
+
 # Zeroconf globals
 ZC = None
 ZC_INFO = None
 NODES_LOCK = threading.Lock()
 
+# ====== LLM 调用：所有 chat completion 都经过这里（带持久化缓存） ======
+# LLM_CACHE_PATH 为空字符串时关闭缓存
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'llm_cache.sqlite3'))
+LLM_CACHE = None
+if LLM_CACHE_PATH:
+    try:
+        LLM_CACHE = LLMCache(
+            LLM_CACHE_PATH,
+            max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '10000')),
+            ttl=float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600))),
+        )
+    except Exception as e:
+        print(f"⚠️ LLM cache disabled ({LLM_CACHE_PATH}): {e}")
+# 只有 temperature <= 该值的请求默认会被缓存（0 表示只缓存确定性请求）
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv('LLM_CACHE_MAX_TEMPERATURE', '0'))
+# 流式输出：设置了回调时 chat_completion 以 stream=True 调用，并把每个增量文本交给回调
+LLM_STREAM = contextvars.ContextVar('llm_stream', default=None)
+
+
+# 对冲请求（见 hedging.py）：慢于该 key 最近耗时第 HEDGE_PERCENTILE 百分位时再发一个备份请求，
+# 备份数不超过最近调用数的 HEDGE_BUDGET 比例。HEDGE_STEPS 针对远端 step，HEDGE_LLM 针对非流式 LLM 调用
+HEDGE_STEPS = os.getenv('HEDGE_STEPS', '0').lower() in ('1', 'true', 'yes')
+HEDGE_LLM = os.getenv('HEDGE_LLM', '0').lower() in ('1', 'true', 'yes')
+_HEDGE_OPTS = dict(
+    percentile=float(os.getenv('HEDGE_PERCENTILE', '95')),
+    budget=float(os.getenv('HEDGE_BUDGET', '0.1')),
+    min_samples=int(os.getenv('HEDGE_MIN_SAMPLES', '20')),
+)
+STEP_HEDGER = Hedger(name='hedge-step', **_HEDGE_OPTS)
+LLM_HEDGER = Hedger(name='hedge-llm', **_HEDGE_OPTS)
+
+
+def chat_completion(messages, model='gpt-4o-mini', temperature=None, max_tokens=None, cache=None):
+    """Return the assistant text for a chat completion.
+
+    `cache` is None (cache only deterministic requests), True (force) or False (opt out).
+    Inside a streaming step (LLM_STREAM set) the completion is streamed and every
+    text delta is passed to the callback as it arrives.
+    """
+    norm = normalize_request(model, messages, temperature, max_tokens)
+    on_delta = LLM_STREAM.get()
+    use_cache = LLM_CACHE is not None and cache is not False and (
+        cache is True or norm['temperature'] <= LLM_CACHE_MAX_TEMPERATURE)
+    key = None
+    if use_cache:
+        key = cache_key(model, messages, temperature, max_tokens)
+        hit = LLM_CACHE.get(key)
+        if hit is not None:
+            if on_delta is not None:
+                on_delta(hit['content'])
+            return hit['content']
+    elif LLM_CACHE is not None:
+        LLM_CACHE.note_bypass()
+
+    kwargs = {'model': model, 'messages': messages, 'timeout': _llm_timeout()}
+    if temperature is not None:
+        kwargs['temperature'] = temperature
+    if max_tokens is not None:
+        kwargs['max_tokens'] = max_tokens
+    if on_delta is not None:
+        parts = []
+        started, outcome = time.perf_counter(), 'error'
+        try:
+            with TRACER.span('llm', model=model, stream=True):
+                for chunk in openai_client.chat.completions.create(stream=True, **kwargs):
+                    piece = chunk.choices[0].delta.content if chunk.choices else None
+                    if piece:
+                        parts.append(piece)
+                        on_delta(piece)
+            outcome = 'ok'
+        finally:
+            PROM_LLM_SECONDS.observe(time.perf_counter() - started, model, outcome)
+        text = ''.join(parts)
+    else:
+        call = lambda: _observe_llm(model, lambda: openai_client.chat.completions.create(**kwargs))
+        if HEDGE_LLM:
+            # 两次请求完全相同，谁先返回用谁
+            resp, _ = LLM_HEDGER.run(model, call, call)
+        else:
+            resp = call()
+        try:
+            text = resp.choices[0].message.content
+        except Exception:
+            text = str(resp)
+    if key is not None and text:
+        LLM_CACHE.put(key, model, {'content': text})
+    return text
+
+
+def _cache_opt(params):
+    """per-step 缓存开关：params.cache = true/false，缺省按 temperature 决定"""
+    v = params.get('cache')
+    return None if v is None else _is_truthy(v)
+
+
 # ====== 定义本节点的技能实现 ======
 
 def skill_generate_poem_en(state, params):
     prompt = params.get("prompt", "Write a short poem about i love morven.")
-    completion = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-    )
-    # new client returns structure similar to legacy; access the content
-    poem = completion.choices[0].message.content
+    poem = chat_completion([{"role": "user", "content": prompt}], cache=_cache_opt(params))
     state["english_poem"] = poem
     return state
 
 def skill_translate_zh(state, params):
     text = state.get("english_poem", "")
     prompt = params.get("prompt") or f"翻译成中文诗：\n{text}"
-    completion = openai_client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-    )
-    zh = completion.choices[0].message.content
+    zh = chat_completion([{"role": "user", "content": prompt}], temperature=0, cache=_cache_opt(params))
     state["chinese_poem"] = zh
     return state
 
 
-def skill_ai_execute(state, params):
-    """通用 AI 执行器：接收 { prompt }，把模型返回写入 state['ai_result']。"""
+def _ai_execute_prompt(state, params):
+    """Prompt for ai_execute: the first non-empty prompt-like param, else a prompt-like state value."""
     # try several common keys for prompt-like content
     prompt = None
     for key in ('prompt', 'text', 'query', 'message', 'input'):
@@ -171,25 +504,30 @@ def skill_ai_execute(state, params):
             if isinstance(v, str) and v.strip():
                 prompt = v.strip()
                 break
+    return prompt
+
+
+def skill_ai_execute(state, params):
+    """通用 AI 执行器：接收 { prompt }，把模型返回写入 state['ai_result']。
+
+    params.output_key 可以指定写入的 state 键（DAG 中并行的多个 ai_execute 互不覆盖）。
+    """
+    out_key = params.get('output_key') or 'ai_result'
+    prompt = _ai_execute_prompt(state, params)
     if not prompt:
-        state.setdefault('ai_result', {'error': 'no prompt provided (please include params.prompt or params.text)'} )
+        state.setdefault(out_key, {'error': 'no prompt provided (please include params.prompt or params.text)'} )
         return state
 
     try:
-        resp = openai_client.chat.completions.create(
-            model='gpt-4o-mini',
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
+        text = chat_completion(
+            [{"role": "user", "content": prompt}],
+            temperature=params.get('temperature', 0.2),
             max_tokens=800,
+            cache=_cache_opt(params),
         )
-        text = ''
-        try:
-            text = resp.choices[0].message.content
-        except Exception:
-            text = str(resp)
-        state['ai_result'] = {'output': text}
+        state[out_key] = {'output': text}
     except Exception as e:
-        state['ai_result'] = {'error': str(e)}
+        state[out_key] = {'error': str(e)}
     return state
 
 SKILL_IMPL = {
@@ -204,21 +542,1227 @@ def self_skills():
             return set(n["skills"])
     return set()
 
-SELF_SKILL_SET = self_skills()
+SELF_SKILL_SET = self_skills()
+
+# ====== 调度：本地跟踪每个节点的在途 step 数 ======
+# node_id -> 由本协调节点发出、尚未完成的 step 数量
+INFLIGHT = {}
+INFLIGHT_LOCK = threading.Lock()
+
+
+def _metrics_probe():
+    """(running, queued, inflight) for the metrics sampler."""
+    running, queued = ADMISSION.snapshot()
+    with INFLIGHT_LOCK:
+        inflight = sum(INFLIGHT.values())
+    return running, queued, inflight
+
+
+# 后台采样（不阻塞），/info、/nodes、调度和 mDNS 广播都读 METRICS.snapshot
+METRICS = MetricsSampler(_metrics_probe, ADMISSION.max_concurrency,
+                         interval=float(os.getenv('METRICS_INTERVAL', '3')),
+                         alpha=float(os.getenv('METRICS_ALPHA', '0.3')))
+
+# ====== Prometheus /metrics ======
+# 计数器和直方图在请求/step/对端调用/LLM 调用的路径上直接记录（一次加锁加法），一直开着；
+# 队列深度、在途数、TASK_STORE 大小等 gauge 在抓取时才读取
+PROM = Registry()
+PROM_HTTP_REQUESTS = PROM.counter('echonet_http_requests_total', 'HTTP requests served.', ('route', 'method', 'status'))
+PROM_HTTP_SECONDS = PROM.histogram('echonet_http_request_duration_seconds', 'HTTP request latency.', ('route',))
+PROM_STEPS = PROM.counter('echonet_steps_total', 'Pipeline steps by op and outcome.', ('op', 'where', 'outcome'))
+PROM_STEP_SECONDS = PROM.histogram('echonet_step_duration_seconds',
+                                   'Step latency: local and remote are steps this node dispatched, '
+                                   'served are steps run for a peer.', ('op', 'where'))
+PROM_PEER_REQUESTS = PROM.counter('echonet_peer_requests_total', 'Calls to other nodes.', ('peer', 'route', 'status'))
+PROM_PEER_SECONDS = PROM.histogram('echonet_peer_request_duration_seconds', 'Latency of calls to other nodes.',
+                                   ('peer', 'route'))
+PROM_LLM_SECONDS = PROM.histogram('echonet_llm_request_duration_seconds', 'OpenAI chat completion latency.',
+                                  ('model', 'outcome'))
+PROM_LLM_TOKENS = PROM.counter('echonet_llm_tokens_total', 'OpenAI tokens used.', ('model', 'kind'))
+PROM_DISCOVERY = PROM.counter('echonet_discovery_events_total', 'mDNS discovery events.', ('event',))
+PROM.gauge('echonet_admission_running', 'Steps executing on this node.', lambda: ADMISSION.snapshot()[0])
+PROM.gauge('echonet_admission_queued', 'Steps waiting for an execution slot.', lambda: ADMISSION.snapshot()[1])
+PROM.gauge('echonet_admission_max_concurrency', 'Execution slots on this node.', lambda: ADMISSION.max_concurrency)
+
+
+def _prom_inflight():
+    with INFLIGHT_LOCK:
+        return dict(INFLIGHT)
+
+
+PROM.gauge('echonet_inflight_steps', 'Steps this node has dispatched and not yet finished, per target node.',
+           _prom_inflight, ('node',))
+PROM.gauge('echonet_task_queue_depth', 'Tasks waiting for a task worker, per user.',
+           lambda: {user: s['queued'] for user, s in FAIR.stats().items()}, ('user',))
+PROM.gauge('echonet_task_store_tasks', 'Tasks held in TASK_STORE.', lambda: TASK_STORE.stats()['tasks'])
+PROM.gauge('echonet_task_store_active', 'Tasks in TASK_STORE that have not finished.',
+           lambda: TASK_STORE.stats()['active'])
+PROM.gauge('echonet_known_nodes', 'Nodes in the node table (including this one).', lambda: len(NODES))
+
+
+def _peer_label(url):
+    """(peer, route) labels for a peer URL; the path is cut to its first segment to bound cardinality."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}", '/' + parts.path.strip('/').split('/', 1)[0]
+
+
+@contextmanager
+def _observe_step(op, where):
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        PROM_STEP_SECONDS.observe(time.perf_counter() - started, op, where)
+        PROM_STEPS.inc(op, where, outcome)
+
+
+def _observe_llm(model, call):
+    """Run one chat completion call in an `llm` span, recording its latency and token usage."""
+    with TRACER.span('llm', model=model) as span:
+        started = time.perf_counter()
+        try:
+            resp = call()
+        except Exception:
+            PROM_LLM_SECONDS.observe(time.perf_counter() - started, model, 'error')
+            raise
+        PROM_LLM_SECONDS.observe(time.perf_counter() - started, model, 'ok')
+        _count_tokens(model, resp, span)
+        return resp
+
+
+def _count_tokens(model, resp, span=None):
+    usage = getattr(resp, 'usage', None)
+    if usage is not None:
+        prompt = getattr(usage, 'prompt_tokens', 0) or 0
+        completion = getattr(usage, 'completion_tokens', 0) or 0
+        PROM_LLM_TOKENS.inc(model, 'prompt', amount=prompt)
+        PROM_LLM_TOKENS.inc(model, 'completion', amount=completion)
+        if span is not None:
+            span.update(prompt_tokens=prompt, completion_tokens=completion)
+
+
+# ====== 分布式追踪：/task 生成 trace id，经 traceparent 头传到每一跳（见 tracing.py） ======
+# TRACING=0 关闭；TRACE_FILE 追加 JSON lines，TRACE_OTLP_ENDPOINT 发给 OTLP/HTTP collector
+TRACING = os.getenv('TRACING', '1') not in ('0', 'false', 'no')
+TRACE_EXPORTERS = []
+if os.getenv('TRACE_FILE'):
+    TRACE_EXPORTERS.append(JsonlExporter(os.getenv('TRACE_FILE')))
+if os.getenv('TRACE_OTLP_ENDPOINT'):
+    TRACE_EXPORTERS.append(OtlpExporter(os.getenv('TRACE_OTLP_ENDPOINT'), service=os.getenv('TRACE_SERVICE_NAME', 'echonet')))
+TRACER = Tracer(SELF_ID, TRACING, TRACE_EXPORTERS)
+
+
+@contextmanager
+def _trace_span(trace, name, **attrs):
+    """A span directly under `trace`'s root (for handlers that are not inside TRACER.activate)."""
+    with TRACER.activate(trace), TRACER.span(name, **attrs) as span:
+        yield span
+
+
+def _with_spans(body, trace):
+    """Peer side: close the request's trace and hand its spans back to the caller in the reply body."""
+    if trace is not None:
+        body['spans'] = TRACER.finish(trace, export=False)['spans']
+    return body
+
+
+def _observe_request(route, method, status, seconds):
+    PROM_HTTP_SECONDS.observe(seconds, route)
+    PROM_HTTP_REQUESTS.inc(route, method, str(status))
+
+
+@app.before_request
+def _prom_request_started():
+    request.environ['echonet.started'] = time.perf_counter()
+
+
+@app.after_request
+def _prom_request_done(response):
+    # 路由模板（/result/<task_id>）而不是实际路径，避免标签无限增长；流式应答记录的是开始返回的时间
+    started = request.environ.get('echonet.started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        _observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
+
+
+@contextmanager
+def _track_inflight(node_id, n=1):
+    with INFLIGHT_LOCK:
+        INFLIGHT[node_id] = INFLIGHT.get(node_id, 0) + n
+    try:
+        yield
+    finally:
+        with INFLIGHT_LOCK:
+            INFLIGHT[node_id] = max(0, INFLIGHT.get(node_id, n) - n)
+
+
+def _to_float(v):
+    try:
+        return float(v) if v is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _node_load_ratio(node):
+    """Return load as a 0..1 ratio. `load` is numeric (with `max_load`); older peers may still
+    advertise a "current / max" string."""
+    load = node.get('load')
+    if isinstance(load, str) and '/' in load:
+        cur, _, mx = load.partition('/')
+        cur, mx = _to_float(cur.strip()), _to_float(mx.strip())
+    else:
+        cur, mx = _to_float(load), _to_float(node.get('max_load'))
+    if cur is None:
+        return None
+    if mx:
+        return max(0.0, cur / mx)
+    # 没有上限信息时按百分比理解（本节点广播的 load 就是 CPU 百分比）
+    return max(0.0, cur / 100.0)
+
+
+def node_score(node):
+    """越小越好：在途 step 数为主，再叠加广播的 load/cpu/health（缺失的指标不计分）。"""
+    with INFLIGHT_LOCK:
+        score = float(INFLIGHT.get(node.get('id'), 0))
+    load = _node_load_ratio(node)
+    if load is not None:
+        score += load
+    cpu = _to_float(node.get('cpu'))
+    if cpu is not None:
+        score += 0.5 * cpu / 100.0
+    health = _to_float(node.get('health'))
+    if health is not None:
+        score += 1.0 - max(0.0, min(1.0, health))
+    return score
+
+
+# ====== 调度策略（可插拔）：candidates 列表 -> 选中的节点 ======
+def _policy_first(candidates):
+    return candidates[0]
+
+
+def _policy_random(candidates):
+    return random.choice(candidates)
+
+
+def _policy_least_loaded(candidates):
+    return min(candidates, key=node_score)
+
+
+def _policy_p2c(candidates):
+    """Power-of-two-choices: sample two candidates, keep the less loaded one."""
+    if len(candidates) == 1:
+        return candidates[0]
+    a, b = random.sample(candidates, 2)
+    return a if node_score(a) <= node_score(b) else b
+
+
+PLACEMENT_POLICIES = {
+    'first': _policy_first,
+    'random': _policy_random,
+    'least_loaded': _policy_least_loaded,
+    'p2c': _policy_p2c,
+}
+
+PLACEMENT_POLICY = os.getenv('PLACEMENT_POLICY', 'p2c')
+if PLACEMENT_POLICY not in PLACEMENT_POLICIES:
+    print(f"⚠️ unknown PLACEMENT_POLICY={PLACEMENT_POLICY}; falling back to p2c")
+    PLACEMENT_POLICY = 'p2c'
+
+
+def register_placement_policy(name, fn):
+    """注册自定义调度策略：fn(candidates) -> node"""
+    PLACEMENT_POLICIES[name] = fn
+
+
+# ====== 工具：根据 op 找一个有这个技能的节点 ======
+def choose_node_for_op(op, policy=None, exclude=()):
+    """Return (node, policy_name) for `op`, or (None, None) if nobody can run it.
+
+    Nodes whose id is in `exclude` are skipped (failover after a failed attempt), and
+    so are peers whose circuit breaker is open; if that leaves nobody, the policy
+    name is 'circuit_open'.
+    """
+    with NODES_LOCK:
+        capable = [n for n in NODES if op in n.get("skills", []) and n.get('id') not in exclude]
+    candidates = [n for n in capable if _circuit_ok(n)]
+    if capable and not candidates and not (op in SKILL_IMPL and SELF_ID not in exclude):
+        return None, 'circuit_open'
+    if not candidates:
+        # 如果没有节点声明该技能，但当前进程实现了这个 op，则退回到本地执行
+        if op in SKILL_IMPL and SELF_ID not in exclude:
+            for n in NODES:
+                if n.get('id') == SELF_ID:
+                    return n, 'local_fallback'
+        return None, None
+    name = policy or PLACEMENT_POLICY
+    return PLACEMENT_POLICIES[name](candidates), name
+
+
+def find_node_for_op(op, policy=None):
+    return choose_node_for_op(op, policy)[0]
+
+# ====== 任务执行（同步 / 异步共用） ======
+class PipelineError(Exception):
+    """A pipeline step failed; carries the HTTP status and JSON body to report."""
+
+    def __init__(self, status, body):
+        super().__init__(body.get('error'))
+        self.status = status
+        self.body = body
+
+
+class PeerError(PipelineError):
+    """A remote node failed to run a step (unreachable, overloaded or non-200); worth failing over."""
+
+
+class SegmentError(PeerError):
+    """A remote segment failed. `done` is how many of its steps finished on the peer (None when
+    unknown, e.g. the connection failed), `state` the state they produced."""
+
+    def __init__(self, status, body, done=None, state=None):
+        super().__init__(status, body)
+        self.done = done
+        self.state = state
+
+
+# TASK_STORE 的状态变更都通过 _update_task，便于 /result?wait=N 长轮询被唤醒
+TASK_COND = threading.Condition()
+TASK_FINAL_STATUSES = ('done', 'failed')
+
+
+def _update_task(task_id, **fields):
+    TASK_STORE.update(task_id, **fields)
+    with TASK_COND:
+        TASK_COND.notify_all()
+
+
+# ====== State 传输：大值按内容寻址，应答只带变化的键（协议见 state_transfer.py） ======
+# STATE_TRANSFER=full 时总是发送/接收完整 state
+STATE_TRANSFER = os.getenv('STATE_TRANSFER', 'delta')
+BLOB_STORE = BlobStore()
+PEER_BLOBS = PeerBlobIndex()
+
+
+def _post_state(target_node, url, payload, state, **kwargs):
+    """POST `payload` + `state` to a peer, using delta transfer unless disabled.
+
+    Returns (resp, hashes of large values sent in full). A 409 listing missing
+    blobs is answered once by resending those values inline.
+    """
+    if STATE_TRANSFER != 'delta':
+        return _peer_post(url, dict(payload, state=state), **kwargs), []
+    peer = target_node['url']
+    for _ in range(2):
+        with TRACER.span('serialize', codec='delta'):
+            wire, sent = PEER_BLOBS.encode(peer, state)
+        resp = _peer_post(url, dict(payload, state=wire, transfer='delta'), **kwargs)
+        if resp.status_code != 409:
+            break
+        try:
+            missing = decode_response(resp).get('missing') or []
+        except Exception:
+            break
+        PEER_BLOBS.forget(peer, missing)
+    return resp, sent
+
+
+def _raise_if_overloaded(target_node, resp):
+    """Turn a peer's 429 into PipelineError(429) carrying its Retry-After."""
+    if resp.status_code != 429:
+        return
+    try:
+        retry_after = int(resp.headers.get('Retry-After') or 1)
+    except ValueError:
+        retry_after = 1
+    raise PeerError(429, {"error": f"remote node {target_node['id']} is overloaded", "retry_after": retry_after})
+
+
+def _state_from_reply(target_node, body, state, sent):
+    """Rebuild the full state from a peer reply (delta or full); the peer's spans join the current trace."""
+    TRACER.merge(body.get('spans'))
+    if body.get('transfer') != 'delta':
+        return body.get('state', state)
+    with TRACER.span('deserialize', codec='delta'):
+        new_state = apply_delta(state, body.get('delta'), body.get('removed'))
+    # 对端在 delta 模式下会保存它见过的所有大值，下次只需发送哈希
+    PEER_BLOBS.learn(target_node['url'], sent + BlobStore.large_hashes(new_state))
+    return new_state
+
+
+def _receive_state(data):
+    """Peer side: return (state, fingerprint or None). Raises MissingBlobs."""
+    if data.get('transfer') == 'delta':
+        state = decode_state(data.get('state') or {}, BLOB_STORE)
+        return state, fingerprint(state)
+    return data.get('state', {}), None
+
+
+def _state_reply_body(state, before, **extra):
+    """Peer side: only the changed keys if the caller used delta transfer, else the full state."""
+    if before is None:
+        return dict(extra, state=state)
+    BLOB_STORE.remember(state)
+    delta, removed = make_delta(before, state)
+    return dict(extra, delta=delta, removed=removed, transfer='delta')
+
+
+# ====== 流式执行：step 事件 + LLM token 增量 ======
+NDJSON = 'application/x-ndjson'
+
+
+class TaskEvents:
+    """Event queue of one streaming task (/task/stream): step_started / delta / step_done."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.queue = queue.Queue()
+
+    def emit(self, event, **data):
+        self.queue.put((event, data))
+
+    def _index(self, step):
+        for i, s in enumerate(self.pipeline):
+            if s is step:
+                return i
+        return None
+
+    def run(self, step, fn):
+        """Run one step with its LLM deltas routed into this task's events."""
+        i, op = self._index(step), step['op']
+        self.emit('step_started', index=i, op=op, executed_by=step.get('executed_by'))
+        token = LLM_STREAM.set(lambda text: self.emit('delta', index=i, op=op, text=text))
+        try:
+            state = fn()
+        finally:
+            LLM_STREAM.reset(token)
+        done = {'index': i, 'op': op, 'executed_by': step.get('executed_by'), 'duration_ms': step.get('duration_ms')}
+        if step.get('coalesced'):
+            done['coalesced'] = True
+        self.emit('step_done', **done)
+        return state
+
+
+STEP_EVENTS = contextvars.ContextVar('step_events', default=None)
+
+
+def _stream_ndjson(fn):
+    """Peer side: run fn() in a thread, yielding its LLM deltas and then its result as NDJSON.
+
+    Lines are {"event": "delta", "text"}, then {"event": "result", ...fn()} or
+    {"event": "error", "status", "error", "detail"}.
+    """
+    lines = queue.Queue()
+
+    def worker():
+        LLM_STREAM.set(lambda text: lines.put({'event': 'delta', 'text': text}))
+        try:
+            lines.put(dict(fn(), event='result'))
+        except PipelineError as e:
+            lines.put(dict(e.body, event='error', status=e.status))
+        except Exception as e:
+            lines.put({'event': 'error', 'status': 500, 'error': 'skill failed', 'detail': str(e)})
+
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        line = lines.get()
+        yield json.dumps(line, ensure_ascii=False) + '\n'
+        if line['event'] != 'delta':
+            return
+
+
+def _relay_stream(target_node, resp, on_delta):
+    """Coordinator side: forward a peer's NDJSON deltas to `on_delta`, return its result body."""
+    for raw in resp.iter_lines():
+        if not raw:
+            continue
+        line = json.loads(raw)
+        event = line.pop('event', None)
+        if event == 'delta':
+            on_delta(line.get('text', ''))
+        elif event == 'result':
+            return line
+        elif event == 'error':
+            raise PeerError(500, {"error": f"remote node {target_node['id']} failed execute_step", "detail": line})
+    raise PeerError(502, {"error": f"remote node {target_node['id']} closed the stream without a result"})
+
+
+def _place_step(step, policy=None):
+    """Pick the node for one step and annotate it with `executed_by` / `placement`.
+
+    Raises PipelineError(400) if no node can handle the op.
+    """
+    op = step["op"]
+
+    # 如果调用方/AI 指定了 target_node 且该节点存在且声明了此技能，则优先使用
+    specified = step.get("target_node")
+    target_node = None
+    placement = None
+    if specified:
+        for n in NODES:
+            if n['id'] == specified and op in n.get('skills', []) and _circuit_ok(n):
+                target_node = n
+                placement = 'target_node'
+                break
+
+    # 否则按照调度策略选择节点
+    if target_node is None:
+        target_node, placement = choose_node_for_op(op, policy)
+    if target_node is None:
+        if placement == 'circuit_open':
+            raise PipelineError(503, {"error": f"every node that can handle op={op} has an open circuit breaker"})
+        raise PipelineError(400, {"error": f"no node can handle op={op}"})
+    # 记录哪个节点将要执行这一步（或已经执行），以及是哪个策略选中的
+    step['executed_by'] = target_node['id']
+    step['placement'] = placement
+    return target_node
+
+
+# ====== Singleflight：相同 (op, params, state) 的并发执行只跑一次，其余调用方共享结果 ======
+SINGLEFLIGHT = os.getenv('SINGLEFLIGHT', '1') not in ('0', 'false', 'no')
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key onto one in-flight execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [Future, follower count]
+        self.leaders = 0
+        self.coalesced = 0
+        self.waiting = 0
+
+    def do(self, key, fn):
+        """Return (result, shared). Followers get a private deep copy of the leader's result."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = [Future(), 0]
+                self.leaders += 1
+                leader = True
+            else:
+                call[1] += 1
+                self.coalesced += 1
+                self.waiting += 1
+                leader = False
+
+        if not leader:
+            try:
+                return copy.deepcopy(call[0].result()), True
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                self._calls.pop(key, None)
+            call[0].set_exception(e)
+            raise
+        with self._lock:
+            self._calls.pop(key, None)
+            followers = call[1]
+        # 只有存在等待者时才做快照：leader 之后还会原地修改自己的 state
+        call[0].set_result(copy.deepcopy(result) if followers else None)
+        return result, False
+
+    def record(self, shared):
+        """Count a leader (shared=False) or coalesced call made outside `do` (net_async.py)."""
+        with self._lock:
+            if shared:
+                self.coalesced += 1
+            else:
+                self.leaders += 1
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': SINGLEFLIGHT, 'leaders': self.leaders, 'coalesced': self.coalesced,
+                    'waiting': self.waiting, 'in_flight': len(self._calls)}
+
+
+STEP_FLIGHTS = SingleFlight()
+
+
+def _step_key(op, params, state):
+    raw = json.dumps({'op': op, 'params': params, 'state': state}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _coalescible(params):
+    return SINGLEFLIGHT and params.get('coalesce', True) is not False
+
+
+# ====== 幂等执行：记住最近执行过的 step_id，重试的 step 直接返回上次的结果，不再调用 LLM ======
+STEP_DEDUP_MAX = int(os.getenv('STEP_DEDUP_MAX', '256'))
+STEP_DEDUP_TTL = float(os.getenv('STEP_DEDUP_TTL', '600'))
+
+
+class StepResults:
+    """Recent results by step id (LRU + TTL); a step id still running is joined, not re-run.
+
+    Results are stored and handed out as copies: segment steps keep mutating their state.
+    """
+
+    def __init__(self, max_entries=STEP_DEDUP_MAX, ttl=STEP_DEDUP_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._done = OrderedDict()  # step_id -> (finished_at, state)
+        self._flights = SingleFlight()
+        self.hits = 0
+
+    def get(self, step_id):
+        """The stored result for step_id, or None."""
+        with self._lock:
+            entry = self._done.get(step_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._done[step_id]
+                return None
+            self._done.move_to_end(step_id)
+            self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def put(self, step_id, state):
+        state = copy.deepcopy(state)
+        with self._lock:
+            self._done[step_id] = (time.monotonic(), state)
+            self._done.move_to_end(step_id)
+            while len(self._done) > self.max_entries:
+                self._done.popitem(last=False)
+
+    def do(self, step_id, fn):
+        """Return (state, deduplicated): a stored or in-flight result for step_id, else fn()."""
+        state = self.get(step_id)
+        if state is not None:
+            return state, True
+
+        def run():
+            result = fn()
+            self.put(step_id, result)
+            return result
+
+        state, shared = self._flights.do(step_id, run)
+        if shared:
+            self.note_joined()
+        return state, shared
+
+    def note_joined(self):
+        """Count a step id joined in flight, here or outside `do` (net_async.py)."""
+        with self._lock:
+            self.hits += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._done), 'max_entries': self.max_entries, 'ttl': self.ttl, 'hits': self.hits}
+
+
+STEP_RESULTS = StepResults()
+
+
+def _execute_on_node(target_node, step, state):
+    """Execute one already-placed step, emitting step events if the task is streaming."""
+    events = STEP_EVENTS.get()
+    if events is not None:
+        return events.run(step, lambda: _execute_coalesced(target_node, step, state))
+    return _execute_coalesced(target_node, step, state)
+
+
+def _execute_coalesced(target_node, step, state):
+    """Execute one already-placed step, sharing the result with identical concurrent steps."""
+    params = step.get("params", {})
+    if not _coalescible(params):
+        return _dispatch_hedged(target_node, step, state)
+
+    started = time.perf_counter()
+    (state, executed_by), shared = STEP_FLIGHTS.do(
+        _step_key(step["op"], params, state),
+        lambda: (_dispatch_hedged(target_node, step, state), step['executed_by']),
+    )
+    if shared:
+        step['executed_by'] = executed_by
+        step['coalesced'] = True
+        step['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return state
+
+
+def _hedge_backup_node(target_node, step):
+    """Second candidate for hedging a remote step, or None when the step should not be hedged."""
+    if not HEDGE_STEPS or target_node["id"] == SELF_ID or step.get('placement') == 'target_node':
+        return None
+    # 流式任务不对冲：两份 token 增量会交错出现在同一个流里
+    if LLM_STREAM.get() is not None:
+        return None
+    return choose_node_for_op(step["op"], exclude={target_node["id"]})[0]
+
+
+def _dispatch_hedged(target_node, step, state):
+    """_dispatch_step, plus a backup on a second candidate if the step runs past its usual latency.
+
+    Each attempt works on its own copy of the step dict; the winner's fields are merged back.
+    """
+    backup_node = _hedge_backup_node(target_node, step)
+    if backup_node is None and not HEDGE_STEPS:
+        return _dispatch_step(target_node, step, state)
+
+    def attempt(node, st):
+        own = dict(step, executed_by=node["id"])
+        return _dispatch_step(node, own, st), own
+
+    backup = None
+    if backup_node is not None:
+        # 远端执行不修改传入的 state；本地执行会原地修改，给它一份独立的副本
+        backup = lambda: attempt(backup_node, copy.deepcopy(state) if backup_node["id"] == SELF_ID else state)
+    (state, done), hedge = STEP_HEDGER.run(step["op"], lambda: attempt(target_node, state), backup)
+    step.update(done)
+    if hedge is not None:
+        step['hedged'] = {'backup': backup_node["id"], 'winner': hedge}
+    return state
+
+
+def _dispatch_step(target_node, step, state):
+    """Execute one already-placed step on `target_node` and return the updated state."""
+    op = step["op"]
+    params = step.get("params", {})
+    # 预算已经用完就不再开始这一步
+    _check_deadline(f"before step {op}")
+    started = time.perf_counter()
+    # 在途计数供调度策略参考
+    where = 'local' if target_node["id"] == SELF_ID else 'remote'
+    with _track_inflight(target_node["id"]), _observe_step(op, where), \
+            TRACER.span('step', op=op, node=target_node["id"], where=where):
+        if target_node["id"] == SELF_ID:
+            # 本机有这个技能 → 本地执行
+            impl = SKILL_IMPL.get(op)
+            if impl is None:
+                raise PipelineError(500, {"error": f"skill {op} not implemented on this node"})
+            # 计入本节点的并发/排队数，但不拒绝（任务已经在执行中）；排队最多等到 deadline
+            try:
+                with TRACER.span('admission'):
+                    admitted = ADMISSION.acquire(False, *_admission_args(), timeout=_remaining())
+            except Overloaded:
+                raise _deadline_error(f"waiting for an execution slot for {op}")
+            try:
+                with TRACER.span('skill', op=op):
+                    state = impl(state, params)
+            finally:
+                ADMISSION.release(admitted)
+        else:
+            # 交给别的节点执行这一步：
+            # 首先优先使用远端声明的 execute_step（如果目标声明了该 op），
+            # 否则回退到远端的 /run_prompt，让远端使用 ai_execute 或其内部逻辑处理自然语言提示。
+            remote_base = target_node["url"].rstrip('/')
+            # 如果目标节点声明了该技能，尽量调用 execute_step
+            if op in target_node.get('skills', []):
+                url = remote_base + "/execute_step"
+                payload = _with_user({"op": op, "params": params})
+                if step.get('step_id'):
+                    payload["step_id"] = step['step_id']
+                # 流式任务：请对端以 NDJSON 转发 token 增量（旧节点忽略 stream，照常整体应答）
+                on_delta = LLM_STREAM.get()
+                if on_delta is not None:
+                    payload["stream"] = True
+                try:
+                    resp, sent = _post_state(target_node, url, payload, state, stream=on_delta is not None)
+                except Exception as e:
+                    raise PeerError(500, {"error": f"remote node {target_node['id']} failed to connect to execute_step", "detail": str(e)})
+                _raise_if_overloaded(target_node, resp)
+                if resp.status_code != 200:
+                    raise PeerError(500, {"error": f"remote node {target_node['id']} failed execute_step", "detail": resp.text})
+                if on_delta is not None and resp.headers.get('Content-Type', '').startswith(NDJSON):
+                    try:
+                        body = _relay_stream(target_node, resp, on_delta)
+                    except ValueError:
+                        raise PeerError(502, {"error": "invalid NDJSON from remote execute_step"})
+                else:
+                    try:
+                        body = decode_response(resp)
+                    except Exception:
+                        raise PeerError(502, {"error": "invalid JSON from remote execute_step", "detail": resp.text})
+                if body.get('deduplicated'):
+                    step['deduplicated'] = True
+                state = _state_from_reply(target_node, body, state, sent)
+            else:
+                # 回退：构造一个简短的 prompt 发给远端 /run_prompt
+                url = remote_base + "/run_prompt"
+                prompt = f"Perform operation '{op}' with params {json.dumps(params)} on the provided state and return the full updated state as JSON."
+                payload = _with_user({"prompt": prompt, "state": state, "op": op, "params": params})
+                try:
+                    _check_deadline()
+                    resp = _breaker_call(url, lambda: PEER_POOL.post(
+                        url, json=payload, headers=TRACER.headers(_deadline_headers()), timeout=_hop_timeout()))
+                except Exception as e:
+                    raise PeerError(500, {"error": f"remote node {target_node['id']} failed to connect (run_prompt)", "detail": str(e)})
+                _raise_if_overloaded(target_node, resp)
+                if resp.status_code != 200:
+                    raise PeerError(500, {"error": f"remote node {target_node['id']} failed run_prompt", "detail": resp.text})
+                try:
+                    body = resp.json()
+                    TRACER.merge(body.get("spans"))
+                    state = body.get("state", state)
+                except Exception:
+                    raise PeerError(502, {"error": "invalid JSON from remote run_prompt", "detail": resp.text})
+    step['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return state
+
+
+# ====== 失败转移：远端失败（连不上 / 429 / 非 200）时退避后换下一个候选节点重试 ======
+STEP_RETRIES = int(os.getenv('STEP_RETRIES', '2'))
+STEP_RETRY_BACKOFF = float(os.getenv('STEP_RETRY_BACKOFF', '0.2'))
+FAILOVER_STATS = {'retries': 0, 'failovers': 0, 'exhausted': 0}
+FAILOVER_LOCK = threading.Lock()
+
+
+def _count_failover(key):
+    with FAILOVER_LOCK:
+        FAILOVER_STATS[key] += 1
+
+
+def _retry_delay(attempt, error):
+    """Exponential backoff with jitter; a peer's Retry-After is used as a cap, not waited out in full.
+
+    Raises PipelineError(504) instead if the deadline would pass before the retry.
+    """
+    delay = STEP_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5)
+    delay = min(delay, float(error.body.get('retry_after') or 5))
+    left = _remaining()
+    if left is not None and left <= delay:
+        raise _deadline_error(f"no time left to retry after: {error.body.get('error')}")
+    return delay
+
+
+def _next_node(step, policy, failed, node):
+    """Next-best candidate that has not failed this step yet, else the same node again
+    (the peer deduplicates by step_id, so a step it already finished is not paid for twice)."""
+    nxt, _ = choose_node_for_op(step["op"], policy, exclude=failed)
+    return nxt or node
+
+
+def _record_attempt(step, node, error, nxt):
+    """Note a failed attempt in the returned pipeline; returns True if it failed over to another node."""
+    step['retries'] = step.get('retries', 0) + 1
+    step.setdefault('failed_attempts', []).append(
+        {'node': node['id'], 'status': error.status, 'error': error.body.get('error')})
+    _count_failover('retries')
+    moved = nxt['id'] != node['id']
+    if moved:
+        step['executed_by'] = nxt['id']
+        _count_failover('failovers')
+    events = STEP_EVENTS.get()
+    if events is not None:
+        events.emit('step_retry', index=events._index(step), op=step['op'], failed_node=node['id'],
+                    next_node=nxt['id'], status=error.status, error=error.body.get('error'))
+    return moved
+
+
+def _execute_with_failover(step, state, policy=None, node=None, failed=()):
+    """Execute one step, retrying remote failures (PeerError) on the next-best candidate.
+
+    Up to STEP_RETRIES retries with exponential backoff; the last error is raised
+    when they are used up. Local skill errors are not retried.
+    """
+    node = node or _place_step(step, policy)
+    step.setdefault('step_id', uuid.uuid4().hex)
+    failed = set(failed)
+    for attempt in range(STEP_RETRIES + 1):
+        try:
+            return _execute_on_node(node, step, state)
+        except PeerError as e:
+            _check_deadline(e.body.get('error'))
+            if attempt == STEP_RETRIES:
+                _count_failover('exhausted')
+                raise
+            failed.add(node['id'])
+            nxt = _next_node(step, policy, failed, node)
+            _record_attempt(step, node, e, nxt)
+            time.sleep(_retry_delay(attempt, e))
+            node = nxt
+
+
+def _run_step(step, state, policy=None):
+    """Place and execute one pipeline step (with failover), returning the updated state."""
+    return _execute_with_failover(step, state, policy)
+
+
+# ====== Segment：连续落在同一远端节点的 step 一次往返发过去 ======
+SEGMENT_EXECUTION = os.getenv('SEGMENT_EXECUTION', '1') not in ('0', 'false', 'no')
+
+
+def _is_remote_skill(node, op):
+    return node['id'] != SELF_ID and op in node.get('skills', [])
+
+
+def _segment_step(step):
+    out = {"op": step["op"], "params": step.get("params", {})}
+    if step.get('step_id'):
+        out["step_id"] = step['step_id']
+    return out
+
+
+def _execute_segment_on_node(target_node, steps, state):
+    """Ship consecutive steps to one remote node via /execute_segment (one round trip)."""
+    url = target_node["url"].rstrip('/') + "/execute_segment"
+    payload = _with_user({"steps": [_segment_step(s) for s in steps]})
+    with _track_inflight(target_node["id"], len(steps)), \
+            TRACER.span('segment', node=target_node["id"], ops=','.join(s["op"] for s in steps)):
+        try:
+            resp, sent = _post_state(target_node, url, payload, state)
+        except Exception as e:
+            raise SegmentError(500, {"error": f"remote node {target_node['id']} failed to connect to execute_segment", "detail": str(e)})
+        _raise_if_overloaded(target_node, resp)
+        try:
+            body = decode_response(resp)
+        except Exception:
+            raise SegmentError(502, {"error": "invalid JSON from remote execute_segment", "detail": resp.text})
+    for step, t in zip(steps, body.get("timings", [])):
+        step['duration_ms'] = t.get('duration_ms')
+        if t.get('deduplicated'):
+            step['deduplicated'] = True
+    if resp.status_code != 200:
+        # 失败应答带 failed_index 和到那一步为止的完整 state：之前的 step 已经完成，不用重跑
+        done, partial = body.get('failed_index'), body.get('state')
+        if not isinstance(done, int) or not 0 <= done <= len(steps) or not isinstance(partial, dict):
+            done, partial = 0, None
+        raise SegmentError(500, {"error": f"remote node {target_node['id']} failed execute_segment", "detail": body},
+                           done, partial)
+    return _state_from_reply(target_node, body, state, sent)
+
+
+def _retry_segment(node, group, state, policy, error, progress=None):
+    """A segment failed: keep the steps the peer finished and fail over only from the failed one.
+
+    Without a reply (connection error) the peer's progress is unknown, so the segment is first
+    resent to the same node, which replays finished steps by step_id instead of running them again.
+    progress(k, state) is called whenever the first k steps of the group are done.
+    """
+    if getattr(error, 'done', 0) is None:
+        time.sleep(_retry_delay(0, error))
+        try:
+            return _execute_segment_on_node(node, group, state)
+        except PeerError as e:
+            error = e
+    done = getattr(error, 'done', 0) or 0
+    if done:
+        state = error.state
+        if progress is not None:
+            progress(done, state)
+    for k, step in enumerate(group):
+        if k < done:
+            continue
+        step.pop('segment', None)
+        if k == done:
+            # 失败的那一步换节点重试；之后的 step 还没有执行过，重新放置即可
+            time.sleep(_retry_delay(0, error))
+            nxt = _next_node(step, policy, {node['id']}, node)
+            _record_attempt(step, node, error, nxt)
+            state = _execute_with_failover(step, state, policy, nxt, failed={node['id']})
+        else:
+            state = _execute_with_failover(step, state, policy)
+        if progress is not None:
+            progress(k + 1, state)
+    return state
+
+
+def _run_sequence(steps, state, policy=None, start=0, save=None):
+    """Run steps[start:] strictly in order, grouping consecutive steps that land on the
+    same remote node into a single /execute_segment call.
+
+    save({'next', 'state'}) is called with the progress after every step (or segment).
+    """
+    placed = [None] * len(steps)
+    i = start
+    while i < len(steps):
+        node = placed[i] or _place_step(steps[i], policy)
+        group = [steps[i]]
+        # 流式任务逐步执行，这样每一步的 token 都能实时转发
+        if SEGMENT_EXECUTION and STEP_EVENTS.get() is None and _is_remote_skill(node, steps[i]["op"]):
+            j = i + 1
+            while j < len(steps):
+                placed[j] = _place_step(steps[j], policy)
+                if placed[j]['id'] != node['id'] or not _is_remote_skill(node, steps[j]["op"]):
+                    break
+                group.append(steps[j])
+                j += 1
+        if len(group) > 1:
+            for step in group:
+                step['segment'] = i
+            try:
+                state = _execute_segment_on_node(node, group, state)
+            except PeerError as e:
+                # 段内失败：已完成的 step 保留结果，从失败的那一步起逐步失败转移
+                def progress(k, st, i=i):
+                    if save is not None and i + k < len(steps):
+                        save({'next': i + k, 'state': st})
+                state = _retry_segment(node, group, state, policy, e, progress)
+        else:
+            state = _execute_with_failover(steps[i], state, policy, node)
+        i += len(group)
+        if save is not None and i < len(steps):
+            save({'next': i, 'state': state})
+    return state
+
+
+# ====== DAG：step 可以带 depends_on，独立的 step 并行执行 ======
+DAG_MAX_PARALLEL = int(os.getenv('DAG_MAX_PARALLEL', '8'))
+STEP_EXECUTOR = ThreadPoolExecutor(max_workers=DAG_MAX_PARALLEL, thread_name_prefix='step')
+
+
+def _is_dag(pipeline):
+    return any(isinstance(step, dict) and 'depends_on' in step for step in pipeline)
+
+
+def _dag_plan(pipeline):
+    """Validate a DAG pipeline and return (ids, deps), where deps[i] is the set of
+    step indexes step i depends on. Steps without `id` are named `step<i>`; steps
+    without `depends_on` are roots. Raises PipelineError(400) on bad edges/cycles.
+    """
+    ids = []
+    for i, step in enumerate(pipeline):
+        sid = str(step.get('id') or f'step{i}')
+        if sid in ids:
+            raise PipelineError(400, {'error': f'duplicate step id {sid}'})
+        ids.append(sid)
+    index = {sid: i for i, sid in enumerate(ids)}
+
+    deps = []
+    for i, step in enumerate(pipeline):
+        edges = step.get('depends_on') or []
+        if isinstance(edges, str):
+            edges = [edges]
+        if not isinstance(edges, list):
+            raise PipelineError(400, {'error': f'step {ids[i]}: depends_on must be a list of step ids'})
+        d = set()
+        for e in edges:
+            if str(e) not in index:
+                raise PipelineError(400, {'error': f'step {ids[i]}: depends_on unknown step {e}'})
+            d.add(index[str(e)])
+        deps.append(d)
+
+    # Kahn 拓扑排序检查环
+    remaining = {i: set(d) for i, d in enumerate(deps)}
+    while remaining:
+        ready = [i for i, d in remaining.items() if not d]
+        if not ready:
+            raise PipelineError(400, {'error': 'depends_on contains a cycle', 'steps': sorted(ids[i] for i in remaining)})
+        for i in ready:
+            del remaining[i]
+        for d in remaining.values():
+            d.difference_update(ready)
+    return ids, deps
+
+
+def _state_delta(before, after):
+    """Keys added or changed by a step (deleted keys are not propagated)."""
+    return {k: v for k, v in after.items() if k not in before or before[k] != v}
+
+
+def _dag_ancestors(deps):
+    """Transitive closure of `deps`: ancestors[i] is every step index step i (indirectly) needs."""
+    ancestors = []
+    for i in range(len(deps)):
+        seen, todo = set(), list(deps[i])
+        while todo:
+            j = todo.pop()
+            if j not in seen:
+                seen.add(j)
+                todo.extend(deps[j])
+        ancestors.append(seen)
+    return ancestors
+
+
+def _dag_input_state(state, ancestors, deltas):
+    """The initial state plus the deltas of `ancestors`, applied in pipeline order."""
+    s = copy.deepcopy(state)
+    for j in sorted(ancestors):
+        s.update(copy.deepcopy(deltas[j]))
+    return s
+
+
+def _run_dag(pipeline, state, policy=None, deltas=None, save=None):
+    """Run a DAG pipeline, dispatching every step whose dependencies are done.
+
+    Each step sees the initial state plus the deltas of its ancestors, and the
+    final state applies all deltas in pipeline order, so joins are deterministic
+    regardless of which branch finished first. `deltas` holds steps already done
+    (resume); save({'state', 'deltas'}) is called after every completed step.
+    """
+    ids, deps = _dag_plan(pipeline)
+    n = len(pipeline)
+    ancestors = _dag_ancestors(deps)
+
+    def input_state(i):
+        return _dag_input_state(state, ancestors[i], deltas)
+
+    deltas = dict(deltas or {})
+    pending = set(range(n)) - deltas.keys()
+    running = {}
+    try:
+        while pending or running:
+            for i in sorted(pending):
+                if deps[i] <= deltas.keys():
+                    pipeline[i]['id'] = ids[i]
+                    inp = input_state(i)
+                    fut = STEP_EXECUTOR.submit(contextvars.copy_context().run, _run_step, pipeline[i], copy.deepcopy(inp), policy)
+                    running[fut] = (i, inp)
+                    pending.discard(i)
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                i, inp = running.pop(fut)
+                deltas[i] = _state_delta(inp, fut.result())
+                if save is not None and len(deltas) < n:
+                    save({'state': state, 'deltas': deltas})
+    finally:
+        # 某一步失败时，取消尚未开始的 step（已在执行的无法中断，结果会被丢弃）
+        for fut in running:
+            fut.cancel()
+
+    for i in range(n):
+        state.update(deltas[i])
+    return state
+
+
+def _run_pipeline(stored_pipeline, state, policy=None, task_id=None):
+    """Execute `stored_pipeline` and return the final state.
+
+    Plain lists run strictly in order (see _run_sequence); if any step declares `depends_on` the
+    pipeline is treated as a DAG (see _run_dag). With a task_id, progress is checkpointed in
+    TASK_STORE and a task that already has a checkpoint continues from it (`state` is ignored).
+    """
+    checkpoint, save = _checkpointer(task_id)
+    dag = _is_dag(stored_pipeline)
+    if save is not None and checkpoint is None:
+        # 第一个 step 之前也存一份，第一步就失败时同样可以 resume
+        save({'state': state, 'deltas': {}} if dag else {'next': 0, 'state': state})
+    if dag:
+        if checkpoint is None:
+            return _run_dag(stored_pipeline, state, policy, None, save)
+        deltas = {int(i): d for i, d in checkpoint['deltas'].items()}
+        return _run_dag(stored_pipeline, checkpoint['state'], policy, deltas, save)
+    if checkpoint is None:
+        return _run_sequence(stored_pipeline, state, policy, 0, save)
+    return _run_sequence(stored_pipeline, checkpoint['state'], policy, checkpoint['next'], save)
+
+
+# ====== Checkpoint：每完成一步保存进度，失败的任务可以从第一个未完成的 step 继续 ======
+TASK_CHECKPOINTS = os.getenv('TASK_CHECKPOINTS', '1') not in ('0', 'false', 'no')
+# 重新执行时要清掉的 step 字段（上一次执行留下的放置、耗时、重试等信息）
+STEP_RUN_FIELDS = ('executed_by', 'placement', 'duration_ms', 'segment', 'coalesced', 'deduplicated', 'hedged',
+                   'retries', 'failed_attempts')
+RESUME_LOCK = threading.Lock()
+
+
+def _checkpointer(task_id):
+    """(checkpoint, save) for a task: its saved progress (None if it has none) and a callback
+    that stores new progress. Both are None without a task_id or with TASK_CHECKPOINTS=0."""
+    if task_id is None or not TASK_CHECKPOINTS:
+        return None, None
+    return TASK_STORE.checkpoint(task_id), lambda progress: TASK_STORE.save_checkpoint(task_id, progress)
+
+
+def _completed_steps(checkpoint):
+    """Indexes of the steps a checkpoint already covers."""
+    if 'deltas' in checkpoint:
+        return sorted(int(i) for i in checkpoint['deltas'])
+    return list(range(checkpoint['next']))
+
+
+def _execute_task(task_id, state, policy=None, deadline=None, trace=None):
+    """Run a stored task to completion, moving its status running -> done/failed.
+
+    `deadline` (time.monotonic()) bounds the whole pipeline, including remote hops. The task's
+    `trace` (from TRACER.start) collects its spans; it is finished and stored with the task.
+    """
+    _update_task(task_id, status='running')
+    if trace is not None:
+        trace.waited('queue')
+    user = CURRENT_USER.set(_user_of(TASK_STORE.owner(task_id)))
+    scope = DEADLINE.set(deadline)
+    try:
+        with TRACER.activate(trace):
+            state = _run_pipeline(TASK_STORE.pipeline(task_id), state, policy, task_id)
+    except PipelineError as e:
+        _update_task(task_id, status='failed', error=e.body, trace=TRACER.finish(trace, e.body.get('error')))
+        raise
+    except Exception as e:
+        _update_task(task_id, status='failed', error={'error': 'pipeline failed', 'detail': str(e)},
+                     trace=TRACER.finish(trace, str(e)))
+        raise
+    finally:
+        DEADLINE.reset(scope)
+        CURRENT_USER.reset(user)
+    _update_task(task_id, status='done', final_state=state, trace=TRACER.finish(trace))
+    return state
+
+
+# 异步模式：有界线程池 + 有界排队（workers + queue 个名额，满了直接拒绝）
+TASK_WORKERS = int(os.getenv('TASK_WORKERS', '4'))
+TASK_QUEUE_MAX = int(os.getenv('TASK_QUEUE_MAX', '64'))
+# 按用户公平出队的任务队列：每个用户有令牌桶限速、并发上限和排队上限（见 fair_share.py）
+FAIR = FairScheduler(TASK_WORKERS, USER_LIMITS)
+TASK_SLOTS = threading.BoundedSemaphore(TASK_WORKERS + TASK_QUEUE_MAX)
+# /result?wait=N 的最长等待秒数
+RESULT_MAX_WAIT = float(os.getenv('RESULT_MAX_WAIT', '60'))
+
+
+def _execute_task_async(task_id, state, policy, deadline=None, trace=None):
+    try:
+        _execute_task(task_id, state, policy, deadline, trace)
+    except Exception as e:
+        # 错误已经记录在 TASK_STORE 中，这里只打印
+        print(f"⚠️ task {task_id} failed: {e}")
+    finally:
+        TASK_SLOTS.release()
+
+
+def _is_truthy(v):
+    return v is True or str(v).lower() in ('1', 'true', 'yes')
+
+
+def _new_task(token, data, headers=None):
+    """Validate a /task body and register it as queued. Returns (task_id, state, policy, deadline, trace).
+
+    Raises PipelineError(400) for a malformed pipeline, deadline or unknown placement policy.
+    """
+    # 截止时间从收到请求时开始算（排队等待也计入）
+    deadline = _task_deadline(data, headers or {})
+    pipeline = data.get("pipeline")
+    if not isinstance(pipeline, list):
+        raise PipelineError(400, {'error': 'pipeline missing or not a list'})
+    state = data.get("state", {})
+    policy = data.get("placement")
+    if policy is not None and policy not in PLACEMENT_POLICIES:
+        raise PipelineError(400, {'error': f'unknown placement policy {policy}', 'available': sorted(PLACEMENT_POLICIES)})
+    if _is_dag(pipeline):
+        _dag_plan(pipeline)
+
+    task_id = str(uuid.uuid4())
+    # deep copy pipeline so we can mutate executed_by without modifying caller data
+    stored_pipeline = copy.deepcopy(pipeline)
+    # 每个 step 一个唯一的 step_id：失败重试时对端据此去重，同一步不会重复调用 LLM
+    for i, step in enumerate(stored_pipeline):
+        if isinstance(step, dict):
+            step['step_id'] = f'{task_id}:{i}'
+    TASK_STORE.create(task_id, token, stored_pipeline)
+    # 调用方带了 traceparent 就沿用它的 trace id
+    trace = TRACER.start((headers or {}).get(TRACEPARENT), task_id=task_id)
+    return task_id, state, policy, deadline, trace
+
+
+def _task_queue_full():
+    return _reply({'error': 'task queue full', 'retry_after': ADMISSION.retry_after()}, 429)
+
+
+def _reject_task(task_id, e):
+    """The user's fair-share queue refused an already registered task: fail it and answer 429."""
+    TASK_SLOTS.release()
+    _update_task(task_id, status='failed', error={'error': e.reason, 'retry_after': e.retry_after})
+    return _overloaded(e, task_id=task_id)
 
-# ====== 工具：根据 op 找一个有这个技能的节点 ======
-def find_node_for_op(op):
-    with NODES_LOCK:
-        candidates = [n for n in NODES if op in n.get("skills", [])]
-    if not candidates:
-        # 如果没有节点声明该技能，但当前进程实现了这个 op，则退回到本地执行
-        if op in SKILL_IMPL:
-            for n in NODES:
-                if n.get('id') == SELF_ID:
-                    return n
-        return None
-    # 简单：随便选第一个，后面可以做负载均衡
-    return candidates[0]
 
 # ====== 接收完整任务（可以发给任意节点） ======
 @app.route("/task", methods=["POST"])
@@ -226,104 +1770,487 @@ def handle_task():
     # require user token
     token, err = _require_token(request)
     if err:
-        return jsonify({'error': err[0]}), err[1]
-
-    data = request.json or {}
-    pipeline = data.get("pipeline")
-    if not isinstance(pipeline, list):
-        return jsonify({'error': 'pipeline missing or not a list'}), 400
-    state = data.get("state", {})
+        return _reply({'error': err[0]}, err[1])
 
-    task_id = str(uuid.uuid4())
-    # deep copy pipeline so we can mutate executed_by without modifying caller data
-    stored_pipeline = copy.deepcopy(pipeline)
-    TASK_STORE[task_id] = {'owner': token, 'pipeline': stored_pipeline, 'final_state': None, 'status': 'running'}
+    try:
+        data = _request_body() or {}
+    except CodecError as e:
+        return _reply({'error': 'cannot decode request body', 'detail': str(e)}, 400)
+    user = _user_of(token)
+    run_async = _is_truthy(data.get('async')) or _is_truthy(request.args.get('async'))
+    rejected = _admit_task(user, run_async)
+    if rejected is not None:
+        return rejected
+    try:
+        task_id, state, policy, deadline, trace = _new_task(token, data, request.headers)
+    except PipelineError as e:
+        TASK_SLOTS.release()
+        if not run_async:
+            FAIR.finish(user)
+        return _reply(e.body, e.status)
+    return _run_task(user, task_id, state, policy, deadline, trace, run_async)
 
-    for step in stored_pipeline:
-        op = step["op"]
-        params = step.get("params", {})
 
-        # 如果调用方/AI 指定了 target_node 且该节点存在且声明了此技能，则优先使用
-        specified = step.get("target_node")
-        target_node = None
-        if specified:
-            for n in NODES:
-                if n['id'] == specified and op in n.get('skills', []):
-                    target_node = n
-                    break
+def _admit_task(user, run_async):
+    """Take the rate-limit token, task slot and (sync) user concurrency for one task run.
 
-        # 否则按照能力选择节点
-        if target_node is None:
-            target_node = find_node_for_op(op)
-        if target_node is None:
-            return jsonify({"error": f"no node can handle op={op}"}), 400
-        # 记录哪个节点将要执行这一步（或已经执行）
-        step['executed_by'] = target_node['id']
+    Returns a 429 reply if any of them is exhausted, else None; on success the caller
+    owns a TASK_SLOTS slot and, for sync runs, a FAIR.try_start count.
+    """
+    # 每个用户先过自己的令牌桶（限速），再占用全局的 TASK_SLOTS 名额（workers + 队列），满了都是 429
+    try:
+        FAIR.check_rate(user)
+    except Overloaded as e:
+        return _overloaded(e)
+    if not TASK_SLOTS.acquire(blocking=False):
+        return _task_queue_full()
+    if not run_async:
+        # 同步任务直接在请求线程执行，但同样计入该用户的并发上限
+        try:
+            FAIR.try_start(user)
+        except Overloaded as e:
+            TASK_SLOTS.release()
+            return _overloaded(e)
+    return None
+
+
+def _trace_extra(trace, body):
+    """Sync replies carry the merged trace when the caller sent a traceparent; async ones point at it."""
+    # span 仍然记录、导出并随任务保存（/task/<id>/trace），只是默认不塞进回复
+    if trace is not None and trace.remote:
+        body['trace'] = {'trace_id': trace.trace_id, 'spans': trace.finish()}
+    return body
+
+
+def _run_task(user, task_id, state, policy, deadline, trace, run_async, **extra):
+    """Queue (async) or run (sync) a registered task admitted by _admit_task, and build the reply."""
+    # 异步模式：立即返回 task_id，客户端用 /result/<task_id>?wait=N 获取结果
+    if run_async:
+        if trace is not None:
+            extra.update(trace_id=trace.trace_id, trace_url=f'/task/{task_id}/trace')
+        try:
+            FAIR.submit(user, _execute_task_async, task_id, state, policy, deadline, trace)
+        except Overloaded as e:
+            return _reject_task(task_id, e)
+        return _reply(dict(extra, task_id=task_id, status='queued', result_url=f'/result/{task_id}'), 202)
 
-        if target_node["id"] == SELF_ID:
-            # 本机有这个技能 → 本地执行
-            impl = SKILL_IMPL.get(op)
-            if impl is None:
-                return jsonify({"error": f"skill {op} not implemented on this node"}), 500
-            state = impl(state, params)
-        else:
-            # 交给别的节点执行这一步：
-            # 首先优先使用远端声明的 execute_step（如果目标声明了该 op），
-            # 否则回退到远端的 /run_prompt，让远端使用 ai_execute 或其内部逻辑处理自然语言提示。
-            remote_base = target_node["url"].rstrip('/')
-            # 如果目标节点声明了该技能，尽量调用 execute_step
-            if op in target_node.get('skills', []):
-                url = remote_base + "/execute_step"
-                payload = {"op": op, "params": params, "state": state}
-                try:
-                    resp = requests.post(url, json=payload, timeout=60)
-                except Exception as e:
-                    return jsonify({"error": f"remote node {target_node['id']} failed to connect to execute_step", "detail": str(e)}), 500
-                if resp.status_code != 200:
-                    return jsonify({"error": f"remote node {target_node['id']} failed execute_step", "detail": resp.text}), 500
-                try:
-                    state = resp.json().get("state", state)
-                except Exception:
-                    return jsonify({"error": "invalid JSON from remote execute_step", "detail": resp.text}), 502
-            else:
-                # 回退：构造一个简短的 prompt 发给远端 /run_prompt
-                url = remote_base + "/run_prompt"
-                prompt = f"Perform operation '{op}' with params {json.dumps(params)} on the provided state and return the full updated state as JSON."
-                payload = {"prompt": prompt, "state": state, "op": op, "params": params}
-                try:
-                    resp = requests.post(url, json=payload, timeout=60)
-                except Exception as e:
-                    return jsonify({"error": f"remote node {target_node['id']} failed to connect (run_prompt)", "detail": str(e)}), 500
-                if resp.status_code != 200:
-                    return jsonify({"error": f"remote node {target_node['id']} failed run_prompt", "detail": resp.text}), 500
-                try:
-                    state = resp.json().get("state", state)
-                except Exception:
-                    return jsonify({"error": "invalid JSON from remote run_prompt", "detail": resp.text}), 502
+    try:
+        state = _execute_task(task_id, state, policy, deadline, trace)
+    except PipelineError as e:
+        return _reply(_trace_extra(trace, dict(e.body, task_id=task_id)), e.status)
+    finally:
+        FAIR.finish(user)
+        TASK_SLOTS.release()
 
-    # 保存并返回 task_id 与最终状态
-    TASK_STORE[task_id]['final_state'] = state
-    TASK_STORE[task_id]['status'] = 'done'
     # 返回 pipeline（包含 executed_by 字段）以便前端显示分工
-    return jsonify({"task_id": task_id, "final_state": state, "pipeline": TASK_STORE[task_id]['pipeline']})
+    return _reply(_trace_extra(trace, dict(extra, task_id=task_id, final_state=state,
+                                           pipeline=TASK_STORE.pipeline(task_id))))
+
+
+@app.route("/task/<task_id>/resume", methods=["POST"])
+def resume_task(task_id):
+    """Continue a failed task from its last checkpoint instead of rerunning every step.
+
+    Body (all optional): { placement, targets: { "<step index or id>": node_id | null },
+    deadline_ms, async }. Completed steps keep their results and executed_by; the
+    remaining ones are placed again (targets re-pins or unpins them). Answers like
+    /task, plus resumed_steps (the step indexes taken from the checkpoint).
+    """
+    token, err = _require_token(request)
+    if err:
+        return _reply({'error': err[0]}, err[1])
+    try:
+        data = _request_body() or {}
+    except CodecError as e:
+        return _reply({'error': 'cannot decode request body', 'detail': str(e)}, 400)
+    owner = TASK_STORE.owner(task_id)
+    if owner is None:
+        return _reply({'error': 'task not found'}, 404)
+    if owner != token:
+        return _reply({'error': 'forbidden'}, 403)
+    checkpoint = TASK_STORE.checkpoint(task_id)
+    if checkpoint is None:
+        return _reply({'error': 'task has no checkpoint to resume from; submit it again'}, 409)
+    policy = data.get("placement")
+    if policy is not None and policy not in PLACEMENT_POLICIES:
+        return _reply({'error': f'unknown placement policy {policy}', 'available': sorted(PLACEMENT_POLICIES)}, 400)
+    targets = data.get("targets") or {}
+    if not isinstance(targets, dict):
+        return _reply({'error': 'targets must be an object mapping step index or id to a node id'}, 400)
+    try:
+        deadline = _task_deadline(data, request.headers)
+    except PipelineError as e:
+        return _reply(e.body, e.status)
+
+    user = _user_of(token)
+    run_async = _is_truthy(data.get('async')) or _is_truthy(request.args.get('async'))
+    # 同一个任务只能有一次 resume 在执行
+    with RESUME_LOCK:
+        status = TASK_STORE.status(task_id)
+        if status != 'failed':
+            return _reply({'error': f'only failed tasks can be resumed (task is {status})'}, 409)
+        rejected = _admit_task(user, run_async)
+        if rejected is not None:
+            return rejected
+        _update_task(task_id, status='queued', error=None)
+
+    completed = set(_completed_steps(checkpoint))
+    for i, step in enumerate(TASK_STORE.pipeline(task_id)):
+        if i in completed or not isinstance(step, dict):
+            continue
+        for field in STEP_RUN_FIELDS:
+            step.pop(field, None)
+        for key in (str(i), step.get('id')):
+            if key is not None and key in targets:
+                if targets[key]:
+                    step['target_node'] = targets[key]
+                else:
+                    step.pop('target_node', None)
+    trace = TRACER.start(request.headers.get(TRACEPARENT), task_id=task_id, resumed=True)
+    return _run_task(user, task_id, None, policy, deadline, trace, run_async, resumed_steps=sorted(completed))
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _execute_task_streaming(task_id, state, policy, events, deadline=None, trace=None):
+    token = STEP_EVENTS.set(events)
+    try:
+        state = _execute_task(task_id, state, policy, deadline, trace)
+        events.emit('final', task_id=task_id, final_state=state, pipeline=TASK_STORE.pipeline(task_id))
+    except PipelineError as e:
+        events.emit('error', task_id=task_id, status=e.status, **e.body)
+    except Exception as e:
+        events.emit('error', task_id=task_id, status=500, error='pipeline failed', detail=str(e))
+    finally:
+        STEP_EVENTS.reset(token)
+        TASK_SLOTS.release()
+
+
+def _sse_stream(task_id, events):
+    yield _sse('task', {'task_id': task_id, 'result_url': f'/result/{task_id}'})
+    while True:
+        try:
+            event, data = events.queue.get(timeout=15)
+        except queue.Empty:
+            # 注释行保持连接（代理/浏览器不会因为长时间无数据而断开）
+            yield ': keepalive\n\n'
+            continue
+        yield _sse(event, data)
+        if event in ('final', 'error'):
+            return
+
+
+@app.route("/task/stream", methods=["POST"])
+def handle_task_stream():
+    """Same body as /task, answered as Server-Sent Events while the pipeline runs.
+
+    Events: task, step_started, delta (LLM text increments, relayed from remote
+    steps too), step_done, then final { final_state, pipeline } or error. If the
+    client disconnects the task still completes and stays readable via /result.
+    """
+    token, err = _require_token(request)
+    if err:
+        return _reply({'error': err[0]}, err[1])
+    try:
+        data = _request_body() or {}
+    except CodecError as e:
+        return _reply({'error': 'cannot decode request body', 'detail': str(e)}, 400)
+    user = _user_of(token)
+    rejected = _admit_task(user, True)
+    if rejected is not None:
+        return rejected
+    try:
+        task_id, state, policy, deadline, trace = _new_task(token, data, request.headers)
+    except PipelineError as e:
+        TASK_SLOTS.release()
+        return _reply(e.body, e.status)
+
+    events = TaskEvents(TASK_STORE.pipeline(task_id))
+    try:
+        FAIR.submit(user, _execute_task_streaming, task_id, state, policy, events, deadline, trace)
+    except Overloaded as e:
+        return _reject_task(task_id, e)
+    return Response(_sse_stream(task_id, events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 # ====== 只执行单个 step 的接口（给别的节点调用） ======
 @app.route("/execute_step", methods=["POST"])
 def execute_step():
-    data = request.json
+    # 调用方在追踪这个任务时记录本节点的 span，随应答返回
+    trace = TRACER.join(request.headers.get(TRACEPARENT), 'execute_step')
+    try:
+        with _trace_span(trace, 'deserialize', codec='wire'):
+            data = _request_body() or {}
+    except CodecError as e:
+        return _reply({"error": "cannot decode request body", "detail": str(e)}, 400)
     op = data["op"]
     params = data.get("params", {})
-    state = data.get("state", {})
 
     if op not in self_skills():
-        return jsonify({"error": f"this node cannot handle {op}"}), 400
+        return _reply({"error": f"this node cannot handle {op}"}, 400)
 
     impl = SKILL_IMPL.get(op)
     if impl is None:
-        return jsonify({"error": f"skill {op} not implemented in code"}), 500
+        return _reply({"error": f"skill {op} not implemented in code"}, 500)
+
+    try:
+        deadline = _incoming_deadline(request.headers)
+        with _trace_span(trace, 'deserialize', codec=data.get('transfer') or 'full'):
+            state, before = _receive_state(data)
+    except MissingBlobs as e:
+        return _reply({"error": "missing blobs", "missing": e.hashes}, 409)
+    except PipelineError as e:
+        return _reply(e.body, e.status)
+
+    # 带 step_id 的重试：已经执行过就直接返回上次的结果（不占执行名额）
+    step_id = data.get("step_id")
+    done = STEP_RESULTS.get(step_id) if step_id else None
+    if done is None:
+        try:
+            with _deadline_scope(deadline), _trace_span(trace, 'admission'):
+                started = ADMISSION.acquire(True, *_admission_args(data.get("user")), timeout=_remaining())
+        except Overloaded as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                return _reply(_deadline_error(f"waiting for an execution slot for {op}").body, 504)
+            return _overloaded(e)
+
+    def execute(state):
+        with _observe_step(op, 'served'), TRACER.span('skill', op=op):
+            if _coalescible(params):
+                return STEP_FLIGHTS.do(_step_key(op, params, state), lambda: impl(state, params))[0]
+            return impl(state, params)
+
+    def run(state):
+        """Reply body for this step: executed now, joined in flight, or replayed by step_id."""
+        if done is not None:
+            with _trace_span(trace, 'respond'):
+                body = _state_reply_body(done, before, deduplicated=True)
+            return _with_spans(body, trace)
+        # 在 run 内设置：流式模式下 run 在另一个线程执行
+        try:
+            with _deadline_scope(deadline), TRACER.activate(trace):
+                if step_id:
+                    state, dedup = STEP_RESULTS.do(step_id, lambda: execute(state))
+                else:
+                    state, dedup = execute(state), False
+        finally:
+            ADMISSION.release(started)
+        with _trace_span(trace, 'respond'):
+            body = _state_reply_body(state, before, **({'deduplicated': True} if dedup else {}))
+        return _with_spans(body, trace)
+
+    if data.get("stream"):
+        return Response(_stream_ndjson(lambda: run(state)), mimetype=NDJSON)
+    try:
+        return _reply(run(state))
+    except PipelineError as e:
+        # 例如技能内部 LLM 调用前发现预算已用完（504）
+        return _reply(e.body, e.status)
+    except Exception as e:
+        return _reply({"error": f"skill {op} failed", "detail": str(e)}, 500)
+
+
+@app.route("/execute_segment", methods=["POST"])
+def execute_segment():
+    """Run an ordered list of { op, params } against one state in a single round trip.
 
-    state = impl(state, params)
-    return jsonify({"state": state})
+    Body: { steps: [ {op, params}, ... ], state }. Returns { state, timings }, where
+    timings holds per-step duration_ms. On failure returns failed_index and the
+    state reached so far.
+    """
+    trace = TRACER.join(request.headers.get(TRACEPARENT), 'execute_segment')
+    try:
+        with _trace_span(trace, 'deserialize', codec='wire'):
+            data = _request_body() or {}
+    except CodecError as e:
+        return _reply({"error": "cannot decode request body", "detail": str(e)}, 400)
+    steps = data.get("steps")
+    if not isinstance(steps, list) or not steps:
+        return _reply({"error": "steps missing or not a non-empty list"}, 400)
+
+    skills = self_skills()
+    for i, step in enumerate(steps):
+        op = step.get("op") if isinstance(step, dict) else None
+        if op not in skills:
+            return _reply({"error": f"this node cannot handle {op}", "failed_index": i}, 400)
+        if SKILL_IMPL.get(op) is None:
+            return _reply({"error": f"skill {op} not implemented in code", "failed_index": i}, 500)
+
+    try:
+        deadline = _incoming_deadline(request.headers)
+        with _trace_span(trace, 'deserialize', codec=data.get('transfer') or 'full'):
+            state, before = _receive_state(data)
+    except MissingBlobs as e:
+        return _reply({"error": "missing blobs", "missing": e.hashes}, 409)
+    except PipelineError as e:
+        return _reply(e.body, e.status)
+
+    try:
+        with _deadline_scope(deadline), _trace_span(trace, 'admission'):
+            admitted = ADMISSION.acquire(True, *_admission_args(data.get("user")), timeout=_remaining())
+    except Overloaded as e:
+        if deadline is not None and time.monotonic() >= deadline:
+            return _reply(_deadline_error("waiting for an execution slot").body, 504)
+        return _overloaded(e)
+    timings = []
+    scope = DEADLINE.set(deadline)
+    try:
+        for i, step in enumerate(steps):
+            if _deadline_expired():
+                return _reply(dict(_deadline_error(f"before step {step['op']}").body, failed_index=i,
+                                   state=state, timings=timings), 504)
+            started = time.perf_counter()
+            impl, params, dedup = SKILL_IMPL[step["op"]], step.get("params", {}), False
+            try:
+                with _observe_step(step["op"], 'served'), _trace_span(trace, 'skill', op=step["op"]):
+                    if step.get("step_id"):
+                        state, dedup = STEP_RESULTS.do(step["step_id"], lambda: impl(state, params))
+                    else:
+                        state = impl(state, params)
+            except PipelineError as e:
+                return _reply(dict(e.body, failed_index=i, state=state, timings=timings), e.status)
+            except Exception as e:
+                return _reply({"error": f"skill {step['op']} failed", "detail": str(e), "failed_index": i,
+                               "state": state, "timings": timings}, 500)
+            timing = {"op": step["op"], "duration_ms": round((time.perf_counter() - started) * 1000, 1)}
+            if dedup:
+                timing["deduplicated"] = True
+            timings.append(timing)
+    finally:
+        DEADLINE.reset(scope)
+        ADMISSION.release(admitted)
+    with _trace_span(trace, 'respond'):
+        body = _state_reply_body(state, before, timings=timings)
+    return _reply(_with_spans(body, trace))
+
+
+# ====== 批量执行：同一个 op 作用于多个 state，按完成顺序以 NDJSON 流式返回 ======
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '1000'))
+BATCH_MAX_PARALLEL = int(os.getenv('BATCH_MAX_PARALLEL', '8'))
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_MAX_PARALLEL, thread_name_prefix='batch')
+
+
+def _batch_items(data):
+    """Normalize the batch body into a list of (params, state). Raises PipelineError(400)."""
+    shared = data.get("params") or {}
+    if not isinstance(shared, dict):
+        raise PipelineError(400, {"error": "params must be an object"})
+    if "items" in data:
+        items = data["items"]
+        if not isinstance(items, list) or not all(isinstance(it, dict) for it in items):
+            raise PipelineError(400, {"error": "items must be a list of { state?, params? } objects"})
+        out = [(dict(shared, **(it.get("params") or {})), it.get("state") or {}) for it in items]
+    elif "states" in data:
+        states = data["states"]
+        if not isinstance(states, list) or not all(isinstance(st, dict) for st in states):
+            raise PipelineError(400, {"error": "states must be a list of objects"})
+        out = [(dict(shared), st) for st in states]
+    else:
+        raise PipelineError(400, {"error": "either states or items is required"})
+    if not out:
+        raise PipelineError(400, {"error": "batch is empty"})
+    if len(out) > BATCH_MAX_ITEMS:
+        raise PipelineError(413, {"error": f"batch too large (max {BATCH_MAX_ITEMS} items)"})
+    return out
+
+
+def _run_batch_item(op, params, state, policy, user=None, deadline=None):
+    step = {"op": op, "params": params}
+    token = CURRENT_USER.set(user)
+    try:
+        with _deadline_scope(deadline):
+            state = _run_step(step, state, policy)
+    finally:
+        CURRENT_USER.reset(token)
+    return step, state
+
+
+def _stream_batch(op, items, policy, parallel, user=None, deadline=None):
+    """Yield one NDJSON line per item as it completes, then a summary line."""
+    pending = list(enumerate(items))
+    pending.reverse()
+    running = {}
+    ok = failed = 0
+    started = time.perf_counter()
+    try:
+        while pending or running:
+            while pending and len(running) < parallel:
+                i, (params, state) = pending.pop()
+                running[BATCH_EXECUTOR.submit(_run_batch_item, op, params, state, policy, user, deadline)] = i
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                i = running.pop(fut)
+                try:
+                    step, state = fut.result()
+                except PipelineError as e:
+                    failed += 1
+                    line = dict(e.body, index=i, status=e.status)
+                except Exception as e:
+                    failed += 1
+                    line = {"index": i, "status": 500, "error": f"skill {op} failed", "detail": str(e)}
+                else:
+                    ok += 1
+                    line = {"index": i, "status": 200, "state": state, "executed_by": step.get("executed_by"),
+                            "duration_ms": step.get("duration_ms")}
+                    if step.get("coalesced"):
+                        line["coalesced"] = True
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "total": len(items), "ok": ok, "failed": failed,
+                          "duration_ms": round((time.perf_counter() - started) * 1000, 1)}) + "\n"
+    finally:
+        # 客户端断开时生成器被关闭：丢弃还没开始的条目
+        for fut in running:
+            fut.cancel()
+
+
+@app.route("/execute_batch", methods=["POST"])
+def execute_batch():
+    """Run one op over many states with bounded concurrency, streaming NDJSON results.
+
+    Body: { op, params?, states: [state, ...] } or { op, params?, items: [ {state, params?}, ... ] }
+    (per-item params override the shared ones), plus optional max_parallel and placement.
+    Each output line is { index, status, state | error } in completion order; the last
+    line is { done, total, ok, failed }. A failing item does not stop the batch.
+    """
+    token, err = _require_token(request)
+    if err:
+        return _reply({'error': err[0]}, err[1])
+    try:
+        data = _request_body() or {}
+    except CodecError as e:
+        return _reply({'error': 'cannot decode request body', 'detail': str(e)}, 400)
+    user = _user_of(token)
+    # 整个批次算一次请求；其中的 step 在各节点的准入队列里按用户公平排队
+    try:
+        FAIR.check_rate(user)
+    except Overloaded as e:
+        return _overloaded(e)
+
+    op = data.get("op")
+    if not isinstance(op, str) or not op:
+        return _reply({'error': 'op missing'}, 400)
+    policy = data.get("placement")
+    if policy is not None and policy not in PLACEMENT_POLICIES:
+        return _reply({'error': f'unknown placement policy {policy}', 'available': sorted(PLACEMENT_POLICIES)}, 400)
+    node, placement = choose_node_for_op(op, policy)
+    if node is None:
+        if placement == 'circuit_open':
+            return _reply({'error': f'every node that can handle op={op} has an open circuit breaker'}, 503)
+        return _reply({'error': f'no node can handle op={op}'}, 400)
+    try:
+        items = _batch_items(data)
+        parallel = int(data.get("max_parallel") or BATCH_MAX_PARALLEL)
+        deadline = _task_deadline(data, request.headers)
+    except PipelineError as e:
+        return _reply(e.body, e.status)
+    except (TypeError, ValueError):
+        return _reply({'error': 'max_parallel must be an integer'}, 400)
+    parallel = max(1, min(parallel, BATCH_MAX_PARALLEL))
+
+    return Response(_stream_batch(op, items, policy, parallel, user, deadline), mimetype='application/x-ndjson',
+                    headers={'X-Accel-Buffering': 'no'})
 
 
 @app.route("/run_prompt", methods=["POST"])
@@ -332,7 +2259,9 @@ def run_prompt():
     This provides a simple fallback so nodes that don't implement a specific op
     can still receive a natural-language instruction and update state.
     """
-    data = request.json or {}
+    trace = TRACER.join(request.headers.get(TRACEPARENT), 'run_prompt')
+    with _trace_span(trace, 'deserialize', codec='json'):
+        data = request.json or {}
     prompt = data.get("prompt")
     state = data.get("state", {})
 
@@ -340,12 +2269,108 @@ def run_prompt():
         return jsonify({"error": "missing prompt"}), 400
 
     # Reuse the local generic AI executor
+    deadline = None
     try:
-        state = skill_ai_execute(state, {"prompt": prompt})
+        deadline = _incoming_deadline(request.headers)
+        with _deadline_scope(deadline), TRACER.activate(trace):
+            with TRACER.span('admission'):
+                admitted = ADMISSION.acquire(True, *_admission_args(data.get("user")), timeout=_remaining())
+            try:
+                with TRACER.span('skill', op='ai_execute'):
+                    state = skill_ai_execute(state, {"prompt": prompt})
+            finally:
+                ADMISSION.release(admitted)
+    except Overloaded as e:
+        # 排队等待被 deadline 截断时是 504，不是过载
+        if deadline is not None and time.monotonic() >= deadline:
+            return _reply(_deadline_error("waiting for an execution slot for ai_execute").body, 504)
+        return _overloaded(e)
+    except PipelineError as e:
+        return jsonify(e.body), e.status
     except Exception as e:
         return jsonify({"error": "ai_execute failed", "detail": str(e)}), 500
 
-    return jsonify({"state": state})
+    return jsonify(_with_spans({"state": state}, trace))
+
+@app.route('/admission_stats', methods=['GET'])
+def admission_stats():
+    """准入控制：并发上限、正在执行/排队的 step 数、拒绝次数"""
+    stats = ADMISSION.stats()
+    stats['tasks_max'] = TASK_WORKERS + TASK_QUEUE_MAX
+    return jsonify(stats)
+
+
+@app.route('/task_store_stats', methods=['GET'])
+def task_store_stats():
+    """任务存储：后端、内存中的任务数/执行中的任务数、结果字节数、淘汰/过期次数"""
+    return jsonify(TASK_STORE.stats())
+
+
+@app.route('/user_stats', methods=['GET'])
+def user_stats():
+    """按用户的公平调度状态：限额、运行/排队中的任务、令牌桶余量、被拒次数、本节点排队的 step"""
+    stats = FAIR.stats()
+    for user, n in ADMISSION.queued_by_user().items():
+        if user is not None:
+            stats.setdefault(user, {})['queued_steps'] = n
+    return jsonify({'users': stats})
+
+
+@app.route('/failover_stats', methods=['GET'])
+def failover_stats():
+    """失败转移：重试次数、换节点次数、重试用尽次数；dedup 为本节点按 step_id 去重的命中情况"""
+    with FAILOVER_LOCK:
+        stats = dict(FAILOVER_STATS)
+    stats.update(max_retries=STEP_RETRIES, backoff=STEP_RETRY_BACKOFF, dedup=STEP_RESULTS.stats())
+    return jsonify(stats)
+
+
+@app.route('/hedge_stats', methods=['GET'])
+def hedge_stats():
+    """对冲请求：每个 op / model 的调用数、发出的备份数、备份胜出次数、因预算不足没有发出的次数"""
+    return jsonify({'steps': dict(STEP_HEDGER.stats(), enabled=HEDGE_STEPS),
+                    'llm': dict(LLM_HEDGER.stats(), enabled=HEDGE_LLM)})
+
+
+@app.route('/coalesce_stats', methods=['GET'])
+def coalesce_stats():
+    """Singleflight：leader 次数、被合并的调用数、当前等待者数量"""
+    return jsonify(STEP_FLIGHTS.stats())
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """LLM 响应缓存的命中/未命中计数"""
+    with PLAN_CACHE_LOCK:
+        plans = dict(PLAN_CACHE_STATS, entries=len(PLAN_CACHE), max_entries=PLAN_CACHE_MAX)
+    if LLM_CACHE is None:
+        return jsonify({'enabled': False, 'plan_cache': plans})
+    return jsonify(dict(LLM_CACHE.stats(), enabled=True, max_temperature=LLM_CACHE_MAX_TEMPERATURE, plan_cache=plans))
+
+
+@app.route('/transfer_stats', methods=['GET'])
+def transfer_stats():
+    """Delta/content-addressed state transfer: local blob store and per-peer known hashes"""
+    return jsonify({'mode': STATE_TRANSFER, 'blob_store': BLOB_STORE.stats(), 'peers': PEER_BLOBS.stats()})
+
+
+@app.route('/trace_stats', methods=['GET'])
+def trace_stats():
+    """分布式追踪：是否开启、导出目标、本节点发起的 trace 数、已导出/排队/丢弃的 trace 数、导出失败次数"""
+    return jsonify(TRACER.stats())
+
+
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    """节点间 HTTP 连接池统计：每个对端的请求数、新建连接数、复用率、打开的连接数"""
+    return jsonify(PEER_POOL.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文本格式：按路由/op/对端/模型的请求数和延迟直方图、token 用量、队列深度、在途 step 等"""
+    return Response(PROM.render(), content_type=PROM_CONTENT_TYPE)
+
 
 # ====== 查看节点信息 ======
 @app.route("/info", methods=["GET"])
@@ -354,6 +2379,7 @@ def info():
         "id": SELF_ID,
         "url": SELF_URL,
         "skills": list(self_skills()),
+        "metrics": dict(METRICS.snapshot),
     })
 
 
@@ -368,7 +2394,49 @@ def get_result(task_id):
         return jsonify({'error': 'task not found'}), 404
     if t['owner'] != token:
         return jsonify({'error': 'forbidden'}), 403
-    return jsonify({'task_id': task_id, 'status': t['status'], 'final_state': t.get('final_state')})
+
+    # ?wait=N：长轮询，最多等待 N 秒直到任务结束（done/failed）
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), RESULT_MAX_WAIT)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    if wait > 0:
+        with TASK_COND:
+            TASK_COND.wait_for(lambda: TASK_STORE.status(task_id) in TASK_FINAL_STATUSES, timeout=wait)
+        t = TASK_STORE.get(task_id) or t
+
+    return jsonify(_task_view(task_id, t))
+
+
+@app.route("/task/<task_id>/trace", methods=["GET"])
+def get_trace(task_id):
+    """The task's trace: { trace_id, spans } with the spans of every node it ran on (owner only)."""
+    token, err = _require_token(request)
+    if err:
+        return jsonify({'error': err[0]}), err[1]
+    owner = TASK_STORE.owner(task_id)
+    if owner is None:
+        return jsonify({'error': 'task not found'}), 404
+    if owner != token:
+        return jsonify({'error': 'forbidden'}), 403
+    trace = TASK_STORE.trace(task_id)
+    if trace is None:
+        status = TASK_STORE.status(task_id)
+        if status in TASK_FINAL_STATUSES:
+            return jsonify({'error': 'no trace recorded for this task'}), 404
+        return jsonify({'error': f'task is {status}; the trace is stored when it finishes'}), 409
+    return jsonify(dict(trace, task_id=task_id))
+
+
+def _task_view(task_id, t):
+    body = {'task_id': task_id, 'status': t['status'], 'final_state': t.get('final_state'), 'pipeline': t.get('pipeline')}
+    if t.get('error'):
+        body['error'] = t['error']
+    if t['status'] == 'failed':
+        checkpoint = TASK_STORE.checkpoint(task_id)
+        if checkpoint is not None:
+            body['resume'] = {'url': f'/task/{task_id}/resume', 'completed_steps': _completed_steps(checkpoint)}
+    return body
 
 
 def _all_allowed_ops():
@@ -409,6 +2477,7 @@ def _validate_tasks_structure(obj):
 
     allowed_ops = _all_allowed_ops()
     node_ids = {n['id'] for n in NODES}
+    task_ids = {t.get('id') for t in tasks if isinstance(t, dict)}
 
     for i, t in enumerate(tasks):
         if not isinstance(t, dict):
@@ -424,6 +2493,13 @@ def _validate_tasks_structure(obj):
         target = t.get('target_node')
         if target is not None and target not in node_ids:
             return False, f'task[{i}].target_node "{target}" not a known node'
+        deps = t.get('depends_on')
+        if deps is not None:
+            if not isinstance(deps, list) or not all(isinstance(d, str) for d in deps):
+                return False, f'task[{i}].depends_on must be a list of task ids'
+            unknown = [d for d in deps if d not in task_ids]
+            if unknown:
+                return False, f'task[{i}].depends_on references unknown ids {unknown}'
 
     return True, ''
 
@@ -452,15 +2528,19 @@ class DiscoveryListener:
         # 解析可选的运行时指标（如果广播方包含这些属性）
         # 首先尝试一次性读取 'metrics' JSON blob（node_test.py 使用此格式）
         metrics_blob = info.properties.get(b"metrics")
-        cpu = battery = load = health = None
+        cpu = battery = load = max_load = health = running = queued = None
         try:
             if metrics_blob:
                 metrics = json.loads(metrics_blob.decode())
                 cpu = metrics.get('cpu')
                 battery = metrics.get('battery')
-                # represent load as "current / max"
-                load = f"{metrics.get('load', '?')} / {metrics.get('max_load', '?')}"
+                # load / max_load 保持数值，调度直接使用
+                load = metrics.get('load')
+                max_load = metrics.get('max_load')
                 health = metrics.get('health')
+                # 准入控制的真实在途/排队数（新版 net.py 才会广播）
+                running = metrics.get('running')
+                queued = metrics.get('queued')
             else:
                 # fallback: individual properties cpu/battery/load/health
                 def _get_prop_bytes(key):
@@ -500,7 +2580,10 @@ class DiscoveryListener:
 
         url = f"http://{node_ip}:{info.port}"
         now = __import__('time').strftime('%H:%M:%S', __import__('time').localtime())
-        new_node = {"id": node_id, "url": url, "skills": skills, "cpu": cpu, "battery": battery, "load": load, "health": health, 'last_seen': now}
+        new_node = {"id": node_id, "url": url, "skills": skills, "cpu": cpu, "battery": battery, "load": load,
+                    "max_load": max_load, "health": health, 'last_seen': now}
+        if running is not None:
+            new_node.update(running=running, queued=queued)
 
         with NODES_LOCK:
             # replace or append
@@ -512,9 +2595,13 @@ class DiscoveryListener:
                     break
             if not replaced:
                 NODES.append(new_node)
+        PROM_DISCOVERY.inc('updated' if replaced else 'added')
+
+        # 节点/技能变化会让缓存的 /analyze 规划失效
+        _refresh_plan_fingerprint()
 
         # 打印更详细的发现信息
-        print(f"✨ FOUND NODE → {node_id} @ {node_ip}:{info.port}\n   skills:    {skills}\n   cpu:       {cpu}%\n   battery:   {battery}\n   load:      {load}\n   health:    {health}")
+        print(f"✨ FOUND NODE → {node_id} @ {node_ip}:{info.port}\n   skills:    {skills}\n   cpu:       {cpu}%\n   battery:   {battery}\n   load:      {load} / {max_load}\n   health:    {health}")
 
     def update_service(self, zeroconf, service_type, name):
         # 当服务更新时，重新读取 service info 并刷新节点信息（复用 add_service）
@@ -525,6 +2612,7 @@ class DiscoveryListener:
 
     def remove_service(self, zeroconf, service_type, name):
         print(f"💦 Node disappeared: {name}")
+        PROM_DISCOVERY.inc('removed')
         # best-effort removal: service name includes id
         # we won't try to parse the name; discovery will refresh over time
 
@@ -550,83 +2638,47 @@ def start_advertising(port):
     print(f"🐣 ADVERTISING: {SELF_ID} @ {ip}:{port}")
 
 
-def _collect_metrics_once():
-    """Collect simple runtime metrics (cpu%, battery%, load, health)."""
-    cpu = None
-    battery = None
-    load = None
-    health = None
-    try:
-        if psutil:
-            cpu = round(psutil.cpu_percent(interval=0.1), 1)
-            # battery may be None on desktops/servers
-            try:
-                batt = psutil.sensors_battery()
-                battery = round(batt.percent, 1) if batt and batt.percent is not None else None
-            except Exception:
-                battery = None
-            # represent load as current percent / 100
-            load = cpu
-            # simple health heuristic: if cpu < 80 -> good, else degraded
-            health = max(0.0, min(1.0, (100.0 - cpu) / 100.0)) if cpu is not None else None
+def _publish_metrics(snapshot):
+    """METRICS subscriber: copy a changed snapshot into the local NODES entry and the mDNS advert."""
+    global ZC_INFO
+    fields = {k: snapshot[k] for k in ('cpu', 'battery', 'load', 'max_load', 'running', 'queued', 'health')}
+    fields['last_seen'] = time.strftime('%H:%M:%S', time.localtime())
+    with NODES_LOCK:
+        for n in NODES:
+            if n.get('id') == SELF_ID:
+                n.update(fields)
+                break
         else:
-            cpu = None
+            # add minimal local node entry
+            NODES.append(dict(fields, id=SELF_ID, url=SELF_URL, skills=list(self_skills())))
+
+    if ZC is None or ZC_INFO is None:
+        return
+    props = dict(ZC_INFO.properties or {})
+    props['id'] = SELF_ID
+    props['skills'] = json.dumps(list(self_skills()))
+    props['metrics'] = json.dumps(METRICS.advert())
+    # attempt to update existing ServiceInfo
+    try:
+        ZC_INFO.properties = props
+        ZC.update_service(ZC_INFO)
     except Exception:
-        cpu = battery = load = health = None
-    return {'cpu': cpu, 'battery': battery, 'load': load, 'health': health}
-
-
-def start_metrics_updater(interval=3):
-    """Background thread: update local NODES entry and advertised Zeroconf properties with metrics every `interval` seconds."""
-    def run():
-        while True:
-            try:
-                m = _collect_metrics_once()
-                now = __import__('time').strftime('%H:%M:%S', __import__('time').localtime())
-                with NODES_LOCK:
-                    # update local node entry if present
-                    found = False
-                    for i, n in enumerate(NODES):
-                        if n.get('id') == SELF_ID:
-                            NODES[i].update({'cpu': m['cpu'], 'battery': m['battery'], 'load': f"{m['load']} / 100" if m['load'] is not None else None, 'health': m['health'], 'last_seen': now})
-                            found = True
-                            break
-                    if not found:
-                        # add minimal local node entry
-                        NODES.append({'id': SELF_ID, 'url': SELF_URL, 'skills': list(self_skills()), 'cpu': m['cpu'], 'battery': m['battery'], 'load': f"{m['load']} / 100" if m['load'] is not None else None, 'health': m['health'], 'last_seen': now})
-
-                # update zeroconf advertised properties if available
-                try:
-                    global ZC_INFO
-                    if ZC is not None and ZC_INFO is not None:
-                        props = dict(ZC_INFO.properties or {})
-                        props['id'] = SELF_ID
-                        props['skills'] = json.dumps(list(self_skills()))
-                        props['metrics'] = json.dumps({'cpu': m['cpu'], 'battery': m['battery'], 'load': m['load'], 'max_load': 100, 'health': m['health']})
-                        # attempt to update existing ServiceInfo
-                        try:
-                            ZC_INFO.properties = props
-                            ZC.update_service(ZC_INFO)
-                        except Exception:
-                            try:
-                                ip = socket.inet_aton(get_local_ip())
-                                new_info = ServiceInfo(ZC_INFO.type_, ZC_INFO.name, addresses=[ip], port=ZC_INFO.port, properties=props, server=ZC_INFO.server)
-                                ZC.update_service(new_info)
-                                ZC_INFO = new_info
-                            except Exception:
-                                pass
-                except Exception:
-                    pass
+        try:
+            ip = socket.inet_aton(get_local_ip())
+            new_info = ServiceInfo(ZC_INFO.type_, ZC_INFO.name, addresses=[ip], port=ZC_INFO.port, properties=props, server=ZC_INFO.server)
+            ZC.update_service(new_info)
+            ZC_INFO = new_info
+        except Exception:
+            pass
 
-            except Exception:
-                pass
-            try:
-                __import__('time').sleep(interval)
-            except Exception:
-                break
 
-    t = threading.Thread(target=run, daemon=True)
-    t.start()
+def start_metrics_updater(interval=None):
+    """Start the background sampler; the local NODES entry and the advertised Zeroconf
+    properties are refreshed only when the (rounded) metrics change."""
+    if interval is not None:
+        METRICS.interval = interval
+    METRICS.subscribe(_publish_metrics)
+    METRICS.start()
 
 
 def start_discovery():
@@ -640,6 +2692,10 @@ def start_discovery():
 
 @app.route('/nodes', methods=['GET'])
 def nodes_list():
+    return jsonify({'nodes': _nodes_snapshot()})
+
+
+def _nodes_snapshot():
     with NODES_LOCK:
         # 返回每个节点的最近日志（如果存在）
         # 为安全起见只返回最近 50 条日志
@@ -648,8 +2704,12 @@ def nodes_list():
             nc = n.copy()
             logs = nc.get('recent_logs', [])
             nc['recent_logs'] = logs[-50:]
+            with INFLIGHT_LOCK:
+                nc['inflight'] = INFLIGHT.get(nc.get('id'), 0)
+            if nc.get('id') != SELF_ID and nc.get('url'):
+                nc['circuit'] = BREAKERS.state(nc['url'])
             nodes_copy.append(nc)
-        return jsonify({'nodes': nodes_copy})
+        return nodes_copy
 
 
 @app.route('/report_log', methods=['POST'])
@@ -676,10 +2736,64 @@ def report_log():
         if not found:
             # create a minimal node entry so frontend can show logs
             NODES.append({'id': node_id, 'url': None, 'skills': [], 'recent_logs': [entry]})
+    if not found:
+        _refresh_plan_fingerprint()
 
     return jsonify({'ok': True})
 
 
+# ====== /analyze 规划缓存：key = 规范化后的命令 + 集群技能/节点指纹 ======
+PLAN_CACHE_MAX = int(os.getenv('PLAN_CACHE_MAX', '256'))
+PLAN_CACHE = OrderedDict()
+PLAN_CACHE_LOCK = threading.Lock()
+PLAN_CACHE_STATS = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_plan_fingerprint = None
+
+
+def _cluster_fingerprint():
+    """Hash of everything the planning prompt depends on besides the command."""
+    with NODES_LOCK:
+        table = sorted((str(n.get('id')), sorted(n.get('skills', []))) for n in NODES)
+    blob = json.dumps({'ops': sorted(_all_allowed_ops()), 'nodes': table}, sort_keys=True)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def _refresh_plan_fingerprint():
+    """Recompute the fingerprint; drop every cached plan if the cluster changed."""
+    global _plan_fingerprint
+    fp = _cluster_fingerprint()
+    with PLAN_CACHE_LOCK:
+        if fp != _plan_fingerprint:
+            if _plan_fingerprint is not None and PLAN_CACHE:
+                PLAN_CACHE.clear()
+                PLAN_CACHE_STATS['invalidations'] += 1
+            _plan_fingerprint = fp
+    return fp
+
+
+def _normalize_command(command):
+    return ' '.join(command.split())
+
+
+def _plan_cache_get(key):
+    with PLAN_CACHE_LOCK:
+        tasks = PLAN_CACHE.get(key)
+        if tasks is None:
+            PLAN_CACHE_STATS['misses'] += 1
+            return None
+        PLAN_CACHE.move_to_end(key)
+        PLAN_CACHE_STATS['hits'] += 1
+        return copy.deepcopy(tasks)
+
+
+def _plan_cache_put(key, tasks):
+    with PLAN_CACHE_LOCK:
+        PLAN_CACHE[key] = copy.deepcopy(tasks)
+        PLAN_CACHE.move_to_end(key)
+        while len(PLAN_CACHE) > PLAN_CACHE_MAX:
+            PLAN_CACHE.popitem(last=False)
+
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     """接受 { command: '...' }，调用 OpenAI 返回拆分任务的 JSON，验证并返回 tasks 列表"""
@@ -688,88 +2802,122 @@ def analyze():
     if not command or not isinstance(command, str):
         return jsonify({'error': 'missing command'}), 400
 
+    # 同一命令在集群技能不变时拆分结果相同：命中缓存则跳过 LLM 调用。
+    # 缓存的是模型给出的原始 tasks，target_node 的补全与校验每次重新做（保持负载均衡）。
+    plan_key = (_normalize_command(command), _refresh_plan_fingerprint())
+    tasks = _plan_cache_get(plan_key)
+    cached = tasks is not None
+    if not cached:
+        tasks, err = _plan_tasks(command)
+        if err:
+            return jsonify(err[0]), err[1]
+    body, status = _finish_plan(plan_key, tasks, cached)
+    return jsonify(body), status
+
+
+def _finish_plan(plan_key, tasks, cached):
+    """Fill missing target_nodes, validate, cache a fresh plan. Returns (body, status)."""
+    raw_tasks = copy.deepcopy(tasks)
+
+    node_ids = {n['id'] for n in NODES}
+    for t in tasks:
+        op = t.get('op')
+        specified = t.get('target_node')
+        if specified and specified in node_ids:
+            # 如果指定的节点存在，且后端会在后续校验检查该节点是否支持 op
+            continue
+        # 需要后端填充：找一个能够执行该 op 的节点
+        chosen = find_node_for_op(op)
+        if chosen:
+            t['target_node'] = chosen['id']
+        else:
+            return {'error': f'no node can handle op={op}', 'raw': raw_tasks}, 400
+
+    # 现在对填充后的结构做一次严格校验
+    ok, reason = _validate_tasks_structure({'tasks': tasks})
+    if not ok:
+        return {'error': 'invalid tasks structure after fill', 'detail': reason, 'raw': tasks}, 400
+
+    if not cached:
+        _plan_cache_put(plan_key, raw_tasks)
+    # 成功：返回解析并校验后的 tasks（包含 target_node）
+    return {'tasks': tasks, 'info': 'analyze successful', 'cached': cached}, 200
+
+
+def _plan_prompt(command):
     # 生成 prompt：强制模型仅返回 JSON，并且为每个 task 指定 target_node（必须是下面给出的节点 id 之一）
     allowed_ops = sorted(list(_all_allowed_ops()))
     node_ids = [n['id'] for n in NODES]
     prompt = (
         "You are an assistant that splits a user's high-level command into a sequence of small tasks.\n"
-        "Return only a JSON object with the shape: { \"tasks\": [ { \"id\": string, \"op\": string, \"params\": object, \"target_node\": string }, ... ] }\n"
+        "Return only a JSON object with the shape: { \"tasks\": [ { \"id\": string, \"op\": string, \"params\": object, \"target_node\": string, \"depends_on\": [string] }, ... ] }\n"
+        "Give every task a unique id. Set \"depends_on\" to the ids of the tasks whose output it needs; use [] only for tasks that are independent of all others, so they can run in parallel.\n"
+        "When several independent ai_execute tasks run in parallel, give each a distinct params.output_key so their results do not overwrite each other.\n"
         "For each task, set \"target_node\" to one of the following node ids: " + ", ".join(node_ids) + ".\n"
         "Ensure that the chosen target_node actually supports the requested operation (i.e., its skills include the op).\n"
         "Use only these operations: " + ", ".join(allowed_ops) + ".\n"
         "Do not include any code, commands, or explanation text—only the JSON.\n"
         f"User command: {command}\n"
     )
+    return prompt
 
+
+def _plan_tasks(command):
+    """Ask the model to split `command`; returns (tasks, None) or (None, (error body, status))."""
     try:
-        resp = openai_client.chat.completions.create(
-            model='gpt-4o-mini',
-            messages=[{"role": "user", "content": prompt}],
+        text = chat_completion(
+            [{"role": "user", "content": _plan_prompt(command)}],
             max_tokens=800,
             temperature=0.0,
         )
     except Exception as e:
-        return jsonify({'error': 'openai error', 'detail': str(e)}), 500
+        return None, ({'error': 'openai error', 'detail': str(e)}, 500)
+    return _parse_plan(text)
 
-    # 尝试从模型输出中提取 JSON
-    text = ''
-    try:
-        text = resp.choices[0].message.content
-    except Exception:
-        # fallback: convert to str
-        text = str(resp)
 
+def _parse_plan(text):
+    """Extract the tasks list from model output; returns (tasks, None) or (None, (error body, status))."""
+    # 尝试从模型输出中提取 JSON
     parsed = _extract_json_candidate(text)
     if parsed is None:
-        return jsonify({'error': 'failed to parse JSON from model output', 'raw': text}), 502
+        return None, ({'error': 'failed to parse JSON from model output', 'raw': text}, 502)
 
-    # 如果模型没有指定 target_node 或指定了不存在的 node，后端尝试填充一个可用的节点
+    # 如果模型没有指定 target_node 或指定了不存在的 node，由调用方补全
     tasks = parsed.get('tasks') if isinstance(parsed, dict) else None
     if not isinstance(tasks, list):
-        return jsonify({'error': 'parsed output missing tasks list', 'raw': parsed}), 502
-
-    node_ids = {n['id'] for n in NODES}
-    for t in tasks:
-        op = t.get('op')
-        specified = t.get('target_node')
-        if specified and specified in node_ids:
-            # 如果指定的节点存在，且后端会在后续校验检查该节点是否支持 op
-            continue
-        # 需要后端填充：找一个能够执行该 op 的节点
-        chosen = find_node_for_op(op)
-        if chosen:
-            t['target_node'] = chosen['id']
-        else:
-            return jsonify({'error': f'no node can handle op={op}', 'raw': parsed}), 400
-
-    # 现在对填充后的结构做一次严格校验
-    ok, reason = _validate_tasks_structure({'tasks': tasks})
-    if not ok:
-        return jsonify({'error': 'invalid tasks structure after fill', 'detail': reason, 'raw': tasks}), 400
+        return None, ({'error': 'parsed output missing tasks list', 'raw': parsed}, 502)
+    if not all(isinstance(t, dict) for t in tasks):
+        return None, ({'error': 'tasks must be objects', 'raw': parsed}, 502)
+    return tasks, None
 
-    # 成功：返回解析并校验后的 tasks（包含 target_node）
-    return jsonify({'tasks': tasks, 'info': 'analyze successful'})
-
-if __name__ == "__main__":
-    # 支持通过 PORT 环境变量指定端口，便于单机运行多个实例
-    port = int(os.getenv('PORT', '5000'))
+def start_node_services(port):
+    """mDNS advertising/discovery and the metrics updater (shared by net.py and net_async.py)."""
     try:
         start_advertising(port)
         start_discovery()
         # start periodic metrics updater (updates local NODES entry and advertised props)
         try:
-            start_metrics_updater(interval=3)
+            start_metrics_updater()
         except Exception as e:
             print('metrics updater failed to start:', e)
     except Exception as e:
         print('Zeroconf start failed:', e)
 
+
+def stop_node_services():
+    try:
+        if ZC is not None and ZC_INFO is not None:
+            ZC.unregister_service(ZC_INFO)
+            ZC.close()
+    except Exception:
+        pass
+
+
+if __name__ == "__main__":
+    # 支持通过 PORT 环境变量指定端口，便于单机运行多个实例
+    port = int(os.getenv('PORT', '5000'))
+    start_node_services(port)
     try:
         app.run(host="0.0.0.0", port=port)
     finally:
-        try:
-            if ZC is not None and ZC_INFO is not None:
-                ZC.unregister_service(ZC_INFO)
-                ZC.close()
-        except Exception:
-            pass
+        stop_node_services()
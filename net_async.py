@@ -0,0 +1,841 @@
+"""
+Asyncio serving mode for an EchoNet node (ASGI: Starlette + uvicorn).
+
+    python net_async.py                  # PORT 环境变量指定端口，默认 5000
+    uvicorn net_async:app --port 5000
+
+与 net.py 共用配置、节点表、TASK_STORE、调度策略、LLM 缓存和 state 传输协议。
+/task、/execute_step、/run_prompt、/analyze、/nodes、/result 直接跑在事件循环上：
+OpenAI 调用用 AsyncOpenAI，节点间调用用 httpx.AsyncClient，等待模型或对端时不占用线程，
+一个进程可以同时挂起成千上万个请求。其余路由（/task/stream、/execute_batch、各种 *_stats、
+前端静态文件等）交给 net.py 的 Flask 应用，通过 WSGI 适配在线程池中执行。
+
+小规模部署继续用 `python net.py` 即可。
+"""
+
+import asyncio
+import copy
+import json
+import os
+import time
+import types
+import uuid
+import warnings
+from contextlib import asynccontextmanager
+
+import httpx
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except Exception:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        from starlette.middleware.wsgi import WSGIMiddleware
+
+import net
+import wire_codec
+from admission import Overloaded
+from llm_cache import cache_key, normalize_request
+from net import PeerError, PipelineError
+from state_transfer import MissingBlobs
+
+# /result?wait=N 的轮询间隔（秒）
+RESULT_POLL_INTERVAL = float(os.getenv('RESULT_POLL_INTERVAL', '0.1'))
+
+AOPENAI = AsyncOpenAI(api_key=net.OPENAI_API_KEY)
+PEERS = None  # httpx.AsyncClient，在 lifespan 中创建
+BACKGROUND_TASKS = set()  # 流式应答的 step 协程（保持引用直到完成）
+
+
+# ====== LLM 调用（与 net.chat_completion 相同的缓存规则） ======
+async def achat_completion(messages, model='gpt-4o-mini', temperature=None, max_tokens=None, cache=None):
+    """Async twin of net.chat_completion, sharing its persistent cache (and its streaming via net.LLM_STREAM)."""
+    norm = normalize_request(model, messages, temperature, max_tokens)
+    on_delta = net.LLM_STREAM.get()
+    llm_cache = net.LLM_CACHE
+    use_cache = llm_cache is not None and cache is not False and (
+        cache is True or norm['temperature'] <= net.LLM_CACHE_MAX_TEMPERATURE)
+    key = None
+    if use_cache:
+        key = cache_key(model, messages, temperature, max_tokens)
+        hit = await asyncio.to_thread(llm_cache.get, key)
+        if hit is not None:
+            if on_delta is not None:
+                on_delta(hit['content'])
+            return hit['content']
+    elif llm_cache is not None:
+        llm_cache.note_bypass()
+
+    kwargs = {'model': model, 'messages': messages, 'timeout': net._llm_timeout()}
+    if temperature is not None:
+        kwargs['temperature'] = temperature
+    if max_tokens is not None:
+        kwargs['max_tokens'] = max_tokens
+    if on_delta is not None:
+        parts = []
+        started, outcome = time.perf_counter(), 'error'
+        try:
+            with net.TRACER.span('llm', model=model, stream=True):
+                async for chunk in await AOPENAI.chat.completions.create(stream=True, **kwargs):
+                    piece = chunk.choices[0].delta.content if chunk.choices else None
+                    if piece:
+                        parts.append(piece)
+                        on_delta(piece)
+            outcome = 'ok'
+        finally:
+            net.PROM_LLM_SECONDS.observe(time.perf_counter() - started, model, outcome)
+        text = ''.join(parts)
+    else:
+        call = lambda: _observe_llm(model, lambda: AOPENAI.chat.completions.create(**kwargs))
+        if net.HEDGE_LLM:
+            resp, _ = await net.LLM_HEDGER.arun(model, call, call)
+        else:
+            resp = await call()
+        try:
+            text = resp.choices[0].message.content
+        except Exception:
+            text = str(resp)
+    if key is not None and text:
+        await asyncio.to_thread(llm_cache.put, key, model, {'content': text})
+    return text
+
+
+async def _observe_llm(model, call):
+    """Async twin of net._observe_llm."""
+    with net.TRACER.span('llm', model=model) as span:
+        started = time.perf_counter()
+        try:
+            resp = await call()
+        except Exception:
+            net.PROM_LLM_SECONDS.observe(time.perf_counter() - started, model, 'error')
+            raise
+        net.PROM_LLM_SECONDS.observe(time.perf_counter() - started, model, 'ok')
+        net._count_tokens(model, resp, span)
+        return resp
+
+
+# ====== 技能：内置技能的 async 版本；其它 SKILL_IMPL 放到线程池执行 ======
+async def askill_generate_poem_en(state, params):
+    prompt = params.get("prompt", "Write a short poem about i love morven.")
+    state["english_poem"] = await achat_completion([{"role": "user", "content": prompt}], cache=net._cache_opt(params))
+    return state
+
+
+async def askill_translate_zh(state, params):
+    text = state.get("english_poem", "")
+    prompt = params.get("prompt") or f"翻译成中文诗：\n{text}"
+    state["chinese_poem"] = await achat_completion([{"role": "user", "content": prompt}], temperature=0,
+                                                   cache=net._cache_opt(params))
+    return state
+
+
+async def askill_ai_execute(state, params):
+    out_key = params.get('output_key') or 'ai_result'
+    prompt = net._ai_execute_prompt(state, params)
+    if not prompt:
+        state.setdefault(out_key, {'error': 'no prompt provided (please include params.prompt or params.text)'})
+        return state
+    try:
+        text = await achat_completion(
+            [{"role": "user", "content": prompt}],
+            temperature=params.get('temperature', 0.2),
+            max_tokens=800,
+            cache=net._cache_opt(params),
+        )
+        state[out_key] = {'output': text}
+    except Exception as e:
+        state[out_key] = {'error': str(e)}
+    return state
+
+
+ASYNC_SKILL_IMPL = {
+    "generate_poem_en": (net.skill_generate_poem_en, askill_generate_poem_en),
+    "translate_zh": (net.skill_translate_zh, askill_translate_zh),
+    "ai_execute": (net.skill_ai_execute, askill_ai_execute),
+}
+
+
+async def _run_skill(op, state, params):
+    impl = net.SKILL_IMPL[op]
+    sync_impl, async_impl = ASYNC_SKILL_IMPL.get(op, (None, None))
+    # 只有 SKILL_IMPL 里仍是内置实现时才用 async 版本，被替换过的技能按原样在线程里跑
+    if impl is sync_impl:
+        return await async_impl(state, params)
+    return await asyncio.to_thread(impl, state, params)
+
+
+class AsyncSingleFlight:
+    """Event-loop counterpart of net.SingleFlight (shares its counters)."""
+
+    def __init__(self, stats):
+        self._calls = {}  # key -> [asyncio.Future, follower count]
+        self._stats = stats
+
+    async def do(self, key, fn):
+        call = self._calls.get(key)
+        if call is not None:
+            call[1] += 1
+            self._stats.record(shared=True)
+            return copy.deepcopy(await asyncio.shield(call[0])), True
+
+        call = self._calls[key] = [asyncio.get_running_loop().create_future(), 0]
+        self._stats.record(shared=False)
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            call[0].cancel()
+            raise
+        except BaseException as e:
+            call[0].set_exception(e)
+            # 没有等待者时避免 "exception was never retrieved"
+            call[0].exception()
+            raise
+        finally:
+            self._calls.pop(key, None)
+        call[0].set_result(copy.deepcopy(result) if call[1] else None)
+        return result, False
+
+
+STEP_FLIGHTS = AsyncSingleFlight(net.STEP_FLIGHTS)
+# 同一个 step_id 正在执行时，重试的请求等待它的结果（net.STEP_RESULTS.do 的事件循环版本）
+STEP_ID_FLIGHTS = AsyncSingleFlight(net.STEP_RESULTS._flights)
+
+
+async def _step_result(step_id, fn):
+    """Return (state, deduplicated): a stored or in-flight result for step_id, else await fn()."""
+    state = net.STEP_RESULTS.get(step_id)
+    if state is not None:
+        return state, True
+
+    async def run():
+        result = await fn()
+        net.STEP_RESULTS.put(step_id, result)
+        return result
+
+    state, shared = await STEP_ID_FLIGHTS.do(step_id, run)
+    if shared:
+        net.STEP_RESULTS.note_joined()
+    return state, shared
+
+
+# ====== 节点间调用 ======
+async def _breaker_call(url, call):
+    """Async twin of net._breaker_call (same per-peer breakers, same `peer_call` span)."""
+    net.BREAKERS.before(url)
+    with net.TRACER.span('peer_call', url=url) as span:
+        started = time.monotonic()
+        try:
+            resp = await call()
+        except Exception as e:
+            net.BREAKERS.record(url, None if net._deadline_expired() else False, time.monotonic() - started, str(e))
+            net._observe_peer(url, 'error', time.monotonic() - started)
+            raise
+        ok = None if resp.status_code == 504 else resp.status_code < 500
+        net.BREAKERS.record(url, ok, time.monotonic() - started, None if ok is not False else f"HTTP {resp.status_code}")
+        net._observe_peer(url, resp.status_code, time.monotonic() - started)
+        if span is not None:
+            span['status'] = resp.status_code
+        return resp
+
+
+def _hop_timeout():
+    """httpx timeout for one peer hop (see net._hop_timeout); the client default without a deadline."""
+    left = net._hop_timeout()
+    if left is None:
+        return httpx.USE_CLIENT_DEFAULT
+    return httpx.Timeout(left, connect=net.PEER_POOL.connect_timeout)
+
+
+async def _peer_post(url, obj):
+    net._check_deadline()
+    with net.TRACER.span('serialize', codec='wire'):
+        body, headers = net.PEER_CODECS.encode(url, obj)
+    # httpx 总能解 gzip；zstd 响应是否自动解码取决于 httpx 版本，所以这里只要 gzip
+    headers["Accept-Encoding"] = "gzip"
+    headers = net._deadline_headers(headers)
+    timeout = _hop_timeout()
+    resp = await _breaker_call(url, lambda: PEERS.post(url, content=body, headers=net.TRACER.headers(headers),
+                                                       timeout=timeout))
+    net.PEER_CODECS.learn(url, resp)
+    return resp
+
+
+def _decode_response(resp):
+    # httpx 已经按 Content-Encoding 解压过了
+    return wire_codec.loads(resp.content, resp.headers.get("Content-Type"))
+
+
+async def _post_state(target_node, url, payload, state):
+    """Async twin of net._post_state (delta transfer with one resend on 409)."""
+    if net.STATE_TRANSFER != 'delta':
+        return await _peer_post(url, dict(payload, state=state)), []
+    peer = target_node['url']
+    for _ in range(2):
+        with net.TRACER.span('serialize', codec='delta'):
+            wire, sent = net.PEER_BLOBS.encode(peer, state)
+        resp = await _peer_post(url, dict(payload, state=wire, transfer='delta'))
+        if resp.status_code != 409:
+            break
+        try:
+            missing = _decode_response(resp).get('missing') or []
+        except Exception:
+            break
+        net.PEER_BLOBS.forget(peer, missing)
+    return resp, sent
+
+
+# ====== 执行 ======
+def _step_payload(step):
+    payload = {"op": step["op"], "params": step.get("params", {})}
+    if step.get('step_id'):
+        payload["step_id"] = step['step_id']
+    return payload
+
+
+async def _dispatch_step(target_node, step, state):
+    """Async twin of net._dispatch_step."""
+    op = step["op"]
+    params = step.get("params", {})
+    net._check_deadline(f"before step {op}")
+    started = time.perf_counter()
+    where = 'local' if target_node["id"] == net.SELF_ID else 'remote'
+    with net._track_inflight(target_node["id"]), net._observe_step(op, where), \
+            net.TRACER.span('step', op=op, node=target_node["id"], where=where):
+        if target_node["id"] == net.SELF_ID:
+            if net.SKILL_IMPL.get(op) is None:
+                raise PipelineError(500, {"error": f"skill {op} not implemented on this node"})
+            # 与 Flask 模式一样计入本节点的并发/排队数但不拒绝；排队最多等到 deadline
+            try:
+                with net.TRACER.span('admission'):
+                    admitted = await net.ADMISSION.acquire_async(False, *net._admission_args(), timeout=net._remaining())
+            except Overloaded:
+                raise net._deadline_error(f"waiting for an execution slot for {op}")
+            try:
+                with net.TRACER.span('skill', op=op):
+                    state = await _run_skill(op, state, params)
+            finally:
+                net.ADMISSION.release(admitted)
+        else:
+            remote_base = target_node["url"].rstrip('/')
+            if op in target_node.get('skills', []):
+                url = remote_base + "/execute_step"
+                try:
+                    resp, sent = await _post_state(target_node, url, net._with_user(_step_payload(step)), state)
+                except Exception as e:
+                    raise PeerError(500, {"error": f"remote node {target_node['id']} failed to connect to execute_step", "detail": str(e)})
+                net._raise_if_overloaded(target_node, resp)
+                if resp.status_code != 200:
+                    raise PeerError(500, {"error": f"remote node {target_node['id']} failed execute_step", "detail": resp.text})
+                try:
+                    body = _decode_response(resp)
+                except Exception:
+                    raise PeerError(502, {"error": "invalid JSON from remote execute_step", "detail": resp.text})
+                if body.get('deduplicated'):
+                    step['deduplicated'] = True
+                state = net._state_from_reply(target_node, body, state, sent)
+            else:
+                url = remote_base + "/run_prompt"
+                prompt = f"Perform operation '{op}' with params {json.dumps(params)} on the provided state and return the full updated state as JSON."
+                net._check_deadline()
+                try:
+                    payload = net._with_user({"prompt": prompt, "state": state, "op": op, "params": params})
+                    resp = await _breaker_call(url, lambda: PEERS.post(
+                        url, json=payload, headers=net.TRACER.headers(net._deadline_headers()), timeout=_hop_timeout()))
+                except Exception as e:
+                    raise PeerError(500, {"error": f"remote node {target_node['id']} failed to connect (run_prompt)", "detail": str(e)})
+                net._raise_if_overloaded(target_node, resp)
+                if resp.status_code != 200:
+                    raise PeerError(500, {"error": f"remote node {target_node['id']} failed run_prompt", "detail": resp.text})
+                try:
+                    body = resp.json()
+                    net.TRACER.merge(body.get("spans"))
+                    state = body.get("state", state)
+                except Exception:
+                    raise PeerError(502, {"error": "invalid JSON from remote run_prompt", "detail": resp.text})
+    step['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return state
+
+
+async def _dispatch_hedged(target_node, step, state):
+    """Async twin of net._dispatch_hedged (the losing attempt is cancelled)."""
+    backup_node = net._hedge_backup_node(target_node, step)
+    if backup_node is None and not net.HEDGE_STEPS:
+        return await _dispatch_step(target_node, step, state)
+
+    async def attempt(node, st):
+        own = dict(step, executed_by=node["id"])
+        return await _dispatch_step(node, own, st), own
+
+    backup = None
+    if backup_node is not None:
+        backup = lambda: attempt(backup_node, copy.deepcopy(state) if backup_node["id"] == net.SELF_ID else state)
+    (state, done), hedge = await net.STEP_HEDGER.arun(step["op"], lambda: attempt(target_node, state), backup)
+    step.update(done)
+    if hedge is not None:
+        step['hedged'] = {'backup': backup_node["id"], 'winner': hedge}
+    return state
+
+
+async def _run_step(step, state, policy=None):
+    """Async twin of net._execute_with_failover."""
+    node = net._place_step(step, policy)
+    step.setdefault('step_id', uuid.uuid4().hex)
+    failed = set()
+    for attempt in range(net.STEP_RETRIES + 1):
+        try:
+            return await _execute_on_node(node, step, state)
+        except PeerError as e:
+            net._check_deadline(e.body.get('error'))
+            if attempt == net.STEP_RETRIES:
+                net._count_failover('exhausted')
+                raise
+            failed.add(node['id'])
+            nxt = net._next_node(step, policy, failed, node)
+            net._record_attempt(step, node, e, nxt)
+            await asyncio.sleep(net._retry_delay(attempt, e))
+            node = nxt
+
+
+async def _execute_on_node(target_node, step, state):
+    params = step.get("params", {})
+    if not net._coalescible(params):
+        return await _dispatch_hedged(target_node, step, state)
+
+    async def leader():
+        return await _dispatch_hedged(target_node, step, state), step['executed_by']
+
+    started = time.perf_counter()
+    (state, executed_by), shared = await STEP_FLIGHTS.do(net._step_key(step["op"], params, state), leader)
+    if shared:
+        step['executed_by'] = executed_by
+        step['coalesced'] = True
+        step['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return state
+
+
+async def _run_dag(pipeline, state, policy=None, deltas=None, save=None):
+    """Async twin of net._run_dag (same deterministic join, at most DAG_MAX_PARALLEL steps at once)."""
+    ids, deps = net._dag_plan(pipeline)
+    n = len(pipeline)
+    ancestors = net._dag_ancestors(deps)
+    deltas = dict(deltas or {})
+    pending = set(range(n)) - deltas.keys()
+    running = {}
+    try:
+        while pending or running:
+            for i in sorted(pending):
+                if len(running) >= net.DAG_MAX_PARALLEL:
+                    break
+                if deps[i] <= deltas.keys():
+                    pipeline[i]['id'] = ids[i]
+                    inp = net._dag_input_state(state, ancestors[i], deltas)
+                    task = asyncio.ensure_future(_run_step(pipeline[i], copy.deepcopy(inp), policy))
+                    running[task] = (i, inp)
+                    pending.discard(i)
+            done, _ = await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                i, inp = running.pop(task)
+                deltas[i] = net._state_delta(inp, task.result())
+                if save is not None and len(deltas) < n:
+                    await asyncio.to_thread(save, {'state': state, 'deltas': deltas})
+    finally:
+        for task in running:
+            task.cancel()
+
+    for i in range(n):
+        state.update(deltas[i])
+    return state
+
+
+async def _run_pipeline(pipeline, state, policy=None, task_id=None):
+    """Async twin of net._run_pipeline (same checkpoints, so either server can resume the task).
+
+    Task store reads and checkpoint writes (SQLite with TASK_STORE=sqlite) run in a thread.
+    """
+    checkpoint, save = await asyncio.to_thread(net._checkpointer, task_id)
+    dag = net._is_dag(pipeline)
+    if save is not None and checkpoint is None:
+        await asyncio.to_thread(save, {'state': state, 'deltas': {}} if dag else {'next': 0, 'state': state})
+    if dag:
+        if checkpoint is None:
+            return await _run_dag(pipeline, state, policy, None, save)
+        deltas = {int(i): d for i, d in checkpoint['deltas'].items()}
+        return await _run_dag(pipeline, checkpoint['state'], policy, deltas, save)
+    start = 0
+    if checkpoint is not None:
+        state, start = checkpoint['state'], checkpoint['next']
+    # 异步模式逐步执行（不做 /execute_segment 合并）
+    for i in range(start, len(pipeline)):
+        state = await _run_step(pipeline[i], state, policy)
+        if save is not None and i + 1 < len(pipeline):
+            await asyncio.to_thread(save, {'next': i + 1, 'state': state})
+    return state
+
+
+async def _update_task(task_id, **fields):
+    # TASK_STORE 可能是 SQLite，不在事件循环上做磁盘写入
+    await asyncio.to_thread(net._update_task, task_id, **fields)
+
+
+async def _execute_task(task_id, state, policy=None, deadline=None, trace=None):
+    await _update_task(task_id, status='running')
+    if trace is not None:
+        trace.waited('queue')
+    owner, pipeline = await asyncio.to_thread(lambda: (net.TASK_STORE.owner(task_id), net.TASK_STORE.pipeline(task_id)))
+    user = net.CURRENT_USER.set(net._user_of(owner))
+    scope = net.DEADLINE.set(deadline)
+    try:
+        with net.TRACER.activate(trace):
+            state = await _run_pipeline(pipeline, state, policy, task_id)
+    except PipelineError as e:
+        await _update_task(task_id, status='failed', error=e.body, trace=net.TRACER.finish(trace, e.body.get('error')))
+        raise
+    except Exception as e:
+        await _update_task(task_id, status='failed', error={'error': 'pipeline failed', 'detail': str(e)},
+                           trace=net.TRACER.finish(trace, str(e)))
+        raise
+    finally:
+        net.DEADLINE.reset(scope)
+        net.CURRENT_USER.reset(user)
+    await _update_task(task_id, status='done', final_state=state, trace=net.TRACER.finish(trace))
+    return state
+
+
+def _execute_task_queued(loop, task_id, state, policy, deadline=None, trace=None):
+    """FAIR worker: run a queued task on the event loop and wait for it (twin of net._execute_task_async)."""
+    try:
+        asyncio.run_coroutine_threadsafe(_execute_task(task_id, state, policy, deadline, trace), loop).result()
+    except Exception as e:
+        print(f"⚠️ task {task_id} failed: {e}")
+    finally:
+        net.TASK_SLOTS.release()
+
+
+async def _admit_step(request, data, deadline, what):
+    """Take an ADMISSION slot for a peer request like the Flask routes do.
+
+    Returns (started, None), or (None, reply) with a 429 (or 504 once the deadline is spent).
+    """
+    try:
+        return await net.ADMISSION.acquire_async(True, *net._admission_args(data.get("user")),
+                                                 timeout=net._remaining()), None
+    except Overloaded as e:
+        if deadline is not None and time.monotonic() >= deadline:
+            return None, _reply(request, net._deadline_error(f"waiting for an execution slot for {what}").body, 504)
+        return None, _overloaded(request, e)
+
+
+# ====== 请求/响应辅助 ======
+def _require_token(request):
+    return net._require_token(types.SimpleNamespace(headers=request.headers, args=request.query_params))
+
+
+async def _request_body(request):
+    return wire_codec.decode_body(await request.body(), request.headers.get("Content-Encoding"),
+                                  request.headers.get("Content-Type"))
+
+
+def _reply(request, obj, status=200):
+    body, ctype, headers = wire_codec.encode_response(obj, request.headers.get("Accept", ""),
+                                                      request.headers.get("Accept-Encoding", ""))
+    if status == 429 and isinstance(obj, dict) and obj.get('retry_after'):
+        headers['Retry-After'] = str(obj['retry_after'])
+    return Response(body, status_code=status, media_type=ctype, headers=headers)
+
+
+def _overloaded(request, e, **extra):
+    return _reply(request, dict(extra, error=e.reason, retry_after=e.retry_after), 429)
+
+
+async def _stream_ndjson(fn):
+    """Async twin of net._stream_ndjson: run fn() as a task, yielding its LLM deltas and then its result."""
+    lines = asyncio.Queue()
+
+    async def worker():
+        net.LLM_STREAM.set(lambda text: lines.put_nowait({'event': 'delta', 'text': text}))
+        try:
+            lines.put_nowait(dict(await fn(), event='result'))
+        except PipelineError as e:
+            lines.put_nowait(dict(e.body, event='error', status=e.status))
+        except Exception as e:
+            lines.put_nowait({'event': 'error', 'status': 500, 'error': 'skill failed', 'detail': str(e)})
+
+    # 客户端断开后 step 继续执行完（与 Flask 模式相同），结果仍进入 STEP_RESULTS
+    task = asyncio.create_task(worker())
+    BACKGROUND_TASKS.add(task)
+    task.add_done_callback(BACKGROUND_TASKS.discard)
+    while True:
+        line = await lines.get()
+        yield json.dumps(line, ensure_ascii=False) + '\n'
+        if line['event'] != 'delta':
+            return
+
+
+# ====== 路由 ======
+async def handle_task(request):
+    token, err = _require_token(request)
+    if err:
+        return _reply(request, {'error': err[0]}, err[1])
+    try:
+        data = await _request_body(request) or {}
+    except wire_codec.CodecError as e:
+        return _reply(request, {'error': 'cannot decode request body', 'detail': str(e)}, 400)
+    # 与 Flask 模式（net._admit_task / net._run_task）相同：按用户的令牌桶、全局 TASK_SLOTS 名额，
+    # 同步任务计入用户并发上限，异步任务进入按权重的公平队列
+    user = net._user_of(token)
+    run_async = net._is_truthy(data.get('async')) or net._is_truthy(request.query_params.get('async'))
+    try:
+        net.FAIR.check_rate(user)
+    except Overloaded as e:
+        return _overloaded(request, e)
+    if not net.TASK_SLOTS.acquire(blocking=False):
+        return _reply(request, {'error': 'task queue full', 'retry_after': net.ADMISSION.retry_after()}, 429)
+    if not run_async:
+        try:
+            net.FAIR.try_start(user)
+        except Overloaded as e:
+            net.TASK_SLOTS.release()
+            return _overloaded(request, e)
+    try:
+        task_id, state, policy, deadline, trace = await asyncio.to_thread(net._new_task, token, data, request.headers)
+    except PipelineError as e:
+        net.TASK_SLOTS.release()
+        if not run_async:
+            net.FAIR.finish(user)
+        return _reply(request, e.body, e.status)
+
+    if run_async:
+        try:
+            net.FAIR.submit(user, _execute_task_queued, asyncio.get_running_loop(), task_id, state, policy,
+                            deadline, trace)
+        except Overloaded as e:
+            net.TASK_SLOTS.release()
+            await _update_task(task_id, status='failed', error={'error': e.reason, 'retry_after': e.retry_after})
+            return _overloaded(request, e, task_id=task_id)
+        body = {'task_id': task_id, 'status': 'queued', 'result_url': f'/result/{task_id}'}
+        if trace is not None:
+            body.update(trace_id=trace.trace_id, trace_url=f'/task/{task_id}/trace')
+        return _reply(request, body, 202)
+
+    try:
+        state = await _execute_task(task_id, state, policy, deadline, trace)
+    except PipelineError as e:
+        # task_id 让客户端可以 /task/<task_id>/resume
+        return _reply(request, net._trace_extra(trace, dict(e.body, task_id=task_id)), e.status)
+    finally:
+        net.FAIR.finish(user)
+        net.TASK_SLOTS.release()
+    pipeline = await asyncio.to_thread(net.TASK_STORE.pipeline, task_id)
+    return _reply(request, net._trace_extra(trace, {"task_id": task_id, "final_state": state, "pipeline": pipeline}))
+
+
+async def execute_step(request):
+    trace = net.TRACER.join(request.headers.get(net.TRACEPARENT), 'execute_step')
+    try:
+        with net._trace_span(trace, 'deserialize', codec='wire'):
+            data = await _request_body(request) or {}
+    except wire_codec.CodecError as e:
+        return _reply(request, {"error": "cannot decode request body", "detail": str(e)}, 400)
+    op = data.get("op")
+    params = data.get("params", {})
+    if op not in net.self_skills():
+        return _reply(request, {"error": f"this node cannot handle {op}"}, 400)
+    if net.SKILL_IMPL.get(op) is None:
+        return _reply(request, {"error": f"skill {op} not implemented in code"}, 500)
+    try:
+        deadline = net._incoming_deadline(request.headers)
+        with net._trace_span(trace, 'deserialize', codec=data.get('transfer') or 'full'):
+            state, before = net._receive_state(data)
+    except MissingBlobs as e:
+        return _reply(request, {"error": "missing blobs", "missing": e.hashes}, 409)
+    except PipelineError as e:
+        return _reply(request, e.body, e.status)
+    net.DEADLINE.set(deadline)  # 每个请求在自己的 context 中处理
+
+    # 与 Flask 节点共用按 step_id 的结果表：重试的 step 直接返回上次的结果
+    step_id = data.get("step_id")
+    done = net.STEP_RESULTS.get(step_id) if step_id else None
+    if done is not None:
+        with net._trace_span(trace, 'respond'):
+            body = net._state_reply_body(done, before, deduplicated=True)
+        return _reply(request, net._with_spans(body, trace))
+
+    with net._trace_span(trace, 'admission'):
+        started, rejected = await _admit_step(request, data, deadline, op)
+    if rejected is not None:
+        return rejected
+
+    async def execute():
+        with net._observe_step(op, 'served'), net._trace_span(trace, 'skill', op=op):
+            if net._coalescible(params):
+                return (await STEP_FLIGHTS.do(net._step_key(op, params, state), lambda: _run_skill(op, state, params)))[0]
+            return await _run_skill(op, state, params)
+
+    async def run():
+        """Reply body for this step: executed now, or joined in flight by step_id."""
+        try:
+            if step_id:
+                result, dedup = await _step_result(step_id, execute)
+            else:
+                result, dedup = await execute(), False
+        finally:
+            net.ADMISSION.release(started)
+        with net._trace_span(trace, 'respond'):
+            body = net._state_reply_body(result, before, **({'deduplicated': True} if dedup else {}))
+        return net._with_spans(body, trace)
+
+    # stream: true（Flask 协调节点的流式任务）按 NDJSON 逐段返回 LLM 输出
+    if data.get("stream"):
+        return StreamingResponse(_stream_ndjson(run), media_type=net.NDJSON)
+    try:
+        return _reply(request, await run())
+    except PipelineError as e:
+        return _reply(request, e.body, e.status)
+    except Exception as e:
+        return _reply(request, {"error": f"skill {op} failed", "detail": str(e)}, 500)
+
+
+async def run_prompt(request):
+    trace = net.TRACER.join(request.headers.get(net.TRACEPARENT), 'run_prompt')
+    try:
+        with net._trace_span(trace, 'deserialize', codec='json'):
+            data = await request.json()
+    except Exception:
+        data = {}
+    data = data or {}
+    prompt = data.get("prompt")
+    state = data.get("state", {})
+    if not isinstance(prompt, str) or not prompt.strip():
+        return JSONResponse({"error": "missing prompt"}, 400)
+    try:
+        deadline = net._incoming_deadline(request.headers)
+    except PipelineError as e:
+        return JSONResponse(e.body, e.status)
+    net.DEADLINE.set(deadline)
+    with net._trace_span(trace, 'admission'):
+        started, rejected = await _admit_step(request, data, deadline, 'ai_execute')
+    if rejected is not None:
+        return rejected
+    try:
+        with net._trace_span(trace, 'skill', op='ai_execute'):
+            state = await askill_ai_execute(state, {"prompt": prompt})
+    except PipelineError as e:
+        return JSONResponse(e.body, e.status)
+    except Exception as e:
+        return JSONResponse({"error": "ai_execute failed", "detail": str(e)}, 500)
+    finally:
+        net.ADMISSION.release(started)
+    return JSONResponse(net._with_spans({"state": state}, trace))
+
+
+async def analyze(request):
+    try:
+        data = await request.json()
+    except Exception:
+        data = {}
+    command = (data or {}).get('command')
+    if not command or not isinstance(command, str):
+        return JSONResponse({'error': 'missing command'}, 400)
+
+    plan_key = (net._normalize_command(command), net._refresh_plan_fingerprint())
+    tasks = net._plan_cache_get(plan_key)
+    cached = tasks is not None
+    if not cached:
+        try:
+            text = await achat_completion(
+                [{"role": "user", "content": net._plan_prompt(command)}],
+                max_tokens=800,
+                temperature=0.0,
+            )
+        except Exception as e:
+            return JSONResponse({'error': 'openai error', 'detail': str(e)}, 500)
+        tasks, err = net._parse_plan(text)
+        if err:
+            return JSONResponse(err[0], err[1])
+    body, status = net._finish_plan(plan_key, tasks, cached)
+    return JSONResponse(body, status)
+
+
+async def nodes_list(request):
+    return JSONResponse({'nodes': net._nodes_snapshot()})
+
+
+async def get_result(request):
+    task_id = request.path_params['task_id']
+    token, err = _require_token(request)
+    if err:
+        return JSONResponse({'error': err[0]}, err[1])
+    t = await asyncio.to_thread(net.TASK_STORE.get, task_id)
+    if not t:
+        return JSONResponse({'error': 'task not found'}, 404)
+    if t['owner'] != token:
+        return JSONResponse({'error': 'forbidden'}, 403)
+
+    try:
+        wait = min(max(float(request.query_params.get('wait', 0)), 0.0), net.RESULT_MAX_WAIT)
+    except ValueError:
+        return JSONResponse({'error': 'wait must be a number of seconds'}, 400)
+    # 长轮询：任务可能由线程（Flask 路由）或事件循环更新，这里按间隔检查状态，不占线程
+    deadline = time.monotonic() + wait
+    if t['status'] not in net.TASK_FINAL_STATUSES and wait > 0:
+        while (await asyncio.to_thread(net.TASK_STORE.status, task_id)) not in net.TASK_FINAL_STATUSES \
+                and time.monotonic() < deadline:
+            await asyncio.sleep(min(RESULT_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+        t = await asyncio.to_thread(net.TASK_STORE.get, task_id) or t
+    return JSONResponse(net._task_view(task_id, t))
+
+
+def _timed(route, handler):
+    """Record request count and latency for a native route under the same labels as net.py."""
+    async def timed(request):
+        started, status = time.perf_counter(), 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+            return response
+        finally:
+            net._observe_request(route, request.method, status, time.perf_counter() - started)
+    return timed
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global PEERS
+    pool = net.PEER_POOL
+    PEERS = httpx.AsyncClient(
+        timeout=httpx.Timeout(pool.read_timeout, connect=pool.connect_timeout),
+        limits=httpx.Limits(max_keepalive_connections=pool.pool_size * max(len(net.NODES), 1) if pool.keepalive else 0,
+                            keepalive_expiry=pool.keepalive or None),
+    )
+    if net._is_truthy(os.getenv('ASYNC_NODE_SERVICES', '1')):
+        net.start_node_services(int(os.getenv('PORT', '5000')))
+    try:
+        yield
+    finally:
+        await PEERS.aclose()
+        net.stop_node_services()
+
+
+app = Starlette(
+    routes=[
+        Route('/task', _timed('/task', handle_task), methods=['POST']),
+        Route('/execute_step', _timed('/execute_step', execute_step), methods=['POST']),
+        Route('/run_prompt', _timed('/run_prompt', run_prompt), methods=['POST']),
+        Route('/analyze', _timed('/analyze', analyze), methods=['POST']),
+        Route('/nodes', _timed('/nodes', nodes_list), methods=['GET']),
+        Route('/result/{task_id}', _timed('/result/<task_id>', get_result), methods=['GET']),
+        # 其它路由（包括 /metrics）和前端静态文件沿用 Flask 实现，请求指标由 Flask 的钩子记录
+        Mount('/', app=WSGIMiddleware(net.app)),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv('PORT', '5000')))
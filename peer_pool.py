@@ -0,0 +1,179 @@
+"""
+Pooled keep-alive HTTP sessions for node-to-node calls.
+
+每个对端（scheme://host:port）一个 requests.Session，底层由 urllib3 连接池复用 TCP 连接，
+避免每个 step 都重新握手。配置可通过环境变量覆盖：
+
+- PEER_POOL_SIZE         每个对端最多保留的连接数（默认 10）
+- PEER_KEEPALIVE         空闲多少秒后丢弃该对端的连接（默认 60；0 表示不使用 keep-alive）
+- PEER_CONNECT_TIMEOUT   建连超时秒数（默认 3）
+- PEER_READ_TIMEOUT      读超时秒数（默认 60）
+"""
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class PeerSessionPool:
+    """A keep-alive `requests.Session` per peer base URL, with reuse statistics."""
+
+    def __init__(self, pool_size: Optional[int] = None, keepalive: Optional[float] = None,
+                 connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None):
+        self.pool_size = int(pool_size if pool_size is not None else _env_float("PEER_POOL_SIZE", 10))
+        self.keepalive = keepalive if keepalive is not None else _env_float("PEER_KEEPALIVE", 60)
+        self.connect_timeout = connect_timeout if connect_timeout is not None else _env_float("PEER_CONNECT_TIMEOUT", 3)
+        self.read_timeout = read_timeout if read_timeout is not None else _env_float("PEER_READ_TIMEOUT", 60)
+        self._lock = threading.RLock()  # request() 持锁调用 session_for
+        # base url -> {"session", "last_used", "requests", "retired_connections", "retired_requests"}
+        self._peers: Dict[str, Dict[str, Any]] = {}
+        # session -> 正在使用它的请求数；换下来的 session 要等这个数归零才关闭
+        self._inflight: Dict[requests.Session, int] = {}
+        self._retiring: Dict[requests.Session, Dict[str, Any]] = {}  # 换下来的 session -> 所属 peer
+
+    @staticmethod
+    def _base(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _new_session(self) -> requests.Session:
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        if not self.keepalive:
+            s.headers["Connection"] = "close"
+        return s
+
+    def session_for(self, url: str) -> requests.Session:
+        """The peer's current session (replacing it after PEER_KEEPALIVE idle seconds)."""
+        base = self._base(url)
+        now = time.monotonic()
+        with self._lock:
+            peer = self._peers.get(base)
+            if peer is None:
+                peer = {"session": self._new_session(), "last_used": now, "requests": 0,
+                        "retired_connections": 0, "retired_requests": 0}
+                self._peers[base] = peer
+            elif self.keepalive and now - peer["last_used"] > self.keepalive:
+                # 空闲太久，对端很可能已经关闭了连接：整体换一个新的 session。
+                # 旧 session 上可能还有别的线程的请求在途，等它们结束再关闭
+                old = peer["session"]
+                peer["session"] = self._new_session()
+                if self._inflight.get(old):
+                    self._retiring[old] = peer
+                else:
+                    self._retire(peer, old)
+            peer["last_used"] = now
+            peer["requests"] += 1
+            return peer["session"]
+
+    def request(self, method: str, url: str, timeout: Any = None, **kwargs) -> requests.Response:
+        """Like `requests.request`, on the peer's pooled session.
+
+        `timeout` may be None (use the pool's connect/read timeouts), a number
+        (read timeout, keeping the pool's connect timeout) or a (connect, read) tuple.
+        """
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        elif not isinstance(timeout, tuple):
+            timeout = (min(self.connect_timeout, timeout), timeout)
+        with self._lock:
+            session = self.session_for(url)
+            self._inflight[session] = self._inflight.get(session, 0) + 1
+        try:
+            return session.request(method, url, timeout=timeout, **kwargs)
+        finally:
+            with self._lock:
+                left = self._inflight.pop(session) - 1
+                if left:
+                    self._inflight[session] = left
+                elif session in self._retiring:
+                    self._retire(self._retiring.pop(session), session)
+
+    def _retire(self, peer: Dict[str, Any], session: requests.Session) -> None:
+        """Close a replaced session, keeping its counters in the peer's stats (caller holds the lock)."""
+        conns, reqs = self._pool_counters(session)
+        peer["retired_connections"] += conns
+        peer["retired_requests"] += reqs
+        session.close()
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    @staticmethod
+    def _pools(session: requests.Session):
+        adapter = session.get_adapter("http://")
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                yield pool
+
+    @classmethod
+    def _pool_counters(cls, session: requests.Session):
+        conns = reqs = 0
+        for pool in cls._pools(session):
+            conns += pool.num_connections
+            reqs += pool.num_requests
+        return conns, reqs
+
+    @classmethod
+    def _open_connections(cls, session: requests.Session) -> int:
+        open_conns = 0
+        for pool in cls._pools(session):
+            q = pool.pool
+            if q is None:
+                continue
+            idle = sum(1 for c in list(q.queue) if c is not None)
+            in_use = pool.pool.maxsize - q.qsize()
+            open_conns += idle + in_use
+        return open_conns
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-peer request count, new connections, reuse rate and open connections."""
+        peers = {}
+        with self._lock:
+            items = list(self._peers.items())
+        for base, peer in items:
+            conns, reqs = self._pool_counters(peer["session"])
+            conns += peer["retired_connections"]
+            reqs += peer["retired_requests"]
+            peers[base] = {
+                "requests": peer["requests"],
+                "new_connections": conns,
+                "reuse_rate": round(1.0 - conns / reqs, 3) if reqs else None,
+                "open_connections": self._open_connections(peer["session"]),
+                "idle_seconds": round(time.monotonic() - peer["last_used"], 1),
+            }
+        return {
+            "pool_size": self.pool_size,
+            "keepalive": self.keepalive,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "peers": peers,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            for peer in self._peers.values():
+                peer["session"].close()
+            for session in self._retiring:
+                session.close()
+            self._peers.clear()
+            self._retiring.clear()
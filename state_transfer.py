@@ -0,0 +1,209 @@
+"""
+Delta-encoded, content-addressed state transfer between nodes.
+
+协议（对旧节点向后兼容）：
+
+- 协调节点发送 { ..., "state": wire_state, "transfer": "delta" }。wire_state 中较大的值
+  （序列化后 >= STATE_BLOB_MIN_BYTES）如果对端已经持有，就替换为 {"$blob": "<sha256>"}。
+- 对端用本地 BlobStore 还原 state；缺失的 blob 返回 409 { "missing": [hash, ...] }，
+  协调节点把这些值完整重发一次。
+- 对端执行完后只返回变化的键：{ "delta": {...}, "removed": [...], "transfer": "delta" }。
+- 旧节点会忽略 "transfer" 并返回完整的 { "state" }；协调节点只有在对端以 delta 模式
+  应答之后才开始发送 $blob 引用，因此不会把引用发给不认识它的节点。
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+BLOB_REF = "$blob"
+BLOB_MIN_BYTES = int(os.getenv("STATE_BLOB_MIN_BYTES", "1024"))
+
+
+class MissingBlobs(Exception):
+    """The incoming state references blobs this node does not hold."""
+
+    def __init__(self, hashes: List[str]):
+        super().__init__(f"missing {len(hashes)} blob(s)")
+        self.hashes = hashes
+
+
+def _canonical(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def blob_hash(value: Any) -> Tuple[str, int]:
+    """Return (sha256 hex, serialized size) of a JSON value."""
+    raw = _canonical(value)
+    return hashlib.sha256(raw).hexdigest(), len(raw)
+
+
+def _is_ref(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and BLOB_REF in value
+
+
+def fingerprint(state: Dict[str, Any]) -> Dict[str, str]:
+    """Per-key content hashes, used to compute deltas even when skills mutate values in place."""
+    return {k: blob_hash(v)[0] for k, v in state.items()}
+
+
+class BlobStore:
+    """Bounded LRU of hash -> value, limited by total serialized bytes."""
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("STATE_BLOB_STORE_BYTES", str(64 * 1024 * 1024)))
+        self._items: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, h: str, value: Any, size: int) -> None:
+        with self._lock:
+            if h in self._items:
+                self._items.move_to_end(h)
+                return
+            # 容器类型拷贝一份，避免 skill 原地修改后与哈希不一致
+            if isinstance(value, (dict, list)):
+                value = copy.deepcopy(value)
+            self._items[h] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, (_, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+
+    def get(self, h: str) -> Tuple[bool, Any]:
+        with self._lock:
+            item = self._items.get(h)
+            if item is None:
+                return False, None
+            self._items.move_to_end(h)
+            value = item[0]
+        # 同样返回拷贝：调用方（skill）原地修改不能污染 store 里按哈希保存的值
+        if isinstance(value, (dict, list)):
+            value = copy.deepcopy(value)
+        return True, value
+
+    @staticmethod
+    def large_hashes(state: Dict[str, Any]) -> List[str]:
+        hashes = []
+        for v in state.values():
+            h, size = blob_hash(v)
+            if size >= BLOB_MIN_BYTES:
+                hashes.append(h)
+        return hashes
+
+    def remember(self, state: Dict[str, Any]) -> None:
+        """Store every large value of `state`."""
+        for v in state.values():
+            h, size = blob_hash(v)
+            if size >= BLOB_MIN_BYTES:
+                self.put(h, v, size)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"blobs": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+class PeerBlobIndex:
+    """Coordinator-side record of which blob hashes each peer is known to hold."""
+
+    def __init__(self, max_per_peer: int = 4096):
+        self.max_per_peer = max_per_peer
+        self._peers: Dict[str, "OrderedDict[str, None]"] = {}
+        self._lock = threading.Lock()
+        self.refs_sent = 0
+        self.bytes_saved = 0
+        self.resends = 0
+
+    def known(self, peer: str) -> Set[str]:
+        with self._lock:
+            return set(self._peers.get(peer, ()))
+
+    def learn(self, peer: str, hashes: Iterable[str]) -> None:
+        with self._lock:
+            held = self._peers.setdefault(peer, OrderedDict())
+            for h in hashes:
+                held[h] = None
+                held.move_to_end(h)
+            while len(held) > self.max_per_peer:
+                held.popitem(last=False)
+
+    def forget(self, peer: str, hashes: Iterable[str]) -> None:
+        with self._lock:
+            held = self._peers.get(peer)
+            for h in hashes:
+                if held is not None:
+                    held.pop(h, None)
+            self.resends += 1
+
+    def encode(self, peer: str, state: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """Replace large values the peer already holds with refs.
+
+        Returns (wire_state, hashes of large values sent in full).
+        """
+        known = self.known(peer)
+        wire, sent_full = {}, []
+        refs = saved = 0
+        for k, v in state.items():
+            h, size = blob_hash(v)
+            if size < BLOB_MIN_BYTES:
+                wire[k] = v
+            elif h in known:
+                wire[k] = {BLOB_REF: h}
+                refs += 1
+                saved += size
+            else:
+                wire[k] = v
+                sent_full.append(h)
+        with self._lock:
+            self.refs_sent += refs
+            self.bytes_saved += saved
+        return wire, sent_full
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "peers": {p: len(h) for p, h in self._peers.items()},
+                "refs_sent": self.refs_sent,
+                "bytes_saved": self.bytes_saved,
+                "resends": self.resends,
+            }
+
+
+def decode_state(wire: Dict[str, Any], store: BlobStore) -> Dict[str, Any]:
+    """Resolve $blob refs from `store` (raising MissingBlobs) and remember large inline values."""
+    state, missing = {}, []
+    for k, v in (wire or {}).items():
+        if _is_ref(v):
+            found, value = store.get(v[BLOB_REF])
+            if not found:
+                missing.append(v[BLOB_REF])
+                continue
+            state[k] = value
+        else:
+            state[k] = v
+    if missing:
+        raise MissingBlobs(missing)
+    store.remember(state)
+    return state
+
+
+def make_delta(before: Dict[str, str], after: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Given a `fingerprint` of the input state and the output state, return (changed, removed)."""
+    changed = {}
+    for k, v in after.items():
+        if before.get(k) != blob_hash(v)[0]:
+            changed[k] = v
+    removed = [k for k in before if k not in after]
+    return changed, removed
+
+
+def apply_delta(state: Dict[str, Any], delta: Dict[str, Any], removed: Iterable[str] = ()) -> Dict[str, Any]:
+    out = dict(state)
+    out.update(delta or {})
+    for k in removed or ():
+        out.pop(k, None)
+    return out
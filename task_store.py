@@ -0,0 +1,370 @@
+"""
+Bounded task store behind /task and /result.
+
+MemoryTaskStore：进程内 LRU，限制任务条数、TTL 和 final_state 总字节数。
+SQLiteTaskStore：任务写入 SQLite，节点重启后 /result 仍然可读；内存里只缓存正在执行的任务
+和最近访问过的记录。
+
+两种实现的索引里都只放小字段（owner、status、pipeline、error、时间戳），final_state 编码后
+单独存放（内存实现放在独立的 map 里并计入字节预算，SQLite 实现放在 task_results 表里），
+只有读取结果时才解码。排队/执行中的任务不会被淘汰（执行过程中会就地更新它的 pipeline）。
+
+任务结束时的 trace（各节点的 span 列表）和 final_state 一样单独存放，只在读取 trace 时解码。
+
+执行中的任务每完成一步保存一次 checkpoint（已完成的进度 + 当时的 state），失败的任务可以
+从 checkpoint 继续执行；任务成功结束后 checkpoint 被删除。
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+FINAL_STATUSES = ('done', 'failed')
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+class MemoryTaskStore:
+    """In-process LRU of task records with count, TTL and result-size limits."""
+
+    backend = 'memory'
+
+    def __init__(self, max_tasks: int = 10000, ttl: float = 24 * 3600, max_result_bytes: int = 64 << 20,
+                 prune_every: int = 100):
+        self.max_tasks = max(1, max_tasks)
+        self.ttl = ttl
+        self.max_result_bytes = max_result_bytes
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # 按最近访问排序
+        self._results: Dict[str, str] = {}
+        self._checkpoints: Dict[str, str] = {}
+        self._traces: Dict[str, str] = {}
+        self._result_bytes = 0  # final_state、checkpoint 和 trace 一起计数
+        self._creates = 0
+        self.evictions = 0
+        self.expired = 0
+
+    # ---- 公共接口 ----
+    def create(self, task_id: str, owner: str, pipeline: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        rec = {'owner': owner, 'pipeline': pipeline, 'status': 'queued', 'error': None, 'created': now, 'updated': now}
+        with self._lock:
+            self._index[task_id] = rec
+            self._save_new(task_id, rec)
+            self._creates += 1
+            if self._creates % self.prune_every == 0:
+                self._expire(now)
+            self._evict()
+
+    def update(self, task_id: str, **fields) -> None:
+        """Apply fields to a task; final_state and trace go to their own stores, not the index."""
+        has_result = 'final_state' in fields
+        final_state = fields.pop('final_state', None)
+        trace = fields.pop('trace', None)
+        with self._lock:
+            rec = self._lookup(task_id)
+            if rec is None:
+                return
+            rec.update(fields)
+            rec['updated'] = time.time()
+            self._index.move_to_end(task_id)
+            if has_result:
+                self._save_result(task_id, _dumps(final_state))
+            if trace is not None:
+                self._save_trace(task_id, _dumps(trace))
+            if rec['status'] == 'done':
+                self._save_checkpoint(task_id, rec, None)
+            if rec['status'] in FINAL_STATUSES:
+                self._save_final(task_id, rec)
+            self._evict()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Task record with its decoded final_state, or None if unknown/evicted/expired."""
+        with self._lock:
+            rec = self._lookup(task_id)
+            if rec is None:
+                return None
+            raw = self._load_result(task_id)
+            rec = dict(rec)
+        rec['final_state'] = json.loads(raw) if raw is not None else None
+        return rec
+
+    def save_checkpoint(self, task_id: str, checkpoint: Dict[str, Any]) -> None:
+        """Replace the task's checkpoint (encoded right away, so later state mutations do not leak in)."""
+        raw = _dumps(checkpoint)
+        with self._lock:
+            rec = self._lookup(task_id)
+            if rec is None:
+                return
+            self._save_checkpoint(task_id, rec, raw)
+            self._evict()
+
+    def checkpoint(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """The task's last checkpoint, or None (never checkpointed, finished, or evicted)."""
+        with self._lock:
+            if self._lookup(task_id) is None:
+                return None
+            raw = self._load_checkpoint(task_id)
+        return json.loads(raw) if raw is not None else None
+
+    def trace(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """The task's recorded trace ({trace_id, spans}), or None."""
+        with self._lock:
+            if self._lookup(task_id) is None:
+                return None
+            raw = self._load_trace(task_id)
+        return json.loads(raw) if raw is not None else None
+
+    def pipeline(self, task_id: str) -> Optional[List[Dict[str, Any]]]:
+        """The task's live pipeline list (steps get executed_by etc. written into it)."""
+        with self._lock:
+            rec = self._lookup(task_id)
+            return rec['pipeline'] if rec is not None else None
+
+    def owner(self, task_id: str) -> Optional[str]:
+        with self._lock:
+            rec = self._lookup(task_id)
+            return rec['owner'] if rec is not None else None
+
+    def status(self, task_id: str) -> Optional[str]:
+        with self._lock:
+            rec = self._lookup(task_id)
+            return rec['status'] if rec is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'tasks': len(self._index),
+                'active': sum(1 for r in self._index.values() if r['status'] not in FINAL_STATUSES),
+                'max_tasks': self.max_tasks,
+                'ttl': self.ttl,
+                'result_bytes': self._result_bytes,
+                'max_result_bytes': self.max_result_bytes,
+                'evictions': self.evictions,
+                'expired': self.expired,
+            }
+
+    # ---- 索引维护（调用方持有 self._lock） ----
+    def _is_expired(self, rec: Dict[str, Any], now: float) -> bool:
+        return bool(self.ttl) and rec['status'] in FINAL_STATUSES and now - rec['updated'] > self.ttl
+
+    def _lookup(self, task_id: str) -> Optional[Dict[str, Any]]:
+        rec = self._index.get(task_id)
+        if rec is None:
+            rec = self._load(task_id)
+            if rec is None:
+                return None
+            self._index[task_id] = rec
+        if self._is_expired(rec, time.time()):
+            self._drop(task_id)
+            self._delete(task_id)
+            self.expired += 1
+            return None
+        self._index.move_to_end(task_id)
+        self._evict()
+        return self._index.get(task_id, rec)
+
+    def _drop(self, task_id: str) -> None:
+        self._index.pop(task_id, None)
+        for store in (self._results, self._checkpoints, self._traces):
+            raw = store.pop(task_id, None)
+            if raw is not None:
+                self._result_bytes -= len(raw)
+
+    def _expire(self, now: float) -> None:
+        for task_id, rec in list(self._index.items()):
+            if self._is_expired(rec, now):
+                self._drop(task_id)
+                self._delete(task_id)
+                self.expired += 1
+
+    def _evict(self) -> None:
+        if len(self._index) <= self.max_tasks and self._result_bytes <= self.max_result_bytes:
+            return
+        for task_id, rec in list(self._index.items()):
+            if len(self._index) <= self.max_tasks and self._result_bytes <= self.max_result_bytes:
+                break
+            if rec['status'] in FINAL_STATUSES:
+                self._drop(task_id)
+                self.evictions += 1
+
+    # ---- 存储钩子：内存实现中结果只放在 self._results ----
+    def _save_new(self, task_id: str, rec: Dict[str, Any]) -> None:
+        pass
+
+    def _save_final(self, task_id: str, rec: Dict[str, Any]) -> None:
+        pass
+
+    def _save_result(self, task_id: str, raw: str) -> None:
+        old = self._results.get(task_id)
+        if old is not None:
+            self._result_bytes -= len(old)
+        self._results[task_id] = raw
+        self._result_bytes += len(raw)
+
+    def _save_checkpoint(self, task_id: str, rec: Dict[str, Any], raw: Optional[str]) -> None:
+        """raw=None deletes the checkpoint."""
+        old = self._checkpoints.pop(task_id, None)
+        if old is not None:
+            self._result_bytes -= len(old)
+        if raw is not None:
+            self._checkpoints[task_id] = raw
+            self._result_bytes += len(raw)
+
+    def _save_trace(self, task_id: str, raw: str) -> None:
+        old = self._traces.get(task_id)
+        if old is not None:
+            self._result_bytes -= len(old)
+        self._traces[task_id] = raw
+        self._result_bytes += len(raw)
+
+    def _load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return None
+
+    def _load_result(self, task_id: str) -> Optional[str]:
+        return self._results.get(task_id)
+
+    def _load_checkpoint(self, task_id: str) -> Optional[str]:
+        return self._checkpoints.get(task_id)
+
+    def _load_trace(self, task_id: str) -> Optional[str]:
+        return self._traces.get(task_id)
+
+    def _delete(self, task_id: str) -> None:
+        pass
+
+
+class SQLiteTaskStore(MemoryTaskStore):
+    """Tasks persisted in SQLite; memory caches active tasks and recently read records.
+
+    Tasks still queued/running when the node stopped are marked failed on startup; their
+    checkpoints are kept, so they can be resumed.
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path: str, max_tasks: int = 100000, ttl: float = 7 * 24 * 3600, hot_tasks: int = 1000,
+                 prune_every: int = 100):
+        super().__init__(max_tasks=hot_tasks, ttl=ttl, prune_every=prune_every)
+        self.path = path
+        self.max_stored = max(1, max_tasks)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " task_id TEXT PRIMARY KEY, owner TEXT NOT NULL, status TEXT NOT NULL,"
+            " pipeline TEXT NOT NULL, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS tasks_updated ON tasks(updated)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS task_results (task_id TEXT PRIMARY KEY, final_state TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS task_checkpoints (task_id TEXT PRIMARY KEY, checkpoint TEXT NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS task_traces (task_id TEXT PRIMARY KEY, trace TEXT NOT NULL)")
+        cur = self._db.execute(
+            "UPDATE tasks SET status = 'failed', error = ?, updated = ? WHERE status NOT IN ('done', 'failed')",
+            (_dumps({'error': 'node restarted before the task finished'}), time.time()),
+        )
+        self.interrupted = cur.rowcount
+        self._db.commit()
+        self.pruned = 0
+
+    def _save_new(self, task_id, rec):
+        self._db.execute(
+            "INSERT OR REPLACE INTO tasks (task_id, owner, status, pipeline, error, created, updated)"
+            " VALUES (?, ?, ?, ?, NULL, ?, ?)",
+            (task_id, rec['owner'], rec['status'], _dumps(rec['pipeline']), rec['created'], rec['updated']),
+        )
+        self._db.commit()
+
+    def _save_final(self, task_id, rec):
+        self._db.execute(
+            "UPDATE tasks SET status = ?, pipeline = ?, error = ?, updated = ? WHERE task_id = ?",
+            (rec['status'], _dumps(rec['pipeline']), _dumps(rec['error']) if rec.get('error') else None,
+             rec['updated'], task_id),
+        )
+        self._db.commit()
+
+    def _save_result(self, task_id, raw):
+        # 和 _save_final 在同一次 update 中紧接着提交
+        self._db.execute("INSERT OR REPLACE INTO task_results (task_id, final_state) VALUES (?, ?)", (task_id, raw))
+
+    def _save_checkpoint(self, task_id, rec, raw):
+        if raw is None:
+            # 任务成功结束：和 _save_final 在同一次 update 中提交
+            self._db.execute("DELETE FROM task_checkpoints WHERE task_id = ?", (task_id,))
+            return
+        # pipeline 一起保存，重启后仍能看到已完成的 step 由谁执行
+        self._db.execute("UPDATE tasks SET pipeline = ?, updated = ? WHERE task_id = ?",
+                         (_dumps(rec['pipeline']), time.time(), task_id))
+        self._db.execute("INSERT OR REPLACE INTO task_checkpoints (task_id, checkpoint) VALUES (?, ?)", (task_id, raw))
+        self._db.commit()
+
+    def _save_trace(self, task_id, raw):
+        # 和 _save_final 在同一次 update 中紧接着提交
+        self._db.execute("INSERT OR REPLACE INTO task_traces (task_id, trace) VALUES (?, ?)", (task_id, raw))
+
+    def _load(self, task_id):
+        row = self._db.execute(
+            "SELECT owner, status, pipeline, error, created, updated FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'owner': row[0], 'status': row[1], 'pipeline': json.loads(row[2]),
+                'error': json.loads(row[3]) if row[3] else None, 'created': row[4], 'updated': row[5]}
+
+    def _load_result(self, task_id):
+        row = self._db.execute("SELECT final_state FROM task_results WHERE task_id = ?", (task_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _load_checkpoint(self, task_id):
+        row = self._db.execute("SELECT checkpoint FROM task_checkpoints WHERE task_id = ?", (task_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _load_trace(self, task_id):
+        row = self._db.execute("SELECT trace FROM task_traces WHERE task_id = ?", (task_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _delete(self, task_id):
+        self._db.execute("DELETE FROM task_traces WHERE task_id = ?", (task_id,))
+        self._db.execute("DELETE FROM task_checkpoints WHERE task_id = ?", (task_id,))
+        self._db.execute("DELETE FROM task_results WHERE task_id = ?", (task_id,))
+        self._db.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        self._db.commit()
+
+    def _expire(self, now):
+        super()._expire(now)
+        doomed = "SELECT task_id FROM tasks WHERE status IN ('done', 'failed') AND ("
+        args = []
+        if self.ttl:
+            doomed += "updated < ? OR "
+            args.append(now - self.ttl)
+        # 超出条数上限时删除最早结束的任务
+        doomed += ("task_id NOT IN (SELECT task_id FROM tasks ORDER BY updated DESC LIMIT ?))")
+        args.append(self.max_stored)
+        ids = [row[0] for row in self._db.execute(doomed, args).fetchall()]
+        for i in range(0, len(ids), 500):  # SQLite 的参数个数有上限
+            chunk = ids[i:i + 500]
+            marks = ','.join('?' * len(chunk))
+            for table in ('task_results', 'task_checkpoints', 'task_traces', 'tasks'):
+                self._db.execute(f"DELETE FROM {table} WHERE task_id IN ({marks})", chunk)
+        # 磁盘上删掉的任务也要从内存热缓存里移除，否则 /result 还能读到
+        for task_id in ids:
+            self._drop(task_id)
+        self.pruned += len(ids)
+        self._db.commit()
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stored = self._db.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+        stats.update(path=self.path, hot_tasks=stats.pop('max_tasks'), stored=stored, max_tasks=self.max_stored,
+                     pruned=self.pruned, interrupted=self.interrupted)
+        stats.pop('result_bytes')
+        stats.pop('max_result_bytes')
+        return stats
@@ -0,0 +1,9 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# net.py 在导入时读取这些配置：测试不需要真实的 OpenAI key，也不在仓库里写缓存/任务库
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('LLM_CACHE_PATH', '')
+os.environ.setdefault('TASK_STORE', 'memory')
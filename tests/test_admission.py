@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+
+
+def test_queue_full_raises_with_retry_after():
+    ctl = AdmissionController(max_concurrency=1, queue_max=0, queue_timeout=1)
+    ctl.acquire()
+    with pytest.raises(Overloaded) as e:
+        ctl.acquire()
+    assert e.value.reason == 'admission queue full'
+    assert 1 <= e.value.retry_after <= 60
+    assert ctl.stats()['rejected'] == 1
+
+
+def test_queue_timeout():
+    ctl = AdmissionController(max_concurrency=1, queue_max=4, queue_timeout=0.05)
+    ctl.acquire()
+    with pytest.raises(Overloaded) as e:
+        ctl.acquire()
+    assert 'timed out' in e.value.reason
+    assert ctl.stats()['timed_out'] == 1 and ctl.queued == 0
+
+
+def test_unbounded_ignores_queue_limit():
+    ctl = AdmissionController(max_concurrency=1, queue_max=0, queue_timeout=0.01)
+    ctl.acquire()
+    t = threading.Thread(target=ctl.acquire, args=(False,))
+    t.start()
+    while ctl.queued == 0:
+        time.sleep(0.005)
+    ctl.release()
+    t.join(1)
+    assert not t.is_alive() and ctl.running == 1
+
+
+def test_release_hands_slot_to_fairest_user():
+    # heavy 先排了两个，light 后来的一个仍然排在 heavy 的第二个之前
+    ctl = AdmissionController(max_concurrency=1, queue_max=8, queue_timeout=5)
+    ctl.acquire()
+    order = []
+
+    def wait(user):
+        ctl.acquire(user=user)
+        order.append(user)
+
+    threads = []
+    for user in ('heavy', 'heavy', 'light'):
+        threads.append(threading.Thread(target=wait, args=(user,)))
+        threads[-1].start()
+        while ctl.queued < len(threads):
+            time.sleep(0.005)
+    for _ in threads:
+        ctl.release()
+        time.sleep(0.02)
+    for t in threads:
+        t.join(1)
+    assert order == ['heavy', 'light', 'heavy']
+
+
+def test_async_acquire_waits_without_blocking():
+    ctl = AdmissionController(max_concurrency=1, queue_max=4, queue_timeout=5)
+    ctl.acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(ctl.acquire_async())
+        await asyncio.sleep(0.02)
+        assert not waiter.done() and ctl.queued == 1
+        ctl.release()
+        await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(main())
+    assert ctl.running == 1 and ctl.queued == 0
+
+
+def test_execute_step_answers_429_with_retry_after(monkeypatch):
+    import net
+
+    ctl = AdmissionController(max_concurrency=1, queue_max=0)
+    ctl.acquire()
+    monkeypatch.setattr(net, 'ADMISSION', ctl)
+    resp = net.app.test_client().post('/execute_step', json={'op': 'translate_zh', 'state': {}},
+                                      headers={'X-User-Token': 'testtoken123'})
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == str(resp.get_json()['retry_after'])
@@ -0,0 +1,102 @@
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, BreakerBoard, CircuitBreaker, CircuitOpen
+
+import pytest
+
+
+def _breaker(**kw):
+    settings = dict(window=10, min_calls=5, error_rate=0.5, consecutive=3, open_seconds=10, max_open_seconds=40)
+    settings.update(kw)
+    return CircuitBreaker(**settings)
+
+
+def test_opens_after_consecutive_failures():
+    b = _breaker()
+    for _ in range(2):
+        b.record(False, 0.1, 0)
+    assert b.state == CLOSED
+    b.record(False, 0.1, 0)
+    assert b.state == OPEN
+    assert not b.allow(1)
+    assert b.rejected == 1
+
+
+def test_opens_on_error_rate():
+    b = _breaker(consecutive=100)
+    for ok in (True, False, True, False, False):
+        b.record(ok, 0.1, 0)
+    assert b.state == OPEN
+
+
+def test_half_open_probe_closes_or_reopens_with_backoff():
+    b = _breaker()
+    for _ in range(3):
+        b.record(False, 0.1, 0)
+    assert b.retry_in(5) == 5
+    assert b.allow(10) and b.state == HALF_OPEN
+    assert not b.allow(10)  # 只放行一个探测请求
+    b.record(False, 0.1, 10)
+    assert b.state == OPEN and b.retry_in(10) == 20  # 冷却时间翻倍
+    assert b.allow(30)
+    b.record(True, 0.1, 30)
+    assert b.state == CLOSED and b.snapshot(30)["calls"] == 0
+
+
+def test_ignored_call_releases_probe():
+    b = _breaker()
+    for _ in range(3):
+        b.record(False, 0.1, 0)
+    assert b.allow(10)
+    b.record(None, 0.1, 10)
+    assert b.state == HALF_OPEN and b.allow(10)
+
+
+def test_slow_but_successful_peer_opens():
+    b = _breaker(slow_min=1.0)
+    for _ in range(10):
+        b.record(True, 0.5, 0, route="/execute_step")
+    assert b.slow_threshold("/execute_step") == 2.0
+    for _ in range(3):
+        b.record(True, 3.0, 1, route="/execute_step")
+    assert b.state == OPEN
+    assert "slow call" in b.last_error
+
+
+def test_slow_threshold_is_per_route():
+    b = _breaker(slow_min=1.0)
+    for _ in range(10):
+        b.record(True, 0.5, 0, route="/execute_step")
+        b.record(True, 20.0, 0, route="/execute_segment")
+    for _ in range(3):
+        b.record(True, 30.0, 1, route="/execute_segment")
+    assert b.state == CLOSED
+    assert b.slow_threshold("/run_prompt") is None
+
+
+def test_fixed_slow_call_overrides_baseline():
+    b = _breaker(slow_call=1.0)
+    for _ in range(3):
+        b.record(True, 1.5, 0)
+    assert b.state == OPEN
+
+
+def test_board_raises_circuit_open_per_peer():
+    board = BreakerBoard(window=10, min_calls=5, consecutive=1, open_seconds=60)
+    board.record("http://a:1/execute_step", False, 0.1, "HTTP 500")
+    with pytest.raises(CircuitOpen):
+        board.before("http://a:1/execute_segment")
+    board.before("http://b:1/execute_step")
+    assert not board.available("http://a:1/x") and board.available("http://b:1/x")
+    assert board.state("http://a:1")["last_error"] == "HTTP 500"
+
+
+def test_slow_probe_closes_and_moves_baseline():
+    b = _breaker(slow_min=1.0)
+    for _ in range(10):
+        b.record(True, 0.5, 0, route="/execute_step")
+    for _ in range(3):
+        b.record(True, 3.0, 1, route="/execute_step")
+    assert b.state == OPEN
+    assert b.allow(20)
+    b.record(True, 3.0, 20, route="/execute_step")
+    assert b.state == CLOSED
+    assert b.slow_threshold("/execute_step") == 12.0
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+import net
+from net import PipelineError
+
+
+@pytest.fixture
+def steps(monkeypatch):
+    """Fake _run_step: sleeps `delay`, then writes params.set into the state; records what each step saw."""
+    seen = {}
+
+    def run_step(step, state, policy=None):
+        params = step.get('params', {})
+        seen[step['id']] = dict(state)
+        time.sleep(params.get('delay', 0))
+        state.update(params.get('set', {}))
+        return state
+
+    monkeypatch.setattr(net, '_run_step', run_step)
+    return seen
+
+
+def _step(sid, deps=(), delay=0, **values):
+    return {'id': sid, 'op': 'x', 'depends_on': list(deps), 'params': {'delay': delay, 'set': values}}
+
+
+def test_join_applies_deltas_in_pipeline_order(steps):
+    # b 比 c 晚结束，但合并顺序按 pipeline 位置：c 写的 out 最终生效
+    pipeline = [_step('a', a=1), _step('b', ['a'], delay=0.1, out='b'), _step('c', ['a'], out='c'),
+                _step('d', ['b', 'c'])]
+    state = net._run_dag(pipeline, {'init': True})
+    assert state == {'init': True, 'a': 1, 'out': 'c'}
+    assert steps['d']['out'] == 'c'
+
+
+def test_branches_see_only_their_ancestors(steps):
+    pipeline = [_step('a', a=1), _step('b', b=2), _step('c', ['a'], c=3)]
+    net._run_dag(pipeline, {})
+    assert steps['c'] == {'a': 1}
+    assert steps['b'] == {}
+
+
+def test_resume_skips_done_steps_and_saves_progress(steps):
+    saved = []
+    pipeline = [_step('a', a=1), _step('b', ['a'], b=2)]
+    state = net._run_dag(pipeline, {}, deltas={0: {'a': 'resumed'}}, save=saved.append)
+    assert 'a' not in steps
+    assert state == {'a': 'resumed', 'b': 2}
+    assert saved == []  # 最后一步完成后不再保存 checkpoint
+
+
+def test_bad_edges_rejected():
+    with pytest.raises(PipelineError) as e:
+        net._dag_plan([_step('a', ['b']), _step('b', ['a'])])
+    assert e.value.status == 400
+    with pytest.raises(PipelineError):
+        net._dag_plan([_step('a', ['missing'])])
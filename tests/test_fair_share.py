@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from admission import Overloaded
+from fair_share import FairScheduler, TokenBucket, parse_limits
+
+
+def test_parse_limits_defaults_and_bad_values():
+    limits = parse_limits({'weight': 0, 'rate': 'fast', 'max_concurrency': 2})
+    assert limits['weight'] == 0.01
+    assert limits['max_concurrency'] == 2
+    assert limits['rate'] == parse_limits({})['rate']
+
+
+def test_token_bucket_burst_then_refill(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr('fair_share.time.monotonic', lambda: clock[0])
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.take() == 0
+    assert TokenBucket(rate=0, burst=1).take() == 0
+
+
+def test_check_rate_rejects_with_retry_after():
+    fair = FairScheduler(0, {'u': parse_limits({'rate': 0.5, 'burst': 1})})
+    fair.check_rate('u')
+    with pytest.raises(Overloaded) as e:
+        fair.check_rate('u')
+    assert e.value.retry_after == 2 and e.value.reason == 'rate limit exceeded'
+    fair.check_rate('other')  # 每个用户一个桶
+
+
+def test_try_start_caps_concurrency():
+    fair = FairScheduler(0, {'u': parse_limits({'max_concurrency': 1})})
+    fair.try_start('u')
+    with pytest.raises(Overloaded):
+        fair.try_start('u')
+    fair.finish('u')
+    fair.try_start('u')
+
+
+def test_submit_caps_queue():
+    fair = FairScheduler(0, {'u': parse_limits({'max_queued': 1})})
+    fair.submit('u', print)
+    with pytest.raises(Overloaded):
+        fair.submit('u', print)
+    assert fair.queue_depth('u') == 1
+
+
+def test_weighted_fair_order():
+    # 一个 worker：heavy 一次提交三个，light 后提交的一个在 heavy 的第二个之前运行
+    fair = FairScheduler(0)
+    order = []
+    for user in ('heavy', 'heavy', 'heavy', 'light'):
+        fair.submit(user, order.append, user)
+    threading.Thread(target=fair._worker, daemon=True).start()
+    deadline = time.monotonic() + 2
+    while len(order) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert order == ['heavy', 'light', 'heavy', 'heavy']
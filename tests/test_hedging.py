@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from hedging import Hedger
+
+
+def _warm(h, key, delay=0.02, fast=19):
+    """Samples putting the hedge delay at `delay`, plus `fast` unhedged calls in the budget window."""
+    for _ in range(5):
+        h.observe(key, delay)
+    for _ in range(fast):
+        h.run(key, lambda: "fast")
+
+
+def _slow():
+    time.sleep(0.2)
+    return "primary"
+
+
+def test_no_hedging_before_min_samples():
+    h = Hedger(min_samples=20)
+    assert h.run("op", lambda: 1, lambda: 2) == (1, None)
+    assert h.delay("op") is None
+
+
+def test_backup_wins_and_budget_caps_hedges():
+    h = Hedger(percentile=95, budget=0.1, min_samples=5)
+    _warm(h, "op")
+    assert h.run("op", _slow, lambda: "backup") == ("backup", "backup")
+    assert h.run("op", _slow, lambda: "backup") == ("backup", "backup")
+    # 第三次超出 10% 的预算：不发备份，等主请求
+    assert h.run("op", _slow, lambda: "backup") == ("primary", None)
+    stats = h.stats()["keys"]["op"]
+    assert (stats["hedged"], stats["backup_wins"], stats["over_budget"]) == (2, 2, 1)
+
+
+def test_losing_primary_is_recorded_as_censored_sample():
+    h = Hedger(percentile=95, budget=0.5, min_samples=5)
+    _warm(h, "op")
+    before = len(h._latency["op"])
+    h.run("op", _slow, lambda: "backup")
+    samples = list(h._latency["op"])[before:]
+    assert len(samples) == 2  # 备份的耗时 + 主请求的截尾耗时
+    assert max(samples) >= 0.02
+
+
+def test_async_loser_is_cancelled_and_recorded():
+    h = Hedger(percentile=95, budget=0.5, min_samples=5)
+    _warm(h, "op")
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "primary"
+
+    async def fast():
+        return "backup"
+
+    before = len(h._latency["op"])
+    assert asyncio.run(h.arun("op", slow, fast)) == ("backup", "backup")
+    assert cancelled == [True]
+    assert max(list(h._latency["op"])[before:]) >= 0.02
+
+
+def test_primary_error_falls_back_to_backup():
+    h = Hedger(percentile=95, budget=0.5, min_samples=5)
+    _warm(h, "op")
+
+    def broken():
+        time.sleep(0.05)
+        raise RuntimeError("down")
+
+    assert h.run("op", broken, lambda: "backup") == ("backup", "backup")
@@ -0,0 +1,59 @@
+import sqlite3
+
+from llm_cache import LLMCache, cache_key
+
+
+def _cache(tmp_path, **kw):
+    return LLMCache(str(tmp_path / "c.sqlite3"), **kw)
+
+
+def test_key_normalizes_whitespace_and_default_temperature():
+    a = cache_key("m", [{"role": "user", "content": " hi "}])
+    b = cache_key("m", [{"role": "user", "content": "hi"}], temperature=1.0)
+    assert a == b
+    assert a != cache_key("m", [{"role": "user", "content": "hi"}], temperature=0)
+
+
+def test_hit_miss_and_ttl(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("llm_cache.time.time", lambda: clock[0])
+    c = _cache(tmp_path, ttl=10)
+    assert c.get("k") is None
+    c.put("k", "m", {"text": "v"})
+    assert c.get("k") == {"text": "v"}
+    clock[0] += 11
+    assert c.get("k") is None
+    s = c.stats()
+    assert (s["hits"], s["misses"], s["evictions"], s["entries"]) == (1, 2, 1, 0)
+
+
+def test_hits_do_not_commit_until_batch(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("llm_cache.time.time", lambda: clock[0])
+    c = _cache(tmp_path, touch_batch=2)
+    c.put("a", "m", {"text": "a"})
+    c.put("b", "m", {"text": "b"})
+    clock[0] += 5
+    c.get("a")
+    c.get("a")
+    other = sqlite3.connect(c.path)
+    read = lambda k: other.execute("SELECT last_access FROM llm_cache WHERE key=?", (k,)).fetchone()[0]
+    assert read("a") == 1000.0
+    c.get("b")  # 第二个不同的 key 攒满一批
+    assert (read("a"), read("b")) == (1005.0, 1005.0)
+
+
+def test_lru_prune_uses_pending_touches(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("llm_cache.time.time", lambda: clock[0])
+    c = _cache(tmp_path, max_entries=2, prune_every=3)
+    c.put("a", "m", {"text": "a"})
+    clock[0] += 1
+    c.put("b", "m", {"text": "b"})
+    clock[0] += 1
+    assert c.get("a") is not None  # 只在内存里 touch
+    clock[0] += 1
+    c.put("c", "m", {"text": "c"})  # 第三次写入触发裁剪
+    assert c.get("b") is None
+    assert c.get("a") == {"text": "a"}
+    assert c.stats()["entries"] == 2
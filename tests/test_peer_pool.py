@@ -0,0 +1,62 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from peer_pool import PeerSessionPool
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    gate = threading.Event()
+
+    def do_GET(self):
+        if self.path == "/slow":
+            self.gate.wait(5)
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{srv.server_address[1]}"
+    _Handler.gate.set()
+    srv.shutdown()
+
+
+def test_reuses_connection(server):
+    pool = PeerSessionPool(keepalive=60)
+    for _ in range(3):
+        assert pool.get(server + "/").text == "ok"
+    peer = pool.stats()["peers"][server]
+    assert peer["requests"] == 3 and peer["new_connections"] == 1
+
+
+def test_expired_session_closed_after_in_flight_request(server, monkeypatch):
+    pool = PeerSessionPool(keepalive=1)
+    _Handler.gate.clear()
+    result = {}
+    slow = threading.Thread(target=lambda: result.update(r=pool.get(server + "/slow")))
+    slow.start()
+    while not pool._inflight:
+        time.sleep(0.01)
+    old = next(iter(pool._inflight))
+    closed = []
+    monkeypatch.setattr(old, "close", lambda: closed.append(old))
+    pool._peers[server]["last_used"] -= 5  # 让 keep-alive 过期
+    assert pool.get(server + "/").text == "ok"
+    assert pool._peers[server]["session"] is not old
+    assert closed == [] and old in pool._retiring
+    _Handler.gate.set()
+    slow.join(5)
+    assert result["r"].text == "ok"
+    assert closed == [old] and not pool._retiring
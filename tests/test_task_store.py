@@ -0,0 +1,59 @@
+from task_store import MemoryTaskStore, SQLiteTaskStore
+
+
+def _finish(store, task_id, state=None):
+    store.create(task_id, 'tok', [{'op': 'x'}])
+    store.update(task_id, status='done', final_state=state or {'id': task_id})
+
+
+def test_memory_evicts_finished_tasks_only():
+    store = MemoryTaskStore(max_tasks=2)
+    store.create('running', 'tok', [])
+    _finish(store, 'a')
+    _finish(store, 'b')
+    assert store.get('a') is None
+    assert store.status('running') == 'queued'
+    assert store.get('b')['final_state'] == {'id': 'b'}
+    assert store.stats()['evictions'] == 1
+
+
+def test_memory_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('task_store.time.time', lambda: clock[0])
+    store = MemoryTaskStore(ttl=10)
+    _finish(store, 'a')
+    clock[0] += 11
+    assert store.get('a') is None
+    assert store.stats()['expired'] == 1
+
+
+def test_sqlite_survives_restart(tmp_path):
+    path = str(tmp_path / 't.sqlite3')
+    store = SQLiteTaskStore(path)
+    _finish(store, 'a')
+    store.create('b', 'tok', [])
+    store = SQLiteTaskStore(path)
+    assert store.get('a')['final_state'] == {'id': 'a'}
+    assert store.status('b') == 'failed' and store.interrupted == 1
+
+
+def test_sqlite_prune_drops_hot_cache(tmp_path):
+    # 超出 max_tasks 时磁盘上删掉的任务，热缓存里也不能再读到
+    store = SQLiteTaskStore(str(tmp_path / 't.sqlite3'), max_tasks=2, prune_every=4)
+    for task_id in 'abcd':
+        _finish(store, task_id)
+    stats = store.stats()
+    assert stats['stored'] == 2 and stats['tasks'] == 2 and stats['pruned'] == 2
+    assert store.get('a') is None and store.get('b') is None
+    assert store.get('d')['final_state'] == {'id': 'd'}
+
+
+def test_sqlite_ttl_prune_drops_hot_cache(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr('task_store.time.time', lambda: clock[0])
+    store = SQLiteTaskStore(str(tmp_path / 't.sqlite3'), ttl=10, prune_every=2)
+    _finish(store, 'a')
+    clock[0] += 11
+    store.create('b', 'tok', [])  # 第二次 create 触发裁剪
+    assert store.stats()['tasks'] == store.stats()['stored'] == 1
+    assert store.get('a') is None
@@ -0,0 +1,59 @@
+import pytest
+
+import wire_codec
+from wire_codec import JSON, MSGPACK, CodecError, PeerCodecs, decode_body, encode_response
+
+# msgpack / zstandard 是可选依赖
+needs_optional = pytest.mark.skipif(wire_codec.msgpack is None or wire_codec.zstandard is None,
+                                    reason='msgpack and zstandard not installed')
+
+OBJ = {'state': {'poem': '我爱 morven ' * 600, 'n': 3, 'ok': True, 'none': None}, 'list': [1.5, 'x']}
+
+
+class _Resp:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+@needs_optional
+@pytest.mark.parametrize('ctype', [JSON, MSGPACK])
+def test_dumps_loads_round_trip(ctype):
+    assert wire_codec.loads(wire_codec.dumps(OBJ, ctype), ctype) == OBJ
+
+
+@needs_optional
+@pytest.mark.parametrize('enc', ['gzip', 'zstd'])
+def test_compress_round_trip(enc):
+    raw = wire_codec.dumps(OBJ)
+    packed = wire_codec.compress(raw, enc)
+    assert len(packed) < len(raw)
+    assert wire_codec.decompress(packed, enc) == raw
+
+
+@needs_optional
+def test_response_negotiation():
+    body, ctype, headers = encode_response(OBJ, accept=MSGPACK, accept_encoding='zstd, gzip')
+    assert ctype == MSGPACK and headers['Content-Encoding'] == 'zstd'
+    assert decode_body(body, headers['Content-Encoding'], ctype) == OBJ
+    body, ctype, headers = encode_response(OBJ)  # 浏览器：JSON、不压缩
+    assert ctype == JSON and 'Content-Encoding' not in headers
+    assert decode_body(body, None, ctype) == OBJ
+
+
+@needs_optional
+def test_peer_gets_plain_json_until_it_advertises_codecs():
+    codecs = PeerCodecs()
+    url = 'http://peer:5000/execute_step'
+    body, headers = codecs.encode(url, OBJ)
+    assert headers['Content-Type'] == JSON and 'Content-Encoding' not in headers
+    codecs.learn(url, _Resp({wire_codec.CODECS_HEADER: 'json,gzip,msgpack,zstd'}))
+    body, headers = codecs.encode('http://peer:5000/run_prompt', OBJ)
+    assert headers['Content-Type'] == MSGPACK and headers['Content-Encoding'] == 'zstd'
+    assert decode_body(body, headers['Content-Encoding'], headers['Content-Type']) == OBJ
+
+
+def test_malformed_and_unknown_encoding():
+    with pytest.raises(CodecError):
+        wire_codec.loads(b'{not json', JSON)
+    with pytest.raises(CodecError):
+        wire_codec.decompress(b'x', 'br')
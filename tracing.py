@@ -0,0 +1,281 @@
+"""
+Distributed tracing for pipelines (spans across /task, /execute_step, /execute_segment and /run_prompt).
+
+协调节点收到 /task 时创建 trace（或沿用调用方 traceparent 头里的 trace id），之后每一跳都在
+W3C `traceparent` 头里带上 trace id 和发起调用的 span id。对端只在请求带了 traceparent 时记录
+span（接收、反序列化、排队、技能执行、LLM 调用、生成应答），并把这些 span 放在应答的 `spans`
+字段里返回；协调节点把它们合并进自己的 trace，随 /task 应答返回并存入 TASK_STORE。
+
+只有创建 trace 的节点导出它（合并后的完整 trace，不会重复）：TRACE_FILE 写 JSON lines（每行一个
+span），TRACE_OTLP_ENDPOINT 以 OTLP/HTTP JSON 发给 collector。导出在后台线程进行，队列满了就丢弃。
+
+span 的 start 是记录节点的墙钟时间（毫秒），各节点时钟不同步时跨节点的瀑布图会有偏差；
+duration_ms 用单调时钟测量，不受影响。
+"""
+
+import contextvars
+import json
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+TRACEPARENT = "traceparent"
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# 当前 (trace, span_id)；没有 trace 时所有 span() 都是空操作
+_CURRENT: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def parse_traceparent(value: Optional[str]):
+    """(trace_id, parent span_id) from a W3C traceparent header, or None if absent/malformed."""
+    if not value:
+        return None
+    m = _TRACEPARENT_RE.match(value.strip().lower())
+    if m is None or m.group(1) == "0" * 32:
+        return None
+    return m.group(1), m.group(2)
+
+
+class Trace:
+    """Spans one node records for one trace (plus remote spans merged into it)."""
+
+    def __init__(self, node: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+                 name: str = "task", **attrs):
+        self.node = node
+        self.trace_id = trace_id or _new_id(16)
+        # 调用方自己带了 traceparent：只有这时才把 span 放进回复
+        self.remote = trace_id is not None
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        # 根 span 从收到请求开始，finish() 时结束（排队时间也算在内）
+        self.root = self._open(name, parent_id, attrs)
+
+    def _open(self, name: str, parent_id: Optional[str], attrs: Dict[str, Any]) -> Dict[str, Any]:
+        span = {"trace_id": self.trace_id, "span_id": _new_id(8), "parent_id": parent_id, "name": name,
+                "node": self.node, "start": round(time.time() * 1000, 3), "_t0": time.perf_counter()}
+        if attrs:
+            span["attrs"] = dict(attrs)
+        return span
+
+    def _close(self, span: Dict[str, Any], error: Optional[str] = None) -> None:
+        span["duration_ms"] = round((time.perf_counter() - span.pop("_t0")) * 1000, 3)
+        if error:
+            span["error"] = error
+        with self._lock:
+            self.spans.append(span)
+
+    def waited(self, name: str = "queue") -> None:
+        """Record a span from the root span's start until now (e.g. the wait for a task worker)."""
+        span = self._open(name, self.root["span_id"], {})
+        span["start"], span["_t0"] = self.root["start"], self.root["_t0"]
+        self._close(span)
+
+    def merge(self, spans) -> None:
+        """Add spans recorded by a peer for this trace."""
+        if not isinstance(spans, list):
+            return
+        spans = [s for s in spans if isinstance(s, dict) and s.get("trace_id") == self.trace_id]
+        with self._lock:
+            self.spans.extend(spans)
+
+    def finish(self, error: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Close the root span; returns every span ordered by start time."""
+        if "_t0" in self.root:
+            self._close(self.root, error)
+        with self._lock:
+            return sorted(self.spans, key=lambda s: (s.get("start", 0), s is not self.root))
+
+
+class JsonlExporter:
+    """Append each span as one JSON line to `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def _otlp_value(v: Any) -> Dict[str, Any]:
+    if isinstance(v, bool):
+        return {"boolValue": v}
+    if isinstance(v, int):
+        return {"intValue": str(v)}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    return {"stringValue": str(v)}
+
+
+class OtlpExporter:
+    """POST spans to an OTLP/HTTP collector as JSON (`<endpoint>/v1/traces`), one resource per node."""
+
+    def __init__(self, endpoint: str, service: str = "echonet", timeout: float = 5.0):
+        self.url = endpoint.rstrip("/")
+        if not self.url.endswith("/v1/traces"):
+            self.url += "/v1/traces"
+        self.service = service
+        self.timeout = timeout
+
+    def _span(self, s: Dict[str, Any]) -> Dict[str, Any]:
+        start = int(s["start"] * 1e6)
+        out = {
+            "traceId": s["trace_id"],
+            "spanId": s["span_id"],
+            "name": s["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start),
+            "endTimeUnixNano": str(start + int(s.get("duration_ms", 0) * 1e6)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in (s.get("attrs") or {}).items()],
+            "status": {"code": 2, "message": s["error"]} if s.get("error") else {"code": 1},
+        }
+        if s.get("parent_id"):
+            out["parentSpanId"] = s["parent_id"]
+        return out
+
+    def export(self, spans: List[Dict[str, Any]]) -> None:
+        import requests
+
+        by_node: Dict[str, List[Dict[str, Any]]] = {}
+        for s in spans:
+            by_node.setdefault(s.get("node") or "unknown", []).append(self._span(s))
+        body = {"resourceSpans": [
+            {"resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}},
+                                         {"key": "service.instance.id", "value": {"stringValue": node}}]},
+             "scopeSpans": [{"scope": {"name": "echonet"}, "spans": node_spans}]}
+            for node, node_spans in by_node.items()
+        ]}
+        requests.post(self.url, json=body, timeout=self.timeout).raise_for_status()
+
+
+class Tracer:
+    """Creates traces, records spans in the current context and exports finished traces."""
+
+    def __init__(self, node: str, enabled: bool = True, exporters=(), queue_max: int = 1000):
+        self.node = node
+        self.enabled = enabled
+        self.exporters = list(exporters)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_max)
+        self._thread: Optional[threading.Thread] = None
+        self._thread_lock = threading.Lock()
+        self.traces = 0
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    # ---- trace 生命周期 ----
+    def start(self, traceparent: Optional[str] = None, name: str = "task", **attrs) -> Optional[Trace]:
+        """A new trace for a task (continuing the caller's trace id if it sent one); None when disabled."""
+        if not self.enabled:
+            return None
+        parent = parse_traceparent(traceparent)
+        self.traces += 1
+        if parent is None:
+            return Trace(self.node, name=name, **attrs)
+        return Trace(self.node, parent[0], parent[1], name=name, **attrs)
+
+    def join(self, traceparent: Optional[str], name: str, **attrs) -> Optional[Trace]:
+        """Peer side: record spans only when the caller is tracing this request."""
+        parent = parse_traceparent(traceparent) if self.enabled else None
+        if parent is None:
+            return None
+        return Trace(self.node, parent[0], parent[1], name=name, **attrs)
+
+    @contextmanager
+    def activate(self, trace: Optional[Trace]):
+        """Make `trace` (its root span as parent) current for the block."""
+        if trace is None:
+            yield None
+            return
+        token = _CURRENT.set((trace, trace.root["span_id"]))
+        try:
+            yield trace
+        finally:
+            _CURRENT.reset(token)
+
+    def finish(self, trace: Optional[Trace], error: Optional[str] = None, export: bool = True):
+        """Close the trace; returns {trace_id, spans} (None without a trace) and queues the export."""
+        if trace is None:
+            return None
+        spans = trace.finish(error)
+        if export and self.exporters:
+            self._export(spans)
+        return {"trace_id": trace.trace_id, "spans": spans}
+
+    # ---- span ----
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Record a child span of the current one; yields its attrs dict (or None when not tracing)."""
+        cur = _CURRENT.get()
+        if cur is None:
+            yield None
+            return
+        trace, parent_id = cur
+        span = trace._open(name, parent_id, attrs)
+        span.setdefault("attrs", {})
+        token = _CURRENT.set((trace, span["span_id"]))
+        error = None
+        try:
+            yield span["attrs"]
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _CURRENT.reset(token)
+            if not span["attrs"]:
+                del span["attrs"]
+            trace._close(span, error)
+
+    def current(self) -> Optional[Trace]:
+        cur = _CURRENT.get()
+        return cur[0] if cur is not None else None
+
+    def headers(self, headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """`headers` plus a traceparent naming the current span as the parent of the remote work."""
+        cur = _CURRENT.get()
+        if cur is None:
+            return headers if headers is not None else {}
+        headers = dict(headers or {})
+        headers[TRACEPARENT] = f"00-{cur[0].trace_id}-{cur[1]}-01"
+        return headers
+
+    def merge(self, spans) -> None:
+        trace = self.current()
+        if trace is not None and spans:
+            trace.merge(spans)
+
+    # ---- 导出（后台线程，不阻塞请求） ----
+    def _export(self, spans: List[Dict[str, Any]]) -> None:
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            spans = self._queue.get()
+            for exporter in self.exporters:
+                try:
+                    exporter.export(spans)
+                except Exception as e:
+                    self.export_errors += 1
+                    print(f"⚠️ trace export to {type(exporter).__name__} failed: {e}")
+            self.exported += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "exporters": [type(e).__name__ for e in self.exporters],
+                "traces": self.traces, "exported": self.exported, "queued": self._queue.qsize(),
+                "dropped": self.dropped, "export_errors": self.export_errors}
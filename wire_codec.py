@@ -0,0 +1,191 @@
+"""
+Negotiated wire codec for node-to-node traffic.
+
+- 格式：JSON（默认，浏览器前端始终走 JSON）或 MessagePack（application/msgpack）。
+- 压缩：超过 WIRE_COMPRESS_MIN_BYTES 的请求/响应体用 zstd 或 gzip 压缩（Content-Encoding）。
+- 协商：服务端在每个响应里带上 X-Echo-Codecs（它能解码的格式/压缩算法）。客户端对一个新对端
+  先发普通 JSON，看到这个头之后才改用 MessagePack/压缩发送请求体；响应格式由 Accept /
+  Accept-Encoding 决定，所以旧节点和浏览器都不受影响。
+
+msgpack 与 zstandard 都是可选依赖，缺失时自动退回 JSON / gzip。
+"""
+
+import gzip
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+try:
+    import urllib3.response as _urllib3_response
+    _URLLIB3_DECODES_ZSTD = bool(getattr(_urllib3_response, "HAS_ZSTD", False))
+except Exception:
+    _URLLIB3_DECODES_ZSTD = False
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+_MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+CODECS_HEADER = "X-Echo-Codecs"
+
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "msgpack")
+WIRE_COMPRESSION = os.getenv("WIRE_COMPRESSION", "zstd")
+WIRE_COMPRESS_MIN_BYTES = int(os.getenv("WIRE_COMPRESS_MIN_BYTES", "4096"))
+
+
+class CodecError(ValueError):
+    """The body could not be decoded (unsupported type/encoding or malformed)."""
+
+
+def supported_codecs():
+    codecs = ["json", "gzip"]
+    if msgpack is not None:
+        codecs.append("msgpack")
+    if zstandard is not None:
+        codecs.append("zstd")
+    return codecs
+
+
+# ---------- primitives ----------
+def dumps(obj: Any, content_type: str = JSON) -> bytes:
+    if content_type in _MSGPACK_TYPES:
+        if msgpack is None:
+            raise CodecError("msgpack not installed")
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(raw: bytes, content_type: Optional[str] = JSON) -> Any:
+    ctype = (content_type or JSON).split(";")[0].strip().lower()
+    try:
+        if ctype in _MSGPACK_TYPES:
+            if msgpack is None:
+                raise CodecError("msgpack not installed")
+            return msgpack.unpackb(raw, raw=False)
+        if not raw:
+            return None
+        return json.loads(raw.decode("utf-8"))
+    except CodecError:
+        raise
+    except Exception as e:
+        raise CodecError(f"malformed {ctype} body: {e}")
+
+
+def compress(raw: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    if encoding == "gzip":
+        return gzip.compress(raw, compresslevel=5)
+    return raw
+
+
+def decompress(raw: bytes, encoding: Optional[str]) -> bytes:
+    encoding = (encoding or "identity").strip().lower()
+    if encoding in ("identity", ""):
+        return raw
+    if encoding == "gzip":
+        return gzip.decompress(raw)
+    if encoding == "zstd":
+        if zstandard is None:
+            raise CodecError("zstd not supported on this node")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(raw)
+    raise CodecError(f"unsupported Content-Encoding {encoding}")
+
+
+def _pick_encoding(accept_encoding: str, allowed=None) -> Optional[str]:
+    accepted = {a.split(";")[0].strip().lower() for a in (accept_encoding or "").split(",")}
+    prefs = ["zstd", "gzip"] if WIRE_COMPRESSION == "zstd" else ["gzip"] if WIRE_COMPRESSION == "gzip" else []
+    for enc in prefs:
+        if enc in accepted and (allowed is None or enc in allowed) and (enc != "zstd" or zstandard is not None):
+            return enc
+    return None
+
+
+# ---------- server side (Flask; encode_response / decode_body also serve net_async.py) ----------
+def decode_body(raw: bytes, content_encoding: Optional[str], content_type: Optional[str]) -> Any:
+    return loads(decompress(raw, content_encoding), content_type)
+
+
+def decode_request(req) -> Any:
+    """Decode a Flask request body according to Content-Encoding / Content-Type."""
+    return decode_body(req.get_data(cache=True), req.headers.get("Content-Encoding"), req.headers.get("Content-Type"))
+
+
+def encode_response(obj: Any, accept: str = "", accept_encoding: Optional[str] = None) -> Tuple[bytes, str, Dict[str, str]]:
+    """Return (body, content type, headers) for a reply to a caller with these Accept headers.
+
+    accept_encoding=None means the response is never compressed.
+    """
+    ctype = MSGPACK if msgpack is not None and any(t in accept for t in _MSGPACK_TYPES) else JSON
+    body = dumps(obj, ctype)
+    headers = {CODECS_HEADER: ",".join(supported_codecs()), "Vary": "Accept, Accept-Encoding"}
+    if len(body) >= WIRE_COMPRESS_MIN_BYTES and accept_encoding is not None:
+        enc = _pick_encoding(accept_encoding)
+        if enc:
+            body = compress(body, enc)
+            headers["Content-Encoding"] = enc
+    return body, ctype, headers
+
+
+def make_response(obj: Any, status: int = 200, req=None):
+    """Encode `obj` for the caller: MessagePack only if Accept asks for it, else JSON."""
+    from flask import Response
+
+    accept = req.headers.get("Accept", "") if req is not None else ""
+    accept_encoding = req.headers.get("Accept-Encoding", "") if req is not None else None
+    body, ctype, headers = encode_response(obj, accept, accept_encoding)
+    return Response(body, status=status, content_type=ctype, headers=headers)
+
+
+# ---------- client side (requests) ----------
+class PeerCodecs:
+    """Remembers which codecs each peer advertised via X-Echo-Codecs."""
+
+    def __init__(self):
+        self._peers: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _base(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def learn(self, url: str, resp) -> None:
+        advertised = resp.headers.get(CODECS_HEADER)
+        if advertised is None:
+            return
+        with self._lock:
+            self._peers[self._base(url)] = {c.strip() for c in advertised.split(",") if c.strip()}
+
+    def encode(self, url: str, obj: Any) -> Tuple[bytes, Dict[str, str]]:
+        """Return (body, headers) for a request to `url`, using what the peer is known to accept."""
+        with self._lock:
+            peer = self._peers.get(self._base(url), set())
+        ctype = MSGPACK if WIRE_FORMAT == "msgpack" and msgpack is not None and "msgpack" in peer else JSON
+        body = dumps(obj, ctype)
+        headers = {"Content-Type": ctype, "Accept": f"{MSGPACK}, {JSON};q=0.9" if msgpack is not None else JSON}
+        encodings = ["gzip"] + (["zstd"] if zstandard is not None else [])
+        headers["Accept-Encoding"] = ", ".join(reversed(encodings))
+        if len(body) >= WIRE_COMPRESS_MIN_BYTES:
+            enc = _pick_encoding(",".join(peer), allowed=peer)
+            if enc:
+                body = compress(body, enc)
+                headers["Content-Encoding"] = enc
+        return body, headers
+
+
+def decode_response(resp) -> Any:
+    """Decode a requests.Response produced by `make_response` (or a plain JSON peer)."""
+    raw = resp.content
+    # urllib3 已经解过 gzip；zstd 只有在较新的 urllib3 下才会自动解
+    if (resp.headers.get("Content-Encoding") or "").strip().lower() == "zstd" and not _URLLIB3_DECODES_ZSTD:
+        raw = decompress(raw, "zstd")
+    return loads(raw, resp.headers.get("Content-Type"))